@@ -15,6 +15,7 @@ import datetime
 import time
 import csv
 import googletrans
+from TranslationCache import TranslationCache
 
 #time on the website is listed in Egypt time
 from pytz import timezone
@@ -26,8 +27,8 @@ print("Start Time: {}".format(datecur))
 start_time = time.time()
 
 # open the sqlite and set the connection on the database
-import sqlite3
-conn = sqlite3.connect("egyptOLX.db")
+from ScrapeDatabase import connect_db
+conn = connect_db("egyptOLX.db")
 c = conn.cursor()
 
 #import the key dataset
@@ -65,10 +66,21 @@ def combine_data():
      
 unprocdata = combine_data() 
 
+#FUNCTION:  returns the descriptions in English, the ones not translated by the scraper go through the translation cache
+#(shared with ScrapeEgyptOLX_cloudv2.py) so a description stored at every revisit of an ad is only translated once
+def translate_descriptions(data):
+    translationcache = TranslationCache('egyptOLX_translations.db', googletrans.Translator())
+    #the line breaks of the description were stored as '>'
+    descriptions = [desc.decode('utf-8').replace('>','\n') if isinstance(desc, bytes) else desc for desc in data['description']]
+    totranslate = [desc if lang != 'EN' else np.nan for desc, lang in zip(descriptions, data['textlanguage'])]
+    translated = translationcache.translate_many(totranslate)
+    print(translationcache.report())
+    translationcache.close()
+    return([desc if lang == 'EN' else trans for desc, trans, lang in zip(descriptions, translated, data['textlanguage'])])
+
 def clean_data(data):
-    translator = googletrans.Translator()
     print(data['description'].value_counts())
-    data['description_english'] = [translator.translate(desc).text for desc in data['description'].decode('utf-8')]
+    data['description_english'] = translate_descriptions(data)
     print(data['description_english'].head(50))
     data['bachelor_degree'] = [1 if row in ['Bachelors Degree','Masters Degree','PhD'] else 0 for row in data['educationlevel']]
     data['fulltime'] = [1 if row in ['Full-time'] else 0 for row in data['type']]
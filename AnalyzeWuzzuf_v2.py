@@ -25,8 +25,8 @@ import nltk
 import time
 import re
 
-import sqlite3
-conn = sqlite3.connect("wuzzuf.db")
+from ScrapeDatabase import connect_db
+conn = connect_db("wuzzuf.db")
 c = conn.cursor()
 
 start_time = time.time()
@@ -0,0 +1,83 @@
+###############################################################################################################
+# Benchmark the job page parsing in ParsePages.py on saved pages
+#
+# Parses the same set of saved pages with the original setup (pure python html.parser building the whole
+# document) and with the configured backend and targeted parsing, and reports pages parsed per second for each.
+# It also checks that both setups produce the same rows.
+#
+# Pages are read from a page store written with --store-pages, or from a directory of saved .html files:
+#   python BenchmarkParsers.py --site olx --pagestore egyptOLX_pages.db
+#   python BenchmarkParsers.py --site wuzzuf --fixtures tests/fixtures/wuzzuf
+#
+# tests/fixtures has a few saved OLX ad pages and Wuzzuf job pages (the figures on them are in the README).
+###############################################################################################################
+
+import os
+import sys
+import time
+import datetime
+import argparse
+
+import ParsePages
+from PageStore import PageStore
+
+argparser = argparse.ArgumentParser(description='Benchmark the job page parsing on saved pages')
+argparser.add_argument('--site', choices=['olx', 'wuzzuf'], required=True)
+argparser.add_argument('--pagestore', help='page store to read the saved job pages from')
+argparser.add_argument('--fixtures', help='directory of saved .html job pages')
+argparser.add_argument('--limit', type=int, default=1000, help='maximum number of pages to parse')
+argparser.add_argument('--repeat', type=int, default=3, help='number of times to parse each page')
+args = argparser.parse_args()
+
+#FUNCTION: loads up to limit saved job pages for the site
+def load_pages():
+    pages = []
+    if args.fixtures is not None:
+        for filename in sorted(os.listdir(args.fixtures)):
+            if filename.endswith('.html'):
+                with open(os.path.join(args.fixtures, filename), 'rb') as file:
+                    pages.append(file.read())
+    elif args.pagestore is not None:
+        store = PageStore(args.pagestore)
+        urlprefix = 'https://olx.com.eg/en/ad/' if args.site == 'olx' else 'https://wuzzuf.net/'
+        for url, fetchtime, status, body in store.iter_fetches(urlprefix):
+            if status == 200 and '/search/' not in url:
+                pages.append(body)
+            if len(pages) >= args.limit:
+                break
+        store.close()
+    else:
+        sys.exit("Give either --pagestore or --fixtures")
+    return(pages[:args.limit])
+
+#FUNCTION: parses every page repeat times and returns the rows and the number of pages parsed per second
+def run_parser(pages, parser, targetedparsing):
+    ParsePages.parser = parser
+    ParsePages.targetedparsing = targetedparsing
+    datetimecur = datetime.datetime(2018, 1, 1, 0, 0)
+    rows = []
+    start_time = time.perf_counter()
+    for r in range(args.repeat):
+        rows = []
+        for page in pages:
+            if args.site == 'olx':
+                rows.append(ParsePages.parse_OLXJobData(None, None, page, datetimecur))
+            else:
+                rows.append(ParsePages.parse_WuzzufJobData(None, None, page, datetimecur))
+    elapsed = time.perf_counter() - start_time
+    return(rows, len(pages)*args.repeat/elapsed)
+
+pages = load_pages()
+print("Pages loaded: {}".format(len(pages)))
+if len(pages) == 0:
+    sys.exit()
+
+backend = ParsePages.parser
+baserows, baserate = run_parser(pages, 'html.parser', False)
+print("html.parser, full document: {} pages/second".format(round(baserate, 1)))
+newrows, newrate = run_parser(pages, backend, True)
+print("{}, targeted parsing: {} pages/second ({}x)".format(backend, round(newrate, 1), round(newrate/baserate, 2)))
+
+#NaN values do not compare equal so compare the printed rows
+mismatches = sum(1 for a, b in zip(baserows, newrows) if repr(list(a)) != repr(list(b)))
+print("Pages where the rows differ: {}".format(mismatches))
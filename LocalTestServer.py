@@ -0,0 +1,66 @@
+###############################################################################################################
+# Stand-in web server that serves the pages kept in a page store
+#
+# Serves the latest stored copy of every page of a site (written by a scraper run with --store-pages) so that the
+# scrapers can be run end to end without making any requests to the real website, e.g. to try out a sharded crawl
+# with several worker processes on one machine:
+#
+#   python LocalTestServer.py --pagestore egyptOLX_pages.db --port 8000
+#   python ScrapeEgyptOLX_cloudv2.py --base-url http://127.0.0.1:8000 --shard 0/2
+#   python ScrapeEgyptOLX_cloudv2.py --base-url http://127.0.0.1:8000 --shard 1/2
+#   python MergeOLXShards.py egyptOLX_shard0.db egyptOLX_shard1.db
+#
+# Pages that were never stored are answered with a 404, as the website does for an ad that was taken down.
+###############################################################################################################
+
+import time
+import argparse
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from PageStore import PageStore
+
+argparser = argparse.ArgumentParser(description='Serve the pages kept in a page store in place of the website')
+argparser.add_argument('--pagestore', default='egyptOLX_pages.db', help='page store to serve the pages from')
+argparser.add_argument('--site', default='https://olx.com.eg', help='site the pages were fetched from')
+argparser.add_argument('--port', type=int, default=8000)
+argparser.add_argument('--latency', type=float, default=0.0, help='seconds to wait before answering each request')
+args = argparser.parse_args()
+
+pagestore = PageStore(args.pagestore)
+stats = {'served': 0, 'notfound': 0}
+
+
+class PageStoreHandler(BaseHTTPRequestHandler):
+
+    #answer on keep-alive connections like the website does
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        if args.latency > 0:
+            time.sleep(args.latency)
+        page = pagestore.get_latest(args.site + self.path)
+        if page is None:
+            stats['notfound'] += 1
+            status, body = 404, b''
+        else:
+            stats['served'] += 1
+            status, body = page
+        self.send_response(status)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+server = ThreadingHTTPServer(('127.0.0.1', args.port), PageStoreHandler)
+print("Serving {} from {} on http://127.0.0.1:{}".format(args.site, args.pagestore, args.port))
+try:
+    server.serve_forever()
+except KeyboardInterrupt:
+    pass
+server.server_close()
+pagestore.close()
+print("Pages served: {}, not found: {}".format(stats['served'], stats['notfound']))
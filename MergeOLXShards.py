@@ -0,0 +1,142 @@
+###############################################################################################################
+# Merge the shard databases of a sharded OLX crawl into egyptOLX.db
+#
+# With --shard i/n each worker node crawls its own hash-partition of the subregions and ads (see
+# ScrapeEgyptOLX_cloudv2.py) into egyptOLX_shard<i>.db, which starts out as a copy of egyptOLX.db.  This script adds
+# the rows of each shard to egyptOLX.db:
+#
+#   - rows are added with INSERT OR IGNORE, so the rows a shard copied from egyptOLX.db are skipped
+#   - a row whose key is already in egyptOLX.db with other values is a conflict (e.g. an ad fetched by two shards on
+#     the same day).  The row already in egyptOLX.db is kept and the conflicts are reported for each table.
+#   - jobadlistings keeps the earliest firstseen and latest lastseen of each listing over the shards, and ads seen
+#     in a listing again are taken out of jobadinferredclosed
+#   - regionjobadchanges and regionjobadlatest are filled by the trigger on regionjobadcounts, jobadclosed by the
+#     trigger on deltajobadpagedata and crawlfrontier is the work list of each shard, so these are not copied
+#   - regionadcounts, regionjobadcounts, jobadpageurls and jobadpagedata are merged through their views, as the ids of
+#     the dimension tables differ between the shards, so the fact and dimension tables are not copied (nor textstore,
+#     which the trigger on jobadpagedata fills with the texts of the rows added, nor the base and delta tables that
+#     the trigger on factjobadpagedata fills)
+#
+# Once all of the shards are merged each shard is overwritten with a copy of egyptOLX.db (unless --keep-shards), so
+# that the next day's crawl of every shard knows the subregions, ads and visits the other shards found.  A shard
+# left behind would not revisit the ads that fall in it but were found by another shard's listings, and the shard
+# that found them leaves them out as they are not in its part, so they would not be fetched again by any shard.
+# Merge the shards once all of the day's runs of every shard are done.
+#
+#   python MergeOLXShards.py egyptOLX_shard0.db egyptOLX_shard1.db egyptOLX_shard2.db
+###############################################################################################################
+
+import argparse
+
+from ScrapeDatabase import connect_db
+from OLXDatabaseConversion import dimtables, viewtables, deltatables
+
+argparser = argparse.ArgumentParser(description='Merge the shard databases of a sharded OLX crawl into egyptOLX.db')
+argparser.add_argument('shards', nargs='+', help='shard databases written with --shard')
+argparser.add_argument('--db', default='egyptOLX.db', help='database the shards are merged into')
+argparser.add_argument('--examples', type=int, default=3, help='number of conflicting keys printed for each table')
+argparser.add_argument('--keep-shards', action='store_true', help='leave the shards as they are rather than overwriting them with a copy of the merged database')
+args = argparser.parse_args()
+
+#tables that are not copied from the shards (each shard is migrated along with egyptOLX.db it was copied from)
+skiptables = ['crawlfrontier', 'schemaversion', 'textstore'] + dimtables + ['fact'+t for t in viewtables] + deltatables
+#tables kept up to date by triggers on the other tables, only copied if the database has no such trigger
+triggertables = {'regionjobadchanges': 'regionjobadcounts', 'regionjobadlatest': 'regionjobadcounts', 'jobadclosed': 'deltajobadpagedata'}
+#the order rows are added in, so that the trigger on regionjobadcounts sees the counts in the order they were taken
+tableorder = {'regionjobadcounts': 'downloaddate, downloadtime'}
+
+#FUNCTION: returns the columns and the primary key columns of a table (for a view those of the table it replaced)
+def get_columns(c, schema, table):
+    info = c.execute('''PRAGMA {}.table_info({});'''.format(schema, table)).fetchall()
+    columns = [row[1] for row in info]
+    keys = [row[1] for row in sorted(info, key=lambda row: row[5]) if row[5] > 0]
+    if table in viewtables:
+        keys = viewtables[table]
+    return(columns, keys)
+
+#FUNCTION: returns the tables of the shard that are to be merged
+def get_tables(c):
+    query = '''SELECT name FROM shard.sqlite_master WHERE type IN ('table', 'view') AND name NOT LIKE 'sqlite_%' AND name IN (SELECT name FROM main.sqlite_master WHERE type IN ('table', 'view')) ORDER BY name;'''
+    tables = []
+    for (table,) in c.execute(query).fetchall():
+        if table in skiptables:
+            continue
+        if table in triggertables:
+            query = '''SELECT COUNT(*) FROM main.sqlite_master WHERE type = 'trigger' AND tbl_name = ?;'''
+            if c.execute(query, (triggertables[table],)).fetchall()[0][0] > 0:
+                continue
+        tables.append(table)
+    return(tables)
+
+#FUNCTION: brings the rows of a table that the shards update in place (rather than only add) up to date
+def reconcile_table(c, table):
+    if table == 'jobadlistings':
+        query = '''UPDATE main.jobadlistings SET
+            firstseen = MIN(firstseen, (SELECT s.firstseen FROM shard.jobadlistings s WHERE s.uniqueadid = jobadlistings.uniqueadid AND s.fsubreg = jobadlistings.fsubreg AND s.jobsector = jobadlistings.jobsector)),
+            lastseen = MAX(lastseen, (SELECT s.lastseen FROM shard.jobadlistings s WHERE s.uniqueadid = jobadlistings.uniqueadid AND s.fsubreg = jobadlistings.fsubreg AND s.jobsector = jobadlistings.jobsector))
+            WHERE EXISTS (SELECT 1 FROM shard.jobadlistings s WHERE s.uniqueadid = jobadlistings.uniqueadid AND s.fsubreg = jobadlistings.fsubreg AND s.jobsector = jobadlistings.jobsector);'''
+        c.execute(query)
+    elif table == 'jobadinferredclosed':
+        #the status found by the shard that fetched the ad to confirm it is closed
+        query = '''UPDATE main.jobadinferredclosed SET confirmstatus = (SELECT s.confirmstatus FROM shard.jobadinferredclosed s WHERE s.uniqueadid = jobadinferredclosed.uniqueadid)
+            WHERE confirmstatus IS NULL AND EXISTS (SELECT 1 FROM shard.jobadinferredclosed s WHERE s.uniqueadid = jobadinferredclosed.uniqueadid AND s.confirmstatus IS NOT NULL);'''
+        c.execute(query)
+
+#FUNCTION: adds the rows of one table of the shard and returns the number of rows added and the conflicting keys
+def merge_table(c, table):
+    columns, keys = get_columns(c, 'main', table)
+    columnlist = ', '.join(columns)
+    query = '''INSERT OR IGNORE INTO main.{} ({}) SELECT {} FROM shard.{}'''.format(table, columnlist, columnlist, table)
+    if table in tableorder:
+        query = query + ''' ORDER BY {}'''.format(tableorder[table])
+    #counted rather than taken from rowcount, which is 0 for an insert into a view
+    countquery = '''SELECT COUNT(*) FROM main.{};'''.format(table)
+    before = c.execute(countquery).fetchall()[0][0]
+    c.execute(query + ';')
+    added = c.execute(countquery).fetchall()[0][0] - before
+    reconcile_table(c, table)
+
+    conflicts = []
+    if keys:
+        joinon = ' AND '.join('s.{0} = m.{0}'.format(key) for key in keys)
+        differ = ' OR '.join('s.{0} IS NOT m.{0}'.format(column) for column in columns if column not in keys)
+        if differ:
+            query = '''SELECT {} FROM shard.{} s INNER JOIN main.{} m ON {} WHERE {};'''.format(', '.join('s.'+key for key in keys), table, table, joinon, differ)
+            conflicts = c.execute(query).fetchall()
+    return(added, conflicts)
+
+conn = connect_db(args.db)
+c = conn.cursor()
+totals = {}
+
+for shardname in args.shards:
+    c.execute('''ATTACH DATABASE ? AS shard;''', (shardname,))
+    for table in get_tables(c):
+        added, conflicts = merge_table(c, table)
+        totals.setdefault(table, [0, 0])
+        totals[table][0] += added
+        totals[table][1] += len(conflicts)
+        print("Shard {} table {}: {} rows added, {} conflicts".format(shardname, table, added, len(conflicts)))
+        for key in conflicts[:args.examples]:
+            print("    conflicting row kept from {}: {}".format(args.db, key))
+    conn.commit()
+    c.execute('''DETACH DATABASE shard;''')
+
+#ads seen in a listing (by any of the shards) since they were marked likely closed are not closed after all
+query = '''DELETE FROM jobadinferredclosed WHERE uniqueadid IN (SELECT l.uniqueadid FROM jobadlistings l WHERE l.lastseen >= jobadinferredclosed.inferreddate);'''
+if 'jobadinferredclosed' in totals and 'jobadlistings' in totals:
+    c.execute(query)
+    print("Ads taken out of jobadinferredclosed as they were listed again: {}".format(c.rowcount))
+conn.commit()
+
+for table, (added, conflicts) in sorted(totals.items()):
+    print("Table {}: {} rows added, {} conflicts".format(table, added, conflicts))
+
+#each shard starts its next crawl from the merged database
+if not args.keep_shards:
+    for shardname in args.shards:
+        shardconn = connect_db(shardname)
+        conn.backup(shardconn)
+        shardconn.close()
+        print("Shard {} copied from {}".format(shardname, args.db))
+conn.close()
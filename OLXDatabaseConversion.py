@@ -1,19 +1,264 @@
 ###############################################################################################################
 # This code aims to help create and update the database by saving old database files into a new one
 #
+# The tables are created and changed by the migrations at the bottom of the schema.  Each one has a version that is
+# recorded in the schemaversion table of egyptOLX.db once it has been applied, and the scraper applies any it does
+# not have yet when it starts (or run this file to do so).  To change the schema add a migration with the next
+# version rather than editing the tables by hand.
 ###############################################################################################################
 
 # open the sqlite and set the connection on the database
-# open the sqlite and set the connection on the database
-import sqlite3
+from ScrapeDatabase import connect_db, migrate_db, normalize_datecolumns, querytextstore, get_storetext, get_storedtext, store_texts, encode_deltas
 
 # in sqlite the only option to convert table is to rename temporary table, create new table, and then drop old 
+# (see rebuild_table() in ScrapeDatabase.py for a migration that needs to)
 
 #SCHEMA FOR THE RELEVANT TABLES
 
+#the schema as it is once all of the migrations at the bottom have been applied.  The tables, views, triggers and
+#indexes that a later migration replaced are only in the migrations that create them.
+
 querycreate = {}
 
-querycreate['regionadcounts'] = '''CREATE TABLE IF NOT EXISTS regionadcounts (
+#most recent count of job ads of each region-sector, kept up to date by the trigger of regionjobadcounts below
+querycreate['regionjobadlatest'] = '''CREATE TABLE IF NOT EXISTS regionjobadlatest (
+        region VARCHAR(50),
+        freg VARCHAR(50),
+        subregion VARCHAR(50),
+        fsubreg VARCHAR(50),
+        sector VARCHAR(50),
+        urlregsector VARCHAR(50),
+        downloaddate DATE,
+        totalposts INTEGER,
+        PRIMARY KEY(region,subregion,sector));'''
+
+#one row for each download where the count of a region-sector changed (or the region-sector was first seen)
+querycreate['regionjobadchanges'] = '''CREATE TABLE IF NOT EXISTS regionjobadchanges (
+        downloaddate DATE,
+        region VARCHAR(50),
+        freg VARCHAR(50),
+        subregion VARCHAR(50),
+        fsubreg VARCHAR(50),
+        sector VARCHAR(50),
+        urlregsector VARCHAR(50),
+        oldtotalposts INTEGER,
+        totalposts INTEGER,
+        PRIMARY KEY(downloaddate,region,subregion,sector));'''
+
+#every subregion and sector listing an ad has been seen in (jobadpageurls only keeps the first one)
+querycreate['jobadlistings'] = '''CREATE TABLE IF NOT EXISTS jobadlistings (
+        uniqueadid INTEGER,
+        freg VARCHAR(50),
+        fsubreg VARCHAR(50),
+        jobsector VARCHAR(50),
+        firstseen DATE,
+        lastseen DATE,
+        PRIMARY KEY(uniqueadid,fsubreg,jobsector));'''
+
+#ads missing from a listing that was read in full, so likely closed without fetching their page.  confirmstatus
+#is the adstatus found when one is fetched anyway (NULL until then)
+querycreate['jobadinferredclosed'] = '''CREATE TABLE IF NOT EXISTS jobadinferredclosed (
+        uniqueadid INTEGER,
+        fsubreg VARCHAR(50),
+        jobsector VARCHAR(50),
+        inferreddate DATE,
+        confirmstatus VARCHAR(10),
+        PRIMARY KEY(uniqueadid));'''
+
+#ads a fetch found closed, with the date of the first such fetch.  Kept up to date by the trigger on the visits of
+#jobadpagedata below so that the revisits leave the closed ads out without scanning jobadpagedata
+querycreate['jobadclosed'] = '''CREATE TABLE IF NOT EXISTS jobadclosed (
+        uniqueadid INTEGER,
+        closeddate DATE,
+        PRIMARY KEY(uniqueadid));'''
+
+queryindex = {}
+queryindex['regionjobadchanges'] = '''CREATE INDEX IF NOT EXISTS regionjobadchanges_date ON regionjobadchanges (downloaddate);'''
+queryindex['jobadlistings'] = '''CREATE INDEX IF NOT EXISTS jobadlistings_listing ON jobadlistings (fsubreg,jobsector);'''
+
+querytrigger = {}
+
+#DIMENSION TABLES
+
+#the region, subregion and sector strings are stored once in the dimension tables, and regionadcounts,
+#regionjobadcounts, jobadpageurls and jobadpagedata are views of fact tables (factregionadcounts, ...) that refer to
+#them by their integer ids.  The views have the columns of the tables they replace, and the rows inserted into a view
+#are written to the fact table by its INSTEAD OF trigger, which adds any new strings to the dimension tables.
+querycreate['subregions'] = '''CREATE TABLE IF NOT EXISTS subregions (
+        subregionid INTEGER PRIMARY KEY,
+        region VARCHAR(50),
+        freg VARCHAR(50),
+        subregion VARCHAR(50),
+        fsubreg VARCHAR(50),
+        UNIQUE(region,freg,subregion,fsubreg));'''
+
+querycreate['sectors'] = '''CREATE TABLE IF NOT EXISTS sectors (
+        sectorid INTEGER PRIMARY KEY,
+        sector VARCHAR(50),
+        UNIQUE(sector));'''
+
+#the listing of each subregion and sector and the url it is read from (the first one seen, the url of a listing is
+#made up of its sector and subregion)
+querycreate['regionsectors'] = '''CREATE TABLE IF NOT EXISTS regionsectors (
+        regionsectorid INTEGER PRIMARY KEY,
+        subregionid INTEGER,
+        sectorid INTEGER,
+        urlregsector VARCHAR(100),
+        UNIQUE(subregionid,sectorid));'''
+
+querycreate['factregionadcounts'] = '''CREATE TABLE IF NOT EXISTS factregionadcounts (
+    downloaddate DATE,
+    downloadtime VARCHAR(5),
+    subregionid INTEGER,
+    totalregposts INTEGER,
+    subposts INTEGER,
+    PRIMARY KEY(downloaddate,subregionid));'''
+
+querycreate['factregionjobadcounts'] = '''CREATE TABLE IF NOT EXISTS factregionjobadcounts (
+    downloaddate DATE,
+    downloadtime VARCHAR(5),
+    regionsectorid INTEGER,
+    totalposts INTEGER,
+    PRIMARY KEY(downloaddate,regionsectorid));'''
+
+querycreate['factjobadpageurls'] = '''CREATE TABLE IF NOT EXISTS factjobadpageurls (
+        subregionid INTEGER,
+        sectorid INTEGER,
+        postdate DATE,
+        uniqueadid INTEGER,
+        i_photo INTEGER,
+        i_featured INTEGER,
+        urllinkshort VARCHAR(50),
+        PRIMARY KEY(uniqueadid,postdate));'''
+
+#the views are LEFT JOINs so that SQLite leaves out the dimension tables of a query that does not use their strings
+queryview = {}
+queryview['regionadcounts'] = '''CREATE VIEW IF NOT EXISTS regionadcounts AS
+    SELECT f.downloaddate, f.downloadtime, s.region, s.freg, s.subregion, s.fsubreg, f.totalregposts, f.subposts
+    FROM factregionadcounts f LEFT JOIN subregions s ON s.subregionid = f.subregionid;'''
+
+queryview['regionjobadcounts'] = '''CREATE VIEW IF NOT EXISTS regionjobadcounts AS
+    SELECT f.downloaddate, f.downloadtime, s.region, s.freg, s.subregion, s.fsubreg, e.sector, r.urlregsector, f.totalposts
+    FROM factregionjobadcounts f LEFT JOIN regionsectors r ON r.regionsectorid = f.regionsectorid
+    LEFT JOIN subregions s ON s.subregionid = r.subregionid LEFT JOIN sectors e ON e.sectorid = r.sectorid;'''
+
+queryview['jobadpageurls'] = '''CREATE VIEW IF NOT EXISTS jobadpageurls AS
+    SELECT s.region, s.freg, s.subregion, s.fsubreg, e.sector AS jobsector, f.postdate, f.uniqueadid, f.i_photo, f.i_featured, f.urllinkshort
+    FROM factjobadpageurls f LEFT JOIN subregions s ON s.subregionid = f.subregionid LEFT JOIN sectors e ON e.sectorid = f.sectorid;'''
+
+#the statements of the INSTEAD OF triggers that add the strings of the new row to the dimension tables (the checks for
+#an existing row rather than OR IGNORE, as the conflict clause of the insert into the view overrides the one here and
+#OR REPLACE would give the strings a new id), and the ids of the strings (NULL if there are none)
+subregionid = '''(SELECT subregionid FROM subregions WHERE region IS NEW.region AND freg IS NEW.freg AND subregion IS NEW.subregion AND fsubreg IS NEW.fsubreg)'''
+sectorid = '''(SELECT sectorid FROM sectors WHERE sector = NEW.{})'''
+regionsectorid = '''(SELECT regionsectorid FROM regionsectors WHERE subregionid IS {} AND sectorid IS {})'''.format(subregionid, sectorid.format('sector'))
+insertsubregion = '''INSERT INTO subregions (region,freg,subregion,fsubreg) SELECT NEW.region, NEW.freg, NEW.subregion, NEW.fsubreg
+        WHERE COALESCE(NEW.region,NEW.freg,NEW.subregion,NEW.fsubreg) IS NOT NULL AND NOT EXISTS {};'''.format(subregionid)
+insertsector = '''INSERT INTO sectors (sector) SELECT NEW.{0} WHERE NEW.{0} IS NOT NULL AND NOT EXISTS (SELECT 1 FROM sectors WHERE sector = NEW.{0});'''
+insertregionsector = '''INSERT INTO regionsectors (subregionid,sectorid,urlregsector) SELECT {}, {}, NEW.urlregsector
+        WHERE NOT EXISTS {};'''.format(subregionid, sectorid.format('sector'), regionsectorid)
+
+querytrigger['regionadcounts_insert'] = '''CREATE TRIGGER IF NOT EXISTS regionadcounts_insert INSTEAD OF INSERT ON regionadcounts
+    BEGIN
+        {}
+        INSERT INTO factregionadcounts (downloaddate,downloadtime,subregionid,totalregposts,subposts)
+        VALUES (NEW.downloaddate, NEW.downloadtime, {}, NEW.totalregposts, NEW.subposts);
+    END;'''.format(insertsubregion, subregionid)
+
+#every count inserted is compared with the latest count of the region-sector in regionjobadlatest and recorded in
+#regionjobadchanges if it changed (or the region-sector is new), so that the scraper can pick the region-sectors that
+#changed without scanning the whole history.  Nothing is recorded if the count of the day is already in
+#factregionjobadcounts (the insert is then ignored or fails)
+isnewcount = '''NOT EXISTS (SELECT 1 FROM factregionjobadcounts WHERE downloaddate = NEW.downloaddate AND regionsectorid = {})'''.format(regionsectorid)
+querytrigger['regionjobadcounts_insert'] = '''CREATE TRIGGER IF NOT EXISTS regionjobadcounts_insert INSTEAD OF INSERT ON regionjobadcounts
+    BEGIN
+        {0}
+        {1}
+        {2}
+        INSERT OR IGNORE INTO regionjobadchanges (downloaddate,region,freg,subregion,fsubreg,sector,urlregsector,oldtotalposts,totalposts)
+        SELECT NEW.downloaddate, NEW.region, NEW.freg, NEW.subregion, NEW.fsubreg, NEW.sector, NEW.urlregsector, l.totalposts, NEW.totalposts
+        FROM (SELECT 1) LEFT JOIN regionjobadlatest l ON l.region = NEW.region AND l.subregion = NEW.subregion AND l.sector = NEW.sector
+        WHERE (l.region IS NULL OR (l.downloaddate < NEW.downloaddate AND l.totalposts != NEW.totalposts)) AND {3};
+        UPDATE regionjobadlatest SET freg = NEW.freg, fsubreg = NEW.fsubreg, urlregsector = NEW.urlregsector, downloaddate = NEW.downloaddate, totalposts = NEW.totalposts
+        WHERE region = NEW.region AND subregion = NEW.subregion AND sector = NEW.sector AND downloaddate <= NEW.downloaddate AND {3};
+        INSERT OR IGNORE INTO regionjobadlatest (region,freg,subregion,fsubreg,sector,urlregsector,downloaddate,totalposts)
+        SELECT NEW.region, NEW.freg, NEW.subregion, NEW.fsubreg, NEW.sector, NEW.urlregsector, NEW.downloaddate, NEW.totalposts WHERE {3};
+        INSERT INTO factregionjobadcounts (downloaddate,downloadtime,regionsectorid,totalposts)
+        VALUES (NEW.downloaddate, NEW.downloadtime, {4}, NEW.totalposts);
+    END;'''.format(insertsubregion, insertsector.format('sector'), insertregionsector, isnewcount, regionsectorid)
+
+querytrigger['jobadpageurls_insert'] = '''CREATE TRIGGER IF NOT EXISTS jobadpageurls_insert INSTEAD OF INSERT ON jobadpageurls
+    BEGIN
+        {}
+        {}
+        INSERT INTO factjobadpageurls (subregionid,sectorid,postdate,uniqueadid,i_photo,i_featured,urllinkshort)
+        VALUES ({}, {}, NEW.postdate, NEW.uniqueadid, NEW.i_photo, NEW.i_featured, NEW.urllinkshort);
+    END;'''.format(insertsubregion, insertsector.format('jobsector'), subregionid, sectorid.format('jobsector'))
+
+#the ads of a listing and the ads posted on a day
+queryindex['factjobadpageurls'] = '''CREATE INDEX IF NOT EXISTS factjobadpageurls_listing ON factjobadpageurls (subregionid,sectorid,uniqueadid);'''
+queryindex['factjobadpageurls_postdate'] = '''CREATE INDEX IF NOT EXISTS factjobadpageurls_postdate ON factjobadpageurls (postdate);'''
+
+dimtables = ['subregions','sectors','regionsectors']
+#the views of the fact tables and the primary key of the tables they replaced
+viewtables = {'regionadcounts': ['downloaddate','region','subregion'], 'regionjobadcounts': ['downloaddate','region','subregion','sector'],
+    'jobadpageurls': ['uniqueadid','postdate'], 'jobadpagedata': ['downloaddate','uniqueadid','postdate']}
+
+#TEXT STORE
+
+#the title and description of an ad are stored once in textstore (see ScrapeDatabase.py) and factjobadpagedata only
+#holds their keys (see store_pagetexts()).
+textcolumns = {'jobadpagedata': ['title','description']}
+
+queryview['jobadpagedata'] = '''CREATE VIEW IF NOT EXISTS jobadpagedata AS
+    SELECT f.downloaddate, f.downloadtime, s.region, s.freg, s.subregion, s.fsubreg, e.sector AS jobsector, f.uniqueadid, f.postdate, f.posttime,
+    f.pageviews, {}, f.experiencelevel, f.educationlevel, f.type, f.employtype, f.compensation, {}, f.textlanguage, f.userhref,
+    f.username, f.userjoinyear, f.userjoinmt, f.emailavail, f.phoneavail, f.adstatus
+    FROM factjobadpagedata f LEFT JOIN subregions s ON s.subregionid = f.subregionid LEFT JOIN sectors e ON e.sectorid = f.sectorid;'''.format(get_storedtext('f.titlekey', 'title'), get_storedtext('f.descriptionkey', 'description'))
+
+querytrigger['jobadpagedata_insert'] = '''CREATE TRIGGER IF NOT EXISTS jobadpagedata_insert INSTEAD OF INSERT ON jobadpagedata
+    BEGIN
+        {}
+        {}
+        {}
+        {}
+        INSERT INTO factjobadpagedata (downloaddate,downloadtime,subregionid,sectorid,uniqueadid,postdate,posttime,pageviews,titlekey,experiencelevel,educationlevel,
+        type,employtype,compensation,descriptionkey,textlanguage,userhref,username,userjoinyear,userjoinmt,emailavail,phoneavail,adstatus)
+        VALUES (NEW.downloaddate, NEW.downloadtime, {}, {}, NEW.uniqueadid, NEW.postdate, NEW.posttime, NEW.pageviews, textkey(NEW.title), NEW.experiencelevel, NEW.educationlevel,
+        NEW.type, NEW.employtype, NEW.compensation, textkey(NEW.description), NEW.textlanguage, NEW.userhref, NEW.username, NEW.userjoinyear, NEW.userjoinmt, NEW.emailavail, NEW.phoneavail, NEW.adstatus);
+    END;'''.format(insertsubregion, insertsector.format('jobsector'), get_storetext('title'), get_storetext('description'), subregionid, sectorid.format('jobsector'))
+
+#DELTA STORAGE
+
+#factjobadpagedata is stored as a base row for each ad in basejobadpagedata and a delta row for each visit in
+#deltajobadpagedata, which holds the columns below and the others only where they differ from the base row (see
+#encode_deltas() in ScrapeDatabase.py).  factjobadpagedata is then a view of the two, so jobadpagedata is unchanged.
+visitcolumns = {'factjobadpagedata': ['downloaddate','downloadtime','uniqueadid','postdate','pageviews','adstatus']}
+deltatables = ['basejobadpagedata','deltajobadpagedata']
+
+#the visits of an ad (last visit and page views) and the closed ads, covering so that the table itself is not read,
+#and the trigger that keeps jobadclosed up to date
+querytrigger['deltajobadpagedata'] = '''CREATE TRIGGER IF NOT EXISTS deltajobadpagedata_closed AFTER INSERT ON deltajobadpagedata
+    WHEN NEW.adstatus == 'CLOSED'
+    BEGIN
+        INSERT OR IGNORE INTO jobadclosed (uniqueadid,closeddate) VALUES (NEW.uniqueadid, NEW.downloaddate);
+    END;'''
+queryindex['deltajobadpagedata'] = '''CREATE INDEX IF NOT EXISTS deltajobadpagedata_ad ON deltajobadpagedata (uniqueadid,downloaddate,pageviews);'''
+queryindex['deltajobadpagedata_status'] = '''CREATE INDEX IF NOT EXISTS deltajobadpagedata_status ON deltajobadpagedata (adstatus,uniqueadid);'''
+
+tables = ['regionadcounts','regionjobadcounts','jobadpageurls','jobadpagedata','regionjobadlatest','regionjobadchanges','jobadlistings','jobadinferredclosed','jobadclosed']
+
+#columns holding a date, stored as 'YYYY-MM-DD'
+datecolumns = {'regionadcounts': ['downloaddate'], 'regionjobadcounts': ['downloaddate'], 'jobadpageurls': ['postdate'],
+    'jobadpagedata': ['downloaddate','postdate'], 'regionjobadlatest': ['downloaddate'], 'regionjobadchanges': ['downloaddate'],
+    'jobadlistings': ['firstseen','lastseen'], 'jobadinferredclosed': ['inferreddate'], 'jobadclosed': ['closeddate']}
+
+#MIGRATIONS
+
+#the tables as they were first created, since replaced by the views of create_dimensiontables()
+def create_basetables(c):
+    querybase = {}
+    querybase['regionadcounts'] = '''CREATE TABLE IF NOT EXISTS regionadcounts (
     downloaddate DATE,
     downloadtime VARCHAR(5),
     region VARCHAR(50),
@@ -24,7 +269,7 @@ querycreate['regionadcounts'] = '''CREATE TABLE IF NOT EXISTS regionadcounts (
     subposts INTEGER,
     PRIMARY KEY(downloaddate,region,subregion));'''
     
-querycreate['regionjobadcounts']= '''CREATE TABLE IF NOT EXISTS regionjobadcounts 
+    querybase['regionjobadcounts']= '''CREATE TABLE IF NOT EXISTS regionjobadcounts 
     (downloaddate DATE,
     downloadtime VARCHAR(5),
     region VARCHAR(50),
@@ -36,7 +281,7 @@ querycreate['regionjobadcounts']= '''CREATE TABLE IF NOT EXISTS regionjobadcount
     totalposts INTEGER,
     PRIMARY KEY(downloaddate,region,subregion,sector));'''
     
-querycreate['jobadpageurls'] = '''CREATE TABLE IF NOT EXISTS jobadpageurls (
+    querybase['jobadpageurls'] = '''CREATE TABLE IF NOT EXISTS jobadpageurls (
         region VARCHAR(50),
         freg VARCHAR(50),
         subregion VARCHAR(50),
@@ -49,7 +294,7 @@ querycreate['jobadpageurls'] = '''CREATE TABLE IF NOT EXISTS jobadpageurls (
         urllinkshort VARCHAR(50),
         PRIMARY KEY(uniqueadid,postdate));'''
 
-querycreate['jobadpagedata'] = '''CREATE TABLE IF NOT EXISTS jobadpagedata (
+    querybase['jobadpagedata'] = '''CREATE TABLE IF NOT EXISTS jobadpagedata (
         downloaddate DATE,
         downloadtime VARCHAR(5),
         region VARCHAR(50),
@@ -77,14 +322,256 @@ querycreate['jobadpagedata'] = '''CREATE TABLE IF NOT EXISTS jobadpagedata (
         phoneavail INTEGER,
         adstatus VARCHAR(10),
         PRIMARY KEY(downloaddate,uniqueadid,postdate));'''
-        
 
-tables = ['regionadcounts','regionjobadcounts','jobadpageurls','jobadpagedata']
+    for t in ['regionadcounts','regionjobadcounts','jobadpageurls','jobadpagedata']:
+        c.execute(querybase[t])
+
+#creates the latest count and change tables of regionjobadcounts and fills them from the counts already downloaded
+def create_changetables(c):
+
+    #every count inserted into regionjobadcounts is compared with the latest count of the region-sector, so that the
+    #scraper can pick the region-sectors that changed from regionjobadchanges without scanning the whole history
+    #(the scraper inserts with OR IGNORE, which overrides the conflict clauses inside the trigger, so no OR REPLACE here)
+    querychanges = '''CREATE TRIGGER IF NOT EXISTS regionjobadcounts_changes AFTER INSERT ON regionjobadcounts
+    BEGIN
+        INSERT OR IGNORE INTO regionjobadchanges (downloaddate,region,freg,subregion,fsubreg,sector,urlregsector,oldtotalposts,totalposts)
+        SELECT NEW.downloaddate, NEW.region, NEW.freg, NEW.subregion, NEW.fsubreg, NEW.sector, NEW.urlregsector, l.totalposts, NEW.totalposts
+        FROM (SELECT 1) LEFT JOIN regionjobadlatest l ON l.region = NEW.region AND l.subregion = NEW.subregion AND l.sector = NEW.sector
+        WHERE l.region IS NULL OR (l.downloaddate < NEW.downloaddate AND l.totalposts != NEW.totalposts);
+        UPDATE regionjobadlatest SET freg = NEW.freg, fsubreg = NEW.fsubreg, urlregsector = NEW.urlregsector, downloaddate = NEW.downloaddate, totalposts = NEW.totalposts
+        WHERE region = NEW.region AND subregion = NEW.subregion AND sector = NEW.sector AND downloaddate <= NEW.downloaddate;
+        INSERT OR IGNORE INTO regionjobadlatest (region,freg,subregion,fsubreg,sector,urlregsector,downloaddate,totalposts)
+        VALUES (NEW.region, NEW.freg, NEW.subregion, NEW.fsubreg, NEW.sector, NEW.urlregsector, NEW.downloaddate, NEW.totalposts);
+    END;'''
+
+    for t in ['regionjobadlatest','regionjobadchanges']:
+        c.execute(querycreate[t])
+    c.execute(queryindex['regionjobadchanges'])
+
+    query = '''INSERT OR REPLACE INTO regionjobadlatest (region,freg,subregion,fsubreg,sector,urlregsector,downloaddate,totalposts)
+    SELECT region, freg, subregion, fsubreg, sector, urlregsector, downloaddate, totalposts FROM
+    (SELECT *, ROW_NUMBER() OVER (PARTITION BY region, subregion, sector ORDER BY downloaddate DESC) AS n FROM regionjobadcounts) WHERE n = 1;'''
+    c.execute(query)
+
+    query = '''INSERT OR IGNORE INTO regionjobadchanges (downloaddate,region,freg,subregion,fsubreg,sector,urlregsector,oldtotalposts,totalposts)
+    SELECT downloaddate, region, freg, subregion, fsubreg, sector, urlregsector, oldtotalposts, totalposts FROM
+    (SELECT *, LAG(totalposts) OVER (PARTITION BY region, subregion, sector ORDER BY downloaddate) AS oldtotalposts,
+    ROW_NUMBER() OVER (PARTITION BY region, subregion, sector ORDER BY downloaddate) AS n FROM regionjobadcounts)
+    WHERE n = 1 OR oldtotalposts != totalposts;'''
+    c.execute(query)
+
+    c.execute(querychanges)
+
+    for t in ['regionjobadlatest','regionjobadchanges']:
+        temp = c.execute('''SELECT COUNT(*) FROM {};'''.format(t)).fetchall()
+        print("Number of entries in table {}: {}".format(t,temp[0][0]))
+
+#jobadlistings is filled from jobadpageurls
+def create_listingtables(c):
+    c.execute(querycreate['jobadlistings'])
+    c.execute('''INSERT OR IGNORE INTO jobadlistings (uniqueadid, freg, fsubreg, jobsector, firstseen, lastseen) SELECT uniqueadid, freg, fsubreg, jobsector, MIN(postdate), MAX(postdate) FROM jobadpageurls GROUP BY uniqueadid, fsubreg, jobsector;''')
+    c.execute(queryindex['jobadlistings'])
+    c.execute(querycreate['jobadinferredclosed'])
+
+#the post dates read from the listings were stored without zero padding ('2018-1-5'), which DATE() turns into NULL
+def normalize_dates(c):
+    normalize_datecolumns(c, datecolumns)
+
+def create_indexes(c):
+    queryindex = {}
+    #the subregions swept in the last days
+    queryindex['regionadcounts'] = '''CREATE INDEX IF NOT EXISTS regionadcounts_date ON regionadcounts (downloaddate);'''
+    #the ads of a listing (known ids, counts and last download date of a subregion-sector) and the ads posted on a day
+    queryindex['jobadpageurls'] = '''CREATE INDEX IF NOT EXISTS jobadpageurls_listing ON jobadpageurls (fsubreg,jobsector,uniqueadid);'''
+    queryindex['jobadpageurls_postdate'] = '''CREATE INDEX IF NOT EXISTS jobadpageurls_postdate ON jobadpageurls (postdate);'''
+    #the visits of an ad (last visit and page views) and the closed ads, covering so that the table itself is not read
+    queryindex['jobadpagedata'] = '''CREATE INDEX IF NOT EXISTS jobadpagedata_ad ON jobadpagedata (uniqueadid,downloaddate,pageviews);'''
+    queryindex['jobadpagedata_status'] = '''CREATE INDEX IF NOT EXISTS jobadpagedata_status ON jobadpagedata (adstatus,uniqueadid);'''
+    for t in ['regionadcounts','jobadpageurls','jobadpageurls_postdate','jobadpagedata','jobadpagedata_status']:
+        c.execute(queryindex[t])
+
+#creates jobadclosed and fills it from the ads already fetched
+def create_closedtable(c):
+    queryclosed = '''CREATE TRIGGER IF NOT EXISTS jobadpagedata_closed AFTER INSERT ON jobadpagedata
+    WHEN NEW.adstatus == 'CLOSED'
+    BEGIN
+        INSERT OR IGNORE INTO jobadclosed (uniqueadid,closeddate) VALUES (NEW.uniqueadid, NEW.downloaddate);
+    END;'''
+    c.execute(querycreate['jobadclosed'])
+    c.execute('''INSERT OR IGNORE INTO jobadclosed (uniqueadid,closeddate) SELECT uniqueadid, MIN(downloaddate) FROM jobadpagedata WHERE adstatus == 'CLOSED' GROUP BY uniqueadid;''')
+    c.execute(queryclosed)
+    temp = c.execute('''SELECT COUNT(*) FROM jobadclosed;''').fetchall()
+    print("Number of entries in table jobadclosed: {}".format(temp[0][0]))
+
+#the closed ads and the indexes of factjobadpagedata, as on jobadpagedata before (see create_indexes())
+def create_factpagedataindexes(c):
+    queryfactclosed = '''CREATE TRIGGER IF NOT EXISTS factjobadpagedata_closed AFTER INSERT ON factjobadpagedata
+    WHEN NEW.adstatus == 'CLOSED'
+    BEGIN
+        INSERT OR IGNORE INTO jobadclosed (uniqueadid,closeddate) VALUES (NEW.uniqueadid, NEW.downloaddate);
+    END;'''
+    c.execute(queryfactclosed)
+    queryfactindex = {}
+    queryfactindex['factjobadpagedata'] = '''CREATE INDEX IF NOT EXISTS factjobadpagedata_ad ON factjobadpagedata (uniqueadid,downloaddate,pageviews);'''
+    queryfactindex['factjobadpagedata_status'] = '''CREATE INDEX IF NOT EXISTS factjobadpagedata_status ON factjobadpagedata (adstatus,uniqueadid);'''
+    for t in ['factjobadpagedata','factjobadpagedata_status']:
+        c.execute(queryfactindex[t])
+
+#replaces regionadcounts, regionjobadcounts, jobadpageurls and jobadpagedata with their fact tables and views.  The
+#rows are copied through the views, so their triggers fill the dimension tables.  (Run VACUUM afterwards to give the
+#space freed to the disk.)
+def create_dimensiontables(c):
+    #jobadpagedata with its title and description, since moved to textstore by store_pagetexts()
+    querypage = {}
+    querypage['factjobadpagedata'] = '''CREATE TABLE IF NOT EXISTS factjobadpagedata (
+        downloaddate DATE,
+        downloadtime VARCHAR(5),
+        subregionid INTEGER,
+        sectorid INTEGER,
+        uniqueadid INTEGER,
+        postdate DATE,
+        posttime VARCHAR(5),
+        pageviews INTEGER,
+        title VARCHAR(70),
+        experiencelevel VARCHAR(50),
+        educationlevel VARCHAR(50),
+        type VARCHAR(50),
+        employtype VARCHAR(50),
+        compensation INTEGER,
+        description VARCHAR(5000),
+        textlanguage VARCHAR(2),
+        userhref VARCHAR(30),
+        username VARCHAR(50),
+        userjoinyear INTEGER,
+        userjoinmt VARCHAR(3),
+        emailavail INTEGER,
+        phoneavail INTEGER,
+        adstatus VARCHAR(10),
+        PRIMARY KEY(downloaddate,uniqueadid,postdate));'''
+
+    querypage['jobadpagedata'] = '''CREATE VIEW IF NOT EXISTS jobadpagedata AS
+    SELECT f.downloaddate, f.downloadtime, s.region, s.freg, s.subregion, s.fsubreg, e.sector AS jobsector, f.uniqueadid, f.postdate, f.posttime,
+    f.pageviews, f.title, f.experiencelevel, f.educationlevel, f.type, f.employtype, f.compensation, f.description, f.textlanguage, f.userhref,
+    f.username, f.userjoinyear, f.userjoinmt, f.emailavail, f.phoneavail, f.adstatus
+    FROM factjobadpagedata f LEFT JOIN subregions s ON s.subregionid = f.subregionid LEFT JOIN sectors e ON e.sectorid = f.sectorid;'''
+
+    querypage['jobadpagedata_insert'] = '''CREATE TRIGGER IF NOT EXISTS jobadpagedata_insert INSTEAD OF INSERT ON jobadpagedata
+    BEGIN
+        {}
+        {}
+        INSERT INTO factjobadpagedata (downloaddate,downloadtime,subregionid,sectorid,uniqueadid,postdate,posttime,pageviews,title,experiencelevel,educationlevel,
+        type,employtype,compensation,description,textlanguage,userhref,username,userjoinyear,userjoinmt,emailavail,phoneavail,adstatus)
+        VALUES (NEW.downloaddate, NEW.downloadtime, {}, {}, NEW.uniqueadid, NEW.postdate, NEW.posttime, NEW.pageviews, NEW.title, NEW.experiencelevel, NEW.educationlevel,
+        NEW.type, NEW.employtype, NEW.compensation, NEW.description, NEW.textlanguage, NEW.userhref, NEW.username, NEW.userjoinyear, NEW.userjoinmt, NEW.emailavail, NEW.phoneavail, NEW.adstatus);
+    END;'''.format(insertsubregion, insertsector.format('jobsector'), subregionid, sectorid.format('jobsector'))
+
+    for t in dimtables:
+        c.execute(querycreate[t])
+    for t in viewtables:
+        columns = [row[1] for row in c.execute('''PRAGMA table_info({});'''.format(t)).fetchall()]
+        c.execute('''ALTER TABLE {} RENAME TO {}_temp;'''.format(t, t))
+        if t == 'jobadpagedata':
+            c.execute(querypage['fact'+t])
+            c.execute(querypage[t])
+            c.execute(querypage[t+'_insert'])
+        else:
+            c.execute(querycreate['fact'+t])
+            c.execute(queryview[t])
+            c.execute(querytrigger[t+'_insert'])
+        query = '''INSERT INTO {} ({}) SELECT {} FROM {}_temp ORDER BY {};'''
+        c.execute(query.format(t, ', '.join(columns), ', '.join(columns), t, ', '.join(viewtables[t])))
+        c.execute('''DROP TABLE {}_temp;'''.format(t))
+    for t in ['factjobadpageurls','factjobadpageurls_postdate']:
+        c.execute(queryindex[t])
+    create_factpagedataindexes(c)
+    for t in dimtables:
+        temp = c.execute('''SELECT COUNT(*) FROM {};'''.format(t)).fetchall()
+        print("Number of entries in table {}: {}".format(t,temp[0][0]))
+
+#moves the title and description of the ads to textstore
+def store_pagetexts(c):
+    queryfact = '''CREATE TABLE IF NOT EXISTS factjobadpagedata (
+        downloaddate DATE,
+        downloadtime VARCHAR(5),
+        subregionid INTEGER,
+        sectorid INTEGER,
+        uniqueadid INTEGER,
+        postdate DATE,
+        posttime VARCHAR(5),
+        pageviews INTEGER,
+        titlekey INTEGER,
+        experiencelevel VARCHAR(50),
+        educationlevel VARCHAR(50),
+        type VARCHAR(50),
+        employtype VARCHAR(50),
+        compensation INTEGER,
+        descriptionkey INTEGER,
+        textlanguage VARCHAR(2),
+        userhref VARCHAR(30),
+        username VARCHAR(50),
+        userjoinyear INTEGER,
+        userjoinmt VARCHAR(3),
+        emailavail INTEGER,
+        phoneavail INTEGER,
+        adstatus VARCHAR(10),
+        PRIMARY KEY(downloaddate,uniqueadid,postdate));'''
+    c.execute(querytextstore)
+    #dropping the view drops its trigger, and the fact table is then renamed without SQLite rewriting the view
+    c.execute('''DROP VIEW jobadpagedata;''')
+    columns = [row[1] for row in c.execute('''PRAGMA table_info(factjobadpagedata);''').fetchall()]
+    c.execute('''ALTER TABLE factjobadpagedata RENAME TO factjobadpagedata_temp;''')
+    c.execute(queryfact)
+    c.execute(queryview['jobadpagedata'])
+    c.execute(querytrigger['jobadpagedata_insert'])
+    store_texts(c, 'factjobadpagedata_temp', textcolumns['jobadpagedata'])
+    newcolumns = [column+'key' if column in textcolumns['jobadpagedata'] else column for column in columns]
+    values = ['textkey({})'.format(column) if column in textcolumns['jobadpagedata'] else column for column in columns]
+    c.execute('''INSERT INTO factjobadpagedata ({}) SELECT {} FROM factjobadpagedata_temp;'''.format(', '.join(newcolumns), ', '.join(values)))
+    c.execute('''DROP TABLE factjobadpagedata_temp;''')
+    create_factpagedataindexes(c)
+    temp = c.execute('''SELECT COUNT(*) FROM textstore;''').fetchall()
+    print("Number of entries in table textstore: {}".format(temp[0][0]))
+
+#stores factjobadpagedata as the base row of each ad and the changes of each visit.  (Run VACUUM afterwards to give the
+#space freed to the disk.)
+def encode_pagedeltas(c):
+    encode_deltas(c, 'factjobadpagedata', 'uniqueadid', visitcolumns['factjobadpagedata'])
+    c.execute(querytrigger['deltajobadpagedata'])
+    for t in ['deltajobadpagedata','deltajobadpagedata_status']:
+        c.execute(queryindex[t])
+    for t in deltatables:
+        temp = c.execute('''SELECT COUNT(*) FROM {};'''.format(t)).fetchall()
+        print("Number of entries in table {}: {}".format(t,temp[0][0]))
+
+#the insert trigger of jobadpagedata again, to compare a text with the one already stored under its key
+def check_textkeys(c):
+    c.execute('''DROP TRIGGER IF EXISTS jobadpagedata_insert;''')
+    c.execute(querytrigger['jobadpagedata_insert'])
+
+#(version, description, migration) in the order they are applied, add new ones at the end
+migrations = [
+    (1, 'regionadcounts, regionjobadcounts, jobadpageurls and jobadpagedata', create_basetables),
+    (2, 'regionjobadlatest and regionjobadchanges kept up to date by a trigger on regionjobadcounts', create_changetables),
+    (3, 'jobadlistings and jobadinferredclosed', create_listingtables),
+    (4, 'dates stored as YYYY-MM-DD', normalize_dates),
+    (5, 'indexes for the queries of the scraper', create_indexes),
+    (6, 'jobadclosed kept up to date by a trigger on jobadpagedata', create_closedtable),
+    (7, 'subregions, sectors and regionsectors, with views of the count, url and page tables that refer to them', create_dimensiontables),
+    (8, 'titles and descriptions of jobadpagedata stored once in textstore', store_pagetexts),
+    (9, 'jobadpagedata stored as the base row of each ad and the changes of each visit', encode_pagedeltas),
+    (10, 'texts inserted into jobadpagedata compared with the text stored under their key', check_textkeys),
+    ]
+
+#brings egyptOLX.db up to the latest version
+def migrate():
+    conn = connect_db("egyptOLX.db")
+    print("Version of egyptOLX.db: {}".format(migrate_db(conn, migrations)))
+    conn.close()
     
 #Report standard statistics and counts of the data that is in each of the tables    
 def report_statistics():
     
-    conn = sqlite3.connect("egyptOLX.db")
+    conn = connect_db("egyptOLX.db")
     c = conn.cursor()
     
     for i, t in enumerate(tables):
@@ -95,10 +582,8 @@ def report_statistics():
         schema = c.execute(query.format(t)).fetchall()
         print(schema)
         
-        if t == "jobadpageurls":
-            query = '''SELECT MAX(DATE(postdate)) FROM {};'''.format(t)
-        else:
-            query = '''SELECT MAX(DATE(downloaddate)) FROM {};'''.format(t)
+        datecol = datecolumns[t][0]
+        query = '''SELECT MAX({}) FROM {};'''.format(datecol,t)
         
         print(c.execute(query).fetchall())
         lastdate = c.execute(query).fetchall()[0][0]
@@ -107,10 +592,7 @@ def report_statistics():
         #Check the most recent data and report counts, means for each of the data points in the dataset
         for j, row in enumerate(schema):
             var = row[1]
-            if t == "jobadpageurls":
-                querystats = '''SELECT DATE(postdate), AVG({}), COUNT({}) FROM {} GROUP BY DATE(postdate);'''.format(var,var,t,lastdate)
-            else:
-                querystats = '''SELECT DATE(downloaddate), AVG({}), COUNT({}) FROM {} GROUP BY DATE(downloaddate);'''.format(var,var,t,lastdate)
+            querystats = '''SELECT {}, AVG({}), COUNT({}) FROM {} GROUP BY {};'''.format(datecol,var,var,t,datecol)
             print(querystats)
             queryresults = {}
             print("{}: {}".format(var,c.execute(querystats).fetchall()))
@@ -124,48 +606,28 @@ def report_statistics():
     
     c.close()
 
-#function resets all of the tables
+#function resets all of the tables (drops them and creates them again with all of the migrations)
 def reset_tables():
 
-    for i, t in enumerate(tables):
-        deletequery = '''DROP TABLE IF EXISTS {};'''
-        c.execute(deletequery.format(table[i]))
-        c.execute(querycreate[t])
-        query ='''PRAGMA table_info({});'''
-        print(c.execute(query.format(table[i])).fetchall())
-    conn.commit()
-    conn.close()
-
-def update_table(tablename,newtablequery,insertstatement):
-    
-    conn = sqlite3.connect("egyptOLX.db")
+    conn = connect_db("egyptOLX.db")
     c = conn.cursor()
 
-    query ='''PRAGMA table_info({});'''
-    print(c.execute(query.format(tablename)).fetchall())    
-    
-    query = "ALTER TABLE {} RENAME TO {}_temp;"
-    c.execute(query.format(tablename,tablename))
-    
-    c.execute(newtablequery)
-    
-    query = "INSERT INTO {} ({}) SELECT {} FROM {}_temp;"
-    c.execute(query.format(tablename,insertstatement,insertstatement,tablename))
-    
-    query ='''PRAGMA table_info({});'''
-    print(c.execute(query.format(tablename)).fetchall())
-    
-    query = '''DROP TABLE IF EXISTS {}_temp;'''
-    c.execute(query.format(tablename))
-    
-    temp = c.execute('''SELECT * FROM {};'''.format(tablename)).fetchall()
-    print("Number of entries in converted table {}: {}".format(tablename,len(temp)))
-    
+    #the views (factjobadpagedata among them from version 9) are dropped before the tables
+    for (t,) in c.execute('''SELECT name FROM sqlite_master WHERE type = 'view';''').fetchall():
+        c.execute('''DROP VIEW IF EXISTS {};'''.format(t))
+    for i, t in enumerate(tables + ['fact'+t for t in viewtables] + dimtables + deltatables + ['textstore','schemaversion']):
+        deletequery = '''DROP TABLE IF EXISTS {};'''
+        c.execute(deletequery.format(t))
     conn.commit()
+    migrate_db(conn, migrations)
+    for i, t in enumerate(tables):
+        query ='''PRAGMA table_info({});'''
+        print(c.execute(query.format(t)).fetchall())
     conn.close()
 
-# Comment or uncomment as needed
-reset_tables()
-# report_statistics()
-# update_table()   
+# Comment or uncomment as needed (the scraper imports the schema above, so only run these as a script)
+if __name__ == '__main__':
+    migrate()
+    # reset_tables()
+    # report_statistics()
 
@@ -0,0 +1,99 @@
+###############################################################################################################
+# Raw page store for the OLX and Wuzzuf scrapers
+#
+# The scrapers parse each page as soon as it is downloaded and then throw the HTML away, so a parsing bug means
+# the historical rows cannot be re-derived without re-crawling (and many of the ads no longer exist).  PageStore
+# keeps every fetched page in its own SQLite file, keyed by url and fetch time.  Bodies are zlib compressed and
+# stored once per content hash, so the identical pages returned on repeat visits take no extra space.
+#
+# The stored pages can be replayed through the parsing functions with the --replay option of the scrapers.
+###############################################################################################################
+
+import zlib
+import hashlib
+import threading
+import datetime
+
+from ScrapeDatabase import connect_db
+
+
+class PageStore:
+
+    # dbname: SQLite file the pages are kept in (kept apart from the main database as it grows quickly)
+    # commitevery: number of saved pages between commits
+    def __init__(self, dbname, commitevery=100):
+        self.dbname = dbname
+        self.commitevery = commitevery
+        self.conn = connect_db(dbname, check_same_thread=False)
+        self.lock = threading.Lock()
+        self.uncommitted = 0
+        self.stats = {'saved': 0, 'newbodies': 0}
+
+        c = self.conn.cursor()
+        c.execute('''CREATE TABLE IF NOT EXISTS pagebodies (
+            bodyhash VARCHAR(40),
+            body BLOB,
+            PRIMARY KEY(bodyhash));''')
+        c.execute('''CREATE TABLE IF NOT EXISTS pagefetches (
+            url VARCHAR(200),
+            fetchtime VARCHAR(32),
+            status INTEGER,
+            bodyhash VARCHAR(40),
+            PRIMARY KEY(url,fetchtime));''')
+        self.conn.commit()
+
+    #FUNCTION: stores the body fetched from url (fetchtime defaults to now in UTC)
+    def save(self, url, status, body, fetchtime=None):
+        if fetchtime is None:
+            fetchtime = datetime.datetime.now(datetime.timezone.utc)
+        if body is None:
+            body = b''
+        bodyhash = hashlib.sha1(body).hexdigest()
+
+        with self.lock:
+            c = self.conn.cursor()
+            if c.execute('''SELECT 1 FROM pagebodies WHERE bodyhash = ?;''', (bodyhash,)).fetchone() is None:
+                #only compress and store the body if we have not seen it before
+                c.execute('''INSERT INTO pagebodies (bodyhash,body) VALUES (?,?);''', (bodyhash, zlib.compress(body)))
+                self.stats['newbodies'] += 1
+            c.execute('''INSERT OR IGNORE INTO pagefetches (url,fetchtime,status,bodyhash) VALUES (?,?,?,?);''', (url, fetchtime.isoformat(), status, bodyhash))
+            self.stats['saved'] += 1
+            self.uncommitted += 1
+            if self.uncommitted >= self.commitevery:
+                self.conn.commit()
+                self.uncommitted = 0
+
+    #FUNCTION: returns (status, body) of the latest stored fetch of the url, or None if it was never stored
+    def get_latest(self, url):
+        query = '''SELECT f.status, b.body FROM pagefetches f LEFT JOIN pagebodies b ON f.bodyhash = b.bodyhash WHERE f.url = ? ORDER BY f.fetchtime DESC LIMIT 1;'''
+        with self.lock:
+            row = self.conn.execute(query, (url,)).fetchone()
+        if row is None:
+            return(None)
+        status, body = row
+        return(status, zlib.decompress(body) if body is not None else b'')
+
+    #FUNCTION: yields (url, fetchtime, status, body) for every stored fetch of a url starting with urlprefix
+    def iter_fetches(self, urlprefix='', since=None):
+        query = '''SELECT f.url, f.fetchtime, f.status, b.body FROM pagefetches f LEFT JOIN pagebodies b ON f.bodyhash = b.bodyhash WHERE f.url >= ? AND f.url < ?'''
+        params = [urlprefix, urlprefix + '\uffff']
+        if since is not None:
+            query = query + ''' AND f.fetchtime >= ?'''
+            params.append(since.isoformat())
+        query = query + ''' ORDER BY f.url, f.fetchtime;'''
+
+        #use a separate connection so that reading does not hold up any pages still being saved
+        conn = connect_db(self.dbname)
+        for url, fetchtime, status, body in conn.execute(query, params):
+            if body is not None:
+                body = zlib.decompress(body)
+            yield(url, datetime.datetime.fromisoformat(fetchtime), status, body)
+        conn.close()
+
+    def close(self):
+        with self.lock:
+            self.conn.commit()
+            self.conn.close()
+
+    def report(self):
+        return("Page store {}: {} pages saved, {} new page bodies".format(self.dbname, self.stats['saved'], self.stats['newbodies']))
@@ -0,0 +1,453 @@
+###############################################################################################################
+# Page parsing for the OLX and Wuzzuf scrapers
+#
+# The functions here turn a downloaded job ad page into the row that is written to the database.  They make no
+# requests and keep no state so that they can be used on pages just downloaded, on pages replayed from the page
+# store and in the parsing benchmark (BenchmarkParsers.py).
+#
+# Parsing used to take about as much CPU as the network wait, so pages are parsed with the C based lxml parser
+# when it is installed and only the parts of each page that the extractors read are built into the tree
+# (set targetedparsing = False to build the whole document).
+###############################################################################################################
+
+from bs4 import BeautifulSoup, SoupStrainer
+import numpy as np
+import re
+import datetime
+
+#parser backend handed to BeautifulSoup, lxml is several times faster than the pure python html.parser
+try:
+    import lxml
+    parser = 'lxml'
+except ImportError:
+    parser = 'html.parser'
+
+#only build the subtrees of the page that the extractors use
+targetedparsing = True
+
+#FUNCTION:  returns a SoupStrainer that keeps only the elements having one of the given classes (and their contents)
+def class_strainer(classes):
+    classes = set(classes)
+    def match(value):
+        if value is None:
+            return(False)
+        if isinstance(value, list):
+            value = ' '.join(value)
+        return(not classes.isdisjoint(value.split()))
+    return(SoupStrainer(attrs={'class': match}))
+
+#parts of the OLX ad page read by parse_OLXJobData (the ad text sits inside descriptioncontent)
+olxjobstrainer = class_strainer(['brlefte5','offerheadinner','descriptioncontent','pdingtop10','pricelabel','user-box','contactbox','contactbox-indent'])
+
+#parts of an OLX listing page read by parse_OLXJobPageUrls
+olxlistingstrainer = class_strainer(['pager','ads__item__info','ads__item__photos-holder'])
+
+#parts of the Wuzzuf job page read by parse_WuzzufJobData
+wuzzufjobstrainer = class_strainer(['alert-job','job-main-card','job-summary','about-job','job-requirements','industries'])
+
+#FUNCTION:  parses the page (its content, or a response to read it from) with the configured backend, keeping only
+#the parts matched by strainer
+def make_soup(page, strainer):
+    if hasattr(page, 'read'):
+        page = page.read()
+    if targetedparsing and strainer is not None:
+        return(BeautifulSoup(page, parser, parse_only=strainer))
+    return(BeautifulSoup(page, parser))
+
+
+#FUNCTION:  lxml turns the line breaks '\r\n' (and '\r') of a text into '\n' where html.parser keeps them, so they
+#are made '\n' in the text taken from a page to give the same row with either backend
+def normalize_breaks(text):
+    return(text.replace('\r\n','\n').replace('\r','\n'))
+
+
+#FUNCTION:  parses a job ad page (just downloaded or read back from the page store) into the row for jobadpagedata
+#datetimecur is the time the page was downloaded.  The text is stored untranslated ('AR'), the scraper translates it
+def parse_OLXJobData(uniqueadid, postdate, page, datetimecur):
+    
+    fields = ['Experience Level','Employment Type','Education Level','Type','Compensation']
+    fielddata = {}
+    
+    #a page that is gone (404/410) is parsed as an empty page so that the ad is marked closed
+    if page is None:
+        page = b''
+    soup = make_soup(page, olxjobstrainer)
+    #fall back to the full document if the ad text is not inside the parts of the page we kept
+    if targetedparsing and soup.find('span',attrs={'class':'pdingleft10 brlefte5'}) is not None and soup.find('div', attrs={'class':"clr", 'id':'textContent'}) is None:
+        soup = make_soup(page, None)
+    
+    #get content for ad posting data and check if available as some are no longer available
+    addata = soup.find('span',attrs={'class':'pdingleft10 brlefte5'})
+    
+    downloaddate = datetimecur.strftime('%Y-%m-%d')
+    downloadtime = datetimecur.strftime('%H:%M')
+
+    adstatus = 'OPEN'
+    # return NULL values if we cannot find the page any longer
+    if addata is None:
+        adstatus = 'CLOSED'
+        return(downloaddate, downloadtime, uniqueadid, postdate, np.NAN, np.NAN, np.NAN, np.NAN, np.NAN, np.NAN, np.NAN, np.NAN, np.NAN, np.NAN, np.NAN, np.NAN, np.NAN, np.NAN, np.NAN, np.NAN, adstatus)        
+    
+    #scrape the page if it does exist
+    addata = addata.get_text().strip()
+    #print(addata)
+    m = re.search(r"at (\d+:\d+, \d+ \w+ \d+), Ad ID: (\d+)",addata)
+    date = m.group(1)
+    adid = m.group(2)
+    dateval = datetime.datetime.strptime(date,'%H:%M, %d %B %Y')
+    postdate = dateval.strftime('%Y-%m-%d') # best time format for spreadsheet programs
+    posttime = dateval.strftime('%H:%M')
+    #print(uniqueadid,adid,postdate)
+    
+    #get title of job advertisement
+    temptitle = soup.find('div',attrs={'class':"clr offerheadinner pding15 pdingright20"})
+    title = normalize_breaks(temptitle.find('h1').get_text())
+    content = normalize_breaks(soup.find('div', attrs={'class':"clr", 'id':'textContent'}).get_text()).strip()
+
+    #the line breaks are kept here for the translator, the scraper stores them as '>' (see store_OLXrow())
+    content = content.encode('utf-8')
+    title = title.encode('utf-8')
+    texttype = 'AR'
+    
+    #get main content related to job
+    name_box = soup.find_all('div', attrs={'class': "clr descriptioncontent marginbott20"})
+    
+    for name in name_box:
+        #print(name)
+        newnames = name.find_all('td', attrs={'class' : 'col'})
+        #print(newnames)
+        for name in newnames:
+            cat = name.find('th').get_text().strip()
+            catval = name.find('td').get_text().strip()
+            fielddata[cat] = catval
+            #print(cat)
+            #print(catval)
+
+    #note that not all categories are always included in a job advertisement so we have to make sure there are contingencies
+    for f in fields:
+        if f not in fielddata:
+            fielddata[f] = np.NAN
+
+    views = soup.find_all('div',attrs={'class':'pdingtop10'})
+    #print(views)
+    for v in views:
+        if 'Views' in str(v):
+            m = re.search(r"Views:<strong>(\d+)</strong>", str(v))
+            pageviews = int(m.group(1))
+            #print(num_views)
+            
+    #get content related to compensation/price
+    comp = soup.find('div', attrs={'class': "pricelabel tcenter"})
+    if comp is not None:
+        compensation = comp.get_text().strip().replace(',','').strip(' EGP')
+        #print(compensation)
+    else:
+        compensation = fielddata['Compensation']
+    try:
+        compensation = int(compensation)
+    except:
+        compensation = np.NAN
+    #print(compensation)
+    
+    #get content related to identity of user/poster of ad
+    user = soup.find('div', attrs={'class':'user-box'})
+    if user is not None:
+        userhref = user.find('a')['href']
+        #print(userhref)
+        #print(userhref.split('/user/')[1].strip('/'))
+        username=user.find('p', attrs={'class':'user-box__info__name'}).get_text().strip().encode('utf-8')
+        userjoindate=user.find('p', attrs={'class':'user-box__info__age'}).get_text().strip()
+        m=re.search(r'On site since\s+(\w+)\s+(\d+)',userjoindate)
+        userjoinmonth = m.group(1)
+        userjoinyear = int(m.group(2))
+    else:
+        userhref = np.NAN
+        username = np.NAN
+        userjoindate = np.NAN
+        userjoinmonth = np.NAN
+        userjoinyear = np.NAN
+    
+    #email available?
+    emailinfo = soup.find('div', attrs={'class':"contactbox innerbox br3 bgfff rel"})
+    emailavail = 0
+    if emailinfo is not None:
+        if 'Email Seller' in emailinfo.get_text():
+            emailavail = 1
+
+    #phone available?
+    phoneinfo = soup.find('div', attrs={'class':"contactbox-indent rel brkword"})
+    phoneavail = 0
+    if phoneinfo is not None:
+        if 'Show phone' in phoneinfo.get_text().strip():
+            phoneavail = 1
+    
+    rowvalues = [downloaddate, downloadtime, uniqueadid, postdate, posttime, pageviews, title, fielddata['Experience Level'], fielddata['Education Level'], fielddata['Type'], fielddata['Employment Type'], compensation, content,texttype, userhref, username, userjoinmonth, userjoinyear, emailavail, phoneavail, adstatus]
+    #print(rowvalues)
+    #OLX field for compensation just got changed (17-Dec-2017)
+    return(rowvalues)
+
+
+#FUNCTION:  parses one page of an OLX subregion-sector listing into the rows for jobadpageurls
+#returns the total number of listing pages, the rows and the oldest post date on the page
+def parse_OLXJobPageUrls(page,region,freg,subregion,fsubreg,jobsector,datetimecur):
+    
+    soup = make_soup(page, olxlistingstrainer)
+    datecur = datetimecur.strftime("%Y-%m-%d")
+    
+    #now find out the total number of pages available
+    try:
+        nextpage = soup.find('div',attrs={'class':'pager rel clr'})
+        temp = nextpage.find('input',attrs={'type':"submit"})['class']
+        totalpages = re.search(r'(\d+)',str(temp[1])).group(1)
+        #print(temp,totalpages)
+    except:
+        totalpages = 1
+    
+    rows = []
+    yr = None
+    mt = None
+    day = None
+    adlinks = soup.find_all('div',attrs={'class':'ads__item__info'})
+    adphotos = soup.find_all('div',attrs={'class':"ads__item__photos-holder"})
+
+    #now loop through all of the relevant data and grab the ad information
+    for i, val1 in enumerate(adphotos):
+        #print(i)
+        val2 = adlinks[i]
+        temp1 = val1.find('img')
+        temp2 = val1.find('span',attrs={'class':"ads__item__paidicon icon paid"})
+        temp3 = val1.find('a',attrs={'data-statkey':'ad.observed.list'})
+        #there are some really old ads that are no longer active and do not have ids so we just skip over this
+        if temp3 is not None:
+            temp3a = temp3['class'][2]
+            #print(temp3a)
+            temp3b = re.search(r'{id:(\d+)}',temp3a)
+            uniqueadid = temp3b.group(1)
+            #print(temp1['src'])
+            temp4 = val2.find('a',attrs={'class':"ads__item__title"})
+            #print(temp4['href'])
+            urllinkshort = temp4['href'].split('/ad/')[1]
+            temp5 = val2.find('p',attrs={'class':'ads__item__date'})
+            tempdate = temp5.get_text().strip()
+            yr = datetimecur.year
+            mt = datetimecur.month
+            day = datetimecur.day
+            if 'Today' in tempdate:
+                postdate = datecur
+            elif 'Yesterday' in tempdate:
+                tempdatetime = datetimecur - datetime.timedelta(days=1)
+                postdate = tempdatetime.strftime("%Y-%m-%d")
+            else:
+                #print(tempdate)
+                months = {'Jan':1,'Feb':2,'Mar':3,'Apr':4,'May':5,'Jun':6,'Jul':7,'Aug':8,'Sep':9,'Oct':10,'Nov':11,'Dec':12}
+                tempdate2 = re.search(r'(\d+)\s+(\w+)',tempdate) 
+                day = tempdate2.group(1)
+                mt = months[tempdate2.group(2)]
+                #ads stay alive for three months tops need to catch cases when cross over between one year to next
+                if datetimecur.month - mt >= 0:
+                    yr = datetimecur.year
+                else:
+                    yr = datetimecur.year - 1
+                postdate = '{:04d}-{:02d}-{:02d}'.format(yr, mt, int(day))
+
+            i_photo = 0
+            i_featured = 0
+            if 'jobs-services-thumb.png' not in temp1['src']:
+                i_photo = 1
+            if temp2 is not None:
+                i_featured = 1
+            rowvalues = [region,freg,subregion,fsubreg,jobsector,postdate,uniqueadid,i_photo,i_featured,urllinkshort]
+            #print(rowvalues)
+            rows.append(rowvalues)
+
+    #now store the last date retrieved as the midaddate
+    #print(yr,mt,day)
+    try:
+        minaddate = datetime.date(int(yr),int(mt),int(day))
+    except:
+        minaddate = datetimecur.date()
+    return([int(totalpages), rows, minaddate])
+
+
+#this parses a job advertisement page (just downloaded or read back from the page store) into the row for pagedata
+#datetimecur is the time the page was downloaded and page is None if the page could not be retrieved
+punctuation = [";",",","'","&"]
+def parse_WuzzufJobData(uniqueid,postdate,page,datetimecur):
+
+    downloaddate = datetimecur.strftime('%Y-%m-%d')
+    downloadtime = datetimecur.strftime('%H:%M')
+    
+    #if the page is gone (404/410) then simply return the data empty
+    if page is None:
+         stat = 'NOT FOUND'
+         job_data = [uniqueid, postdate, np.NAN, downloaddate, downloadtime, stat,np.NAN,np.NAN,np.NAN,np.NAN,np.NAN,np.NAN,np.NAN,np.NAN,np.NAN,np.NAN,np.NAN,np.NAN,np.NAN,np.NAN,np.NAN,np.NAN,np.NAN,np.NAN,np.NAN,np.NAN,np.NAN]
+         return(job_data)
+    
+    soup = make_soup(page, wuzzufjobstrainer)
+    #print(soup)
+        
+    #check job status and see if it is open or closed
+    stat = "OPEN"
+    status = soup.find('div',attrs={'class':"alert alert-danger alert-job col-sm-12"})
+    
+    if status is not None:
+         stat = "CLOSED"
+    
+    #obtain main job data
+    
+    mainjobdata = soup.find('div', attrs={'class': 'job-main-card content-card'})
+    
+    #there is a few postings that may not be completely filled in
+    if mainjobdata is None:
+         job_data = [uniqueid, postdate, np.NAN, downloaddate, downloadtime, stat,np.NAN,np.NAN,np.NAN,np.NAN,np.NAN,np.NAN,np.NAN,np.NAN,np.NAN,np.NAN,np.NAN,np.NAN,np.NAN,np.NAN,np.NAN,np.NAN,np.NAN,np.NAN,np.NAN,np.NAN,np.NAN]
+         return(job_data)
+
+    #print(mainjobdata)
+    jobdata = mainjobdata.find_all(['h1','a','span'])
+    #print(jobdata)
+    jobinfo = {}
+
+    for d in jobdata:
+         try:
+              if d['class'][0] in ['job-title','job-company-name','job-company-location']:
+                   jobinfo[d['class'][0]] = d.get_text().strip().encode('utf-8')
+                   #print(jobinfo[d['class'][0]])
+         except KeyError:
+              pass
+
+    #get stats on applicants
+    try:
+        num_applicants = mainjobdata.find_all('div', attrs={'class': 'applicants-num'})[0].get_text()
+    except IndexError:
+        num_applicants = 0
+        
+    try:
+        num_vacancies = mainjobdata.find_all('span', attrs={'class': 'vacancies-num'})[0].get_text()
+    except IndexError:
+        num_vacancies = 0
+
+    stats = mainjobdata.find_all('div', attrs={'class': 'applicants-stat-num'})
+    #print(stats)
+    try:
+        num_seen = stats[0].get_text()
+    except IndexError:
+        num_seen = 0
+    try:
+        num_shortlist = stats[1].get_text()
+    except IndexError:
+        num_shortlist = 0
+    try:
+        num_rejected = stats[2].get_text()
+    except IndexError:
+        num_rejected = 0
+        
+    #get date when posted and download date
+    post_date = mainjobdata.find('p', attrs={'class': 'job-post-date'})
+    #print(mainjobdata.find('time',datetime=True))
+    #temp = mainjobdata.find('time',datetime=True)
+    #print(temp['datetime'])
+    #print(datetime.datetime.strptime(temp['datetime'],'%Y-%m-%dT%H:%M:%S'))
+    
+    #print(post_date['title'])
+    try:
+        pdate = datetime.datetime.strptime(post_date['title'],'%A, %B %d, %Y at %I:%M%p')
+    except ValueError:
+        pdate = datetime.datetime.strptime(post_date['title'],'%A, %B %d, %Y at%I:%M%p')
+    postdate = pdate.strftime('%Y-%m-%d')
+    posttime = pdate.strftime('%H:%M') # best time format for spreadsheet programs
+    
+    #now still need to split the post-date into a term that is valid
+    #print(post_date['title'])
+    
+    #obtain job summary information
+    jobsumm = soup.find('div', attrs={'class': 'row job-summary'})
+    jobsummdata = jobsumm.find_all(['dl'])
+    #print(jobsumm)
+    #print(jobdata)
+    for d in jobsummdata:
+        try:
+            temp = re.sub('\s+',' ',d.get_text()).strip().split(":")
+            name = re.sub('\s',"_",temp[0].lower())
+            if name in ['languages']:
+                jobinfo[name] = temp[1].strip().split(',')
+                jobinfo['languages'] = '>'.join(jobinfo['languages'])
+            elif name in ['salary']:
+                if 'Negotiable' in temp[1].strip().split(','):
+                    jobinfo[name] = temp[1].strip().split(',')
+                else:
+                    newtemp = temp[1].strip().replace(',','')
+                    jobinfo[name] = [newtemp]
+                jobinfo['salary']='>'.join(jobinfo['salary'])
+            else:
+                jobinfo[name] = temp[1].strip()
+        except KeyError:
+            pass
+        
+    #these columns are not consistent across jobs so need to take this into account
+    columns = ['experience_needed','career_level','job_type','salary','education_level','gender','travel_frequency','languages','vacancies']
+    for c in columns:
+        if c not in jobinfo:
+            jobinfo[c] = "NA"
+       
+    jobcard = soup.find('div', attrs={'class': "about-job content-card"})
+    #print(jobcard)
+    data = jobcard.find_all('div', attrs={'class': "labels-wrapper"})
+    #print(data)
+    jobroles = []
+    for d in data:
+        for role in d.find_all(['a']):
+            jobroles.append(role.get_text().strip())    
+    jobinfo['roles'] = '>'.join(jobroles)
+    #print(jobroles)
+        
+    #obtain job requirements, key words, and industry indicators
+    jobreqs = soup.find('div', attrs={'class': "job-requirements content-card"})
+    #print(jobreqs)
+    if jobreqs is not None:
+        data = jobreqs.find_all('meta', content=True)
+        keywords = []
+        try:
+            temp = data[0]['content']
+            for t in temp.split(', '):
+                keywords.append(t)
+            jobinfo['keywords'] = keywords
+        except IndexError:
+            jobinfo['keywords'] = []
+    else:
+        jobinfo['keywords'] = []
+    jobinfo['keywords']='>'.join(jobinfo['keywords']).encode('utf-8')
+    #print(jobinfo['keywords'])
+    
+    try:
+        data = jobreqs.find_all('li')
+        reqs = []
+        for d in data:
+            temp = d.get_text().lower().strip('.')
+            for p in punctuation:
+                temp = temp.replace(';','')
+            reqs.append(temp)
+        jobinfo['requirements'] = reqs
+        #print(reqs)
+    except:
+        jobinfo['requirements'] = []
+    jobinfo['requirements']='>'.join(jobinfo['requirements']).encode('utf-8')
+    
+    industries = soup.find('div', attrs={"class": "industries labels-wrapper"})
+    inds = []
+    
+    try:
+        indust = industries.find_all(['a'])
+        for ind in indust:
+            inds.append(ind.get_text().strip())
+    except:
+        pass
+    jobinfo['industries'] = '>'.join(inds).encode('utf-8')
+
+    #print(jobinfo)
+    # now let us return the dictionary entries to write to a csv file.  
+    #Note that we may need to split so we do not have problem with commas
+    job_data = [uniqueid, postdate, posttime, downloaddate, downloadtime, stat,jobinfo['job-title'],jobinfo['job-company-name'],jobinfo['job-company-location'],num_applicants,num_vacancies,num_seen,
+               num_shortlist,num_rejected,jobinfo['experience_needed'],jobinfo['career_level'],jobinfo['job_type'],jobinfo['salary'],
+               jobinfo['education_level'],jobinfo['gender'],jobinfo['travel_frequency'],jobinfo['languages'],jobinfo['vacancies'],jobinfo['roles'],jobinfo['keywords'],jobinfo['requirements'],jobinfo['industries']]
+    
+    return(job_data)
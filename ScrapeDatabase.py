@@ -0,0 +1,383 @@
+###############################################################################################################
+# Shared database connections and buffered writes for the OLX and Wuzzuf scrapers
+#
+# Every script opens egyptOLX.db and wuzzuf.db (and the page store and translation cache) with connect_db, which
+# switches the database to WAL journaling so that the analysis scripts can read while a scrape is writing, and
+# sets synchronous=NORMAL (WAL only syncs at checkpoints, a power cut may lose the last commits but never corrupts
+# the database), a larger page cache, memory mapped reads and a busy timeout so that a connection waits for the
+# write lock of another one rather than failing with 'database is locked'.
+#
+# The tables of each database are created and changed by the migrations listed in OLXDatabaseConversion.py and
+# WuzzufDatabaseConversion.py.  migrate_db applies the ones a database does not have yet, each in its own
+# transaction, and records their version in its schemaversion table.
+#
+# The long texts of an ad (title, description, requirements, ...) rarely change between its visits, so they are stored
+# once in the textstore table of the database, zlib compressed, under a key made from the text itself, and the rows
+# of each visit only hold the key.  connect_db registers the SQL functions the triggers and views of the databases use
+# to store and read back the texts (textkey, textcompress and textdecompress), so the views that read the texts can
+# only be queried through a connection opened with connect_db.
+#
+# Most of the other columns of a visit are the same as on the first visit of the ad too, only the page views (OLX) or
+# the applicant counts (Wuzzuf) change from one visit to the next.  encode_deltas stores such a table as one base row
+# for each ad, with the columns as they were when it was first stored, and one delta row for each visit that holds the
+# columns changing on every visit and only those of the others that differ from the base row.  The table is replaced
+# by a view of the same name that puts the rows back together (so reading the visits of one ad is a lookup of its delta
+# rows and one base row), with triggers that insert and delete its rows as before.
+#
+# The scrapers used to execute and commit the rows one at a time (a listing page, a subregion count, a job page),
+# and on the VM's slow disk the fsync of each commit took most of the database time.  BufferedWriter collects the
+# rows written to each table and hands them to the database with executemany, committing them in one transaction
+# once maxrows rows are waiting or the oldest has waited maxdelay seconds:
+#
+#   write(query, rowvalues)       -> buffers one row
+#   write_many(query, rows)       -> buffers several rows of the same query
+#   sync()                        -> executes the buffered rows without committing, so they can be read back
+#   flush()                       -> writes and commits everything buffered
+#
+# The rows are written in the order they were buffered, and everything buffered is flushed when the scraper exits
+# (including on SIGTERM/SIGHUP, e.g. when cron or the VM stops it), so a crash loses at most the last batch.  A
+# CrawlFrontier given the writer buffers its completed units with the rows, so a unit is never marked done in the
+# database before its rows are.
+###############################################################################################################
+
+import re
+import sys
+import zlib
+import time
+import atexit
+import signal
+import hashlib
+import sqlite3
+import datetime
+import threading
+
+#page cache and memory map of each connection in MB, and seconds a connection waits on the lock of another one
+cachesize = 64
+mmapsize = 256
+busytimeout = 60
+
+
+#FUNCTION: opens a connection to the SQLite database dbname with the settings above (check_same_thread=False for a
+#connection that is shared with the fetch and writer threads)
+def connect_db(dbname, check_same_thread=True):
+    conn = sqlite3.connect(dbname, timeout=busytimeout, check_same_thread=check_same_thread)
+    conn.execute('''PRAGMA journal_mode=WAL;''')
+    conn.execute('''PRAGMA synchronous=NORMAL;''')
+    conn.execute('''PRAGMA cache_size=-{};'''.format(cachesize*1024))
+    conn.execute('''PRAGMA mmap_size={};'''.format(mmapsize*1024*1024))
+    conn.execute('''PRAGMA busy_timeout={};'''.format(busytimeout*1000))
+    conn.execute('''PRAGMA temp_store=MEMORY;''')
+    conn.create_function('textkey', 1, text_key, deterministic=True)
+    conn.create_function('textcompress', 1, compress_text, deterministic=True)
+    conn.create_function('textdecompress', 1, decompress_text, deterministic=True)
+    return(conn)
+
+#texts stored once for all of the rows that have them (see the textstore helpers below)
+querytextstore = '''CREATE TABLE IF NOT EXISTS textstore (
+        textkey INTEGER PRIMARY KEY,
+        textdata BLOB);'''
+
+#FUNCTION: returns the key of a text in textstore, the first 64 bits of the SHA-1 of its type and content (so that the
+#key is the rowid of textstore).  Two texts could still have the same key, so a text is compared with the one already
+#stored under its key and a mismatch fails the insert (see get_storetext and store_texts) rather than one of them
+#reading back the other.
+def text_key(text):
+    if text is None:
+        return(None)
+    if isinstance(text, str):
+        data = b's' + text.encode('utf-8')
+    elif isinstance(text, bytes):
+        data = b'b' + text
+    else:
+        data = b'r' + repr(text).encode('utf-8')
+    return(int.from_bytes(hashlib.sha1(data).digest()[:8], 'big', signed=True))
+
+#FUNCTION: returns what is stored in textstore for a text.  Texts (some of the older rows hold them as BLOBs) are zlib
+#compressed into a BLOB whose first byte tells what it was: 's' a text, 'b' a BLOB, 'r' a BLOB that is kept as it is
+#as compressing it does not make it shorter.  A text that compressing does not make shorter (e.g. a short title) is
+#kept as it is.
+def compress_text(text):
+    if isinstance(text, str):
+        compressed = zlib.compress(text.encode('utf-8'))
+        if len(compressed) + 1 >= len(text.encode('utf-8')):
+            return(text)
+        return(b's' + compressed)
+    if isinstance(text, bytes):
+        compressed = zlib.compress(text)
+        if len(compressed) + 1 >= len(text):
+            return(b'r' + text)
+        return(b'b' + compressed)
+    return(text)
+
+#FUNCTION: returns the text stored in textstore as it was before compress_text
+def decompress_text(value):
+    if not isinstance(value, bytes):
+        return(value)
+    if value[:1] == b's':
+        return(zlib.decompress(value[1:]).decode('utf-8'))
+    if value[:1] == b'b':
+        return(zlib.decompress(value[1:]))
+    return(value[1:])
+
+#FUNCTION: for an INSTEAD OF trigger, the statements that add the text in column of the new row to textstore (checking
+#for the key rather than with OR IGNORE, as the conflict clause of the insert into the view would override it), after
+#aborting the insert if another text is stored under its key
+def get_storetext(column):
+    return('''SELECT RAISE(ABORT, 'textstore key collision') FROM textstore WHERE textkey = textkey(NEW.{0}) AND textdecompress(textdata) IS NOT NEW.{0};
+        INSERT INTO textstore (textkey,textdata) SELECT textkey(NEW.{0}), textcompress(NEW.{0})
+        WHERE NEW.{0} IS NOT NULL AND NOT EXISTS (SELECT 1 FROM textstore WHERE textkey = textkey(NEW.{0}));'''.format(column))
+
+#FUNCTION: for a view, the column that reads back the text stored under the key in keycolumn
+def get_storedtext(keycolumn, column):
+    return('''textdecompress((SELECT textdata FROM textstore WHERE textkey = {})) AS {}'''.format(keycolumn, column))
+
+#FUNCTION: for a migration, adds the texts of the columns of a table to textstore, raising ValueError if one of them
+#has the key of another text
+def store_texts(c, table, columns):
+    for column in columns:
+        c.execute('''INSERT OR IGNORE INTO textstore (textkey,textdata) SELECT textkey({0}), textcompress({0}) FROM (SELECT DISTINCT {0} FROM {1} WHERE {0} IS NOT NULL);'''.format(column, table))
+        query = '''SELECT COUNT(*) FROM (SELECT DISTINCT {0} FROM {1} WHERE {0} IS NOT NULL) t INNER JOIN textstore s ON s.textkey = textkey(t.{0})
+        WHERE textdecompress(s.textdata) IS NOT t.{0};'''
+        collisions = c.execute(query.format(column, table)).fetchall()[0][0]
+        if collisions > 0:
+            raise ValueError("{} texts of {}.{} have the key of another text in textstore".format(collisions, table, column))
+
+#FUNCTION: deletes the texts that no row refers to any more, keycolumns is {table: [columns holding a text key]}
+def delete_unusedtexts(c, keycolumns):
+    used = ' UNION '.join('''SELECT {0} FROM {1} WHERE {0} IS NOT NULL'''.format(column, table) for table, columns in keycolumns.items() for column in columns)
+    c.execute('''DELETE FROM textstore WHERE textkey NOT IN ({});'''.format(used))
+    return(c.rowcount)
+
+#FUNCTION: returns the SQL of the changedcolumns of a delta row: the bit of each of the deltacolumns (bit i for the i-th)
+#is set if its value in row (e.g. 'NEW.' in a trigger) differs from the base row b
+def get_changedcolumns(row, deltacolumns):
+    return(' + '.join('''(b.{0} IS NOT {1}{0}) * {2}'''.format(column, row, 1 << i) for i, column in enumerate(deltacolumns)))
+
+#FUNCTION: for a migration, stores table as one base row for each ad (each value of adkey) in base<table> and one delta
+#row for each of its rows in delta<table> (table without its 'fact' prefix), and replaces it with a view that puts the
+#rows back together.  The delta rows hold the visitcolumns (which must include adkey and the primary key of table) and
+#the other columns only where they differ from the base row, the bits of changedcolumns telling which.  The indexes and
+#triggers of table are dropped with it, so the migration creates them again on delta<table>.
+def encode_deltas(c, table, adkey, visitcolumns):
+    info = c.execute('''PRAGMA table_info({});'''.format(table)).fetchall()
+    columns = [row[1] for row in info]
+    types = dict((row[1], row[2]) for row in info)
+    keys = [row[1] for row in sorted(info, key=lambda row: row[5]) if row[5] > 0]
+    stored = [column for column in columns if column in visitcolumns]
+    deltacolumns = [column for column in columns if column not in visitcolumns]
+    if adkey not in stored or any(key not in stored for key in keys) or len(deltacolumns) > 62:
+        raise ValueError("Table {} can not be stored as deltas with the visit columns {}".format(table, visitcolumns))
+    name = table[len('fact'):] if table.startswith('fact') else table
+    base, delta = 'base'+name, 'delta'+name
+
+    c.execute('''CREATE TABLE IF NOT EXISTS {} (
+        {} {} NOT NULL,
+        {},
+        PRIMARY KEY({})) WITHOUT ROWID;'''.format(base, adkey, types[adkey], ',\n        '.join(column+' '+types[column] for column in deltacolumns), adkey))
+    c.execute('''CREATE TABLE IF NOT EXISTS {} (
+        {},
+        changedcolumns INTEGER,
+        {},
+        PRIMARY KEY({}));'''.format(delta, ',\n        '.join(column+' '+types[column] for column in stored), ',\n        '.join(column+' '+types[column] for column in deltacolumns), ','.join(keys)))
+
+    #the base row of an ad is its first row
+    c.execute('''INSERT INTO {0} ({1}, {2}) SELECT {1}, {2} FROM {3} WHERE rowid IN (SELECT MIN(rowid) FROM {3} WHERE {1} IS NOT NULL GROUP BY {1});'''.format(base, adkey, ', '.join(deltacolumns), table))
+    changed = ', '.join('''CASE WHEN b.{0} IS NOT f.{0} THEN f.{0} END'''.format(column) for column in deltacolumns)
+    c.execute('''INSERT INTO {0} ({1}, changedcolumns, {2}) SELECT {3}, {4}, {5} FROM {6} f LEFT JOIN {7} b ON b.{8} = f.{8} ORDER BY f.rowid;'''.format(
+        delta, ', '.join(stored), ', '.join(deltacolumns), ', '.join('f.'+column for column in stored), get_changedcolumns('f.', deltacolumns), changed, table, base, adkey))
+    c.execute('''DROP TABLE {};'''.format(table))
+
+    rebuilt = ['d.'+column if column in visitcolumns else '''CASE WHEN d.changedcolumns & {1} THEN d.{0} ELSE b.{0} END AS {0}'''.format(column, 1 << deltacolumns.index(column)) for column in columns]
+    c.execute('''CREATE VIEW IF NOT EXISTS {} AS
+    SELECT {}
+    FROM {} d LEFT JOIN {} b ON b.{} = d.{};'''.format(table, ', '.join(rebuilt), delta, base, adkey, adkey))
+    #checking for the base row rather than with OR IGNORE, as the conflict clause of the insert into the view would override it
+    changed = ', '.join('''CASE WHEN b.{0} IS NOT NEW.{0} THEN NEW.{0} END'''.format(column) for column in deltacolumns)
+    c.execute('''CREATE TRIGGER IF NOT EXISTS {0}_insert INSTEAD OF INSERT ON {0}
+    BEGIN
+        INSERT INTO {1} ({2}, {3}) SELECT NEW.{2}, {4} WHERE NEW.{2} IS NOT NULL AND NOT EXISTS (SELECT 1 FROM {1} WHERE {2} = NEW.{2});
+        INSERT INTO {5} ({6}, changedcolumns, {3}) SELECT {7}, {8}, {9} FROM (SELECT 1) LEFT JOIN {1} b ON b.{2} = NEW.{2};
+    END;'''.format(table, base, adkey, ', '.join(deltacolumns), ', '.join('NEW.'+column for column in deltacolumns), delta, ', '.join(stored),
+        ', '.join('NEW.'+column for column in stored), get_changedcolumns('NEW.', deltacolumns), changed))
+    #the base row goes with the last visit of the ad
+    c.execute('''CREATE TRIGGER IF NOT EXISTS {0}_delete INSTEAD OF DELETE ON {0}
+    BEGIN
+        DELETE FROM {1} WHERE {2};
+        DELETE FROM {3} WHERE {4} = OLD.{4} AND NOT EXISTS (SELECT 1 FROM {1} WHERE {4} = OLD.{4});
+    END;'''.format(table, delta, ' AND '.join('{0} IS OLD.{0}'.format(key) for key in keys), base, adkey))
+
+#FUNCTION: returns a date stored in any of the forms used over the years ('2017-9-5', '2017-09-05 10:31:00') as
+#'YYYY-MM-DD', which sorts and compares as text so that the date columns can be indexed and compared without DATE().
+#Values that are not a date are returned as they are.
+def normalize_date(value):
+    if value is None:
+        return(None)
+    m = re.match(r'\s*(\d{4})-(\d{1,2})-(\d{1,2})', str(value))
+    if m is None:
+        return(value)
+    return('{:04d}-{:02d}-{:02d}'.format(int(m.group(1)), int(m.group(2)), int(m.group(3))))
+
+#FUNCTION: brings the database up to date with migrations, a list of (version, description, migration) in order of
+#version where migration(c) makes the changes with the cursor c.  The migrations the database has not had yet are
+#run one at a time, each in its own transaction together with its row in schemaversion, so a migration that fails
+#leaves the database as it was before it.  Returns the version of the database.
+def migrate_db(conn, migrations):
+    #available to the migrations as an SQL function
+    conn.create_function('normalize_date', 1, normalize_date, deterministic=True)
+    c = conn.cursor()
+    c.execute('''CREATE TABLE IF NOT EXISTS schemaversion (
+        version INTEGER,
+        description VARCHAR(100),
+        applieddate DATE,
+        PRIMARY KEY(version));''')
+    conn.commit()
+    current = 0
+    for version, description, migration in migrations:
+        #take the write lock before checking the version, so that two scripts starting at once do not both migrate
+        c.execute('''BEGIN IMMEDIATE;''')
+        current = c.execute('''SELECT COALESCE(MAX(version), 0) FROM schemaversion;''').fetchall()[0][0]
+        if version <= current:
+            conn.commit()
+            continue
+        try:
+            migration(c)
+            c.execute('''INSERT INTO schemaversion (version, description, applieddate) VALUES (?,?,?);''', (version, description, datetime.date.today().strftime('%Y-%m-%d')))
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        current = version
+        print("Database migrated to version {}: {}".format(version, description))
+    return(current)
+
+#FUNCTION: for a migration, stores the dates of the columns in datecolumns ({table: [columns]}) as 'YYYY-MM-DD'.  A row
+#that would then be a duplicate of a row already stored with the date in the other form is dropped.  Tables created by
+#a later migration are skipped.
+def normalize_datecolumns(c, datecolumns):
+    existing = set(row[0] for row in c.execute('''SELECT name FROM sqlite_master WHERE type = 'table';''').fetchall())
+    for table, columns in datecolumns.items():
+        if table not in existing:
+            continue
+        for column in columns:
+            c.execute('''UPDATE OR IGNORE {0} SET {1} = normalize_date({1}) WHERE {1} != normalize_date({1});'''.format(table, column))
+            c.execute('''DELETE FROM {0} WHERE {1} != normalize_date({1});'''.format(table, column))
+            if c.rowcount > 0:
+                print("Duplicate rows dropped from {} as {} was stored in two forms: {}".format(table, column, c.rowcount))
+
+#FUNCTION: for a migration that changes the columns or keys of a table, which SQLite can not alter in place: the table
+#is renamed, created again with newtablequery and the columns (all of them if None) are copied over
+def rebuild_table(c, tablename, newtablequery, columns=None):
+    if columns is None:
+        columns = [row[1] for row in c.execute('''PRAGMA table_info({});'''.format(tablename)).fetchall()]
+    c.execute('''ALTER TABLE {} RENAME TO {}_temp;'''.format(tablename, tablename))
+    c.execute(newtablequery)
+    c.execute('''INSERT INTO {} ({}) SELECT {} FROM {}_temp;'''.format(tablename, ', '.join(columns), ', '.join(columns), tablename))
+    c.execute('''DROP TABLE {}_temp;'''.format(tablename))
+
+
+class BufferedWriter:
+
+    # conn: SQLite connection the rows are written to
+    # maxrows: number of buffered rows that are written in one transaction
+    # maxdelay: seconds a row may wait in the buffer before the buffer is written
+    def __init__(self, conn, maxrows=500, maxdelay=5.0):
+        self.conn = conn
+        self.maxrows = maxrows
+        self.maxdelay = maxdelay
+        self.lock = threading.RLock()
+        #list of [query, rows] in the order they were written, rows of the same query in a row share one entry
+        self.pending = []
+        #[query, rows] executed by sync() but not committed yet
+        self.executed = []
+        #rows not committed yet, whether still in pending or already executed by sync()
+        self.buffered = 0
+        self.oldest = None
+        self.closed = False
+        self.stats = {'rows': 0, 'commits': 0}
+        atexit.register(self.close)
+        set_signalhandlers()
+
+    def write(self, query, rowvalues):
+        self.write_many(query, [rowvalues])
+
+    def write_many(self, query, rows):
+        rows = list(rows)
+        if not rows:
+            return
+        with self.lock:
+            if self.pending and self.pending[-1][0] == query:
+                self.pending[-1][1].extend(rows)
+            else:
+                self.pending.append([query, rows])
+            self.buffered += len(rows)
+            if self.oldest is None:
+                self.oldest = time.time()
+            if self.buffered >= self.maxrows or time.time() - self.oldest >= self.maxdelay:
+                self.flush()
+
+    #FUNCTION: executes the buffered rows in the open transaction, they are committed by the next flush
+    def sync(self):
+        with self.lock:
+            if self.closed:
+                return
+            c = self.conn.cursor()
+            try:
+                while self.pending:
+                    c.executemany(*self.pending[0])
+                    self.executed.append(self.pending.pop(0))
+            except BaseException:
+                self.rollback()
+                raise
+
+    #FUNCTION: writes everything buffered and commits it (along with anything else executed on the connection)
+    def flush(self):
+        with self.lock:
+            if self.closed:
+                return
+            self.sync()
+            try:
+                self.conn.commit()
+            except BaseException:
+                self.rollback()
+                raise
+            self.executed = []
+            self.stats['rows'] += self.buffered
+            self.stats['commits'] += 1
+            self.buffered = 0
+            self.oldest = None
+
+    #FUNCTION: e.g. interrupted by a signal part way through a write, the transaction is rolled back rather than left
+    #half written and the rows it had are buffered again to be written by the next flush
+    def rollback(self):
+        self.conn.rollback()
+        self.pending = self.executed + self.pending
+        self.executed = []
+
+    def close(self):
+        with self.lock:
+            if self.closed:
+                return
+            try:
+                self.flush()
+            except Exception as e:
+                #e.g. the scraper closed the connection without closing the writer first
+                if self.pending:
+                    print("Buffered rows could not be written: {} ({})".format(self.buffered, e))
+            self.closed = True
+
+    def report(self):
+        return("Buffered writer: {} rows written in {} commits".format(self.stats['rows'], self.stats['commits']))
+
+
+#FUNCTION: turns SIGTERM and SIGHUP into a normal exit so that the buffered rows are flushed by atexit, unless the
+#scraper set its own handlers
+def set_signalhandlers():
+    if threading.current_thread() is not threading.main_thread():
+        return
+    for signame in ['SIGTERM', 'SIGHUP']:
+        signum = getattr(signal, signame, None)
+        if signum is not None and signal.getsignal(signum) == signal.SIG_DFL:
+            signal.signal(signum, exit_on_signal)
+
+def exit_on_signal(signum, frame):
+    sys.exit(128 + signum)
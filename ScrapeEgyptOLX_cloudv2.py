@@ -18,17 +18,109 @@
 import urllib
 import urllib.request as urlrequest
 from bs4 import BeautifulSoup
-import pandas as pd
-import numpy as np
 import re
+import sys
+import math
+import zlib
 import datetime
 import time
-import csv
-
-#set to True if are able to googletranslate otherwise set to false
+import argparse
+import os
+from ScrapeEngine import FetchEngine, FetchPipeline
+from ScrapeSession import HTTPSession, RateLimiter, CircuitBreaker, RetryPolicy, gonestatus
+from PageStore import PageStore
+from ScrapeFrontier import CrawlFrontier, RunBudget, get_deadline
+from ScrapeDatabase import BufferedWriter, connect_db, migrate_db
+from ScrapeScheduler import RevisitScheduler, to_date
+from OLXDatabaseConversion import migrations
+from ParsePages import parse_OLXJobData, parse_OLXJobPageUrls, normalize_breaks
+from TranslationCache import TranslationCache, StubTranslator
+
+#set to True if are able to googletranslate otherwise set to false (--translate switches it on)
 translation = False
+
+#number of ad pages fetched at the same time and the maximum of those that may be sent to olx.com.eg at once
+maxinflight = 8
+perhostlimit = 4
+
+#number of processes parsing the ad pages while they are downloaded (None for one per cpu)
+parseworkers = None
+
+#target requests per second to olx.com.eg, the rate limiter adapts between minrate and maxrate as the site responds
+requestrate = 4
+minrate = 0.5
+maxrate = 10
+
+argparser = argparse.ArgumentParser(description='Scrape the OLX job ads into egyptOLX.db')
+argparser.add_argument('--store-pages', action='store_true', help='keep a compressed copy of every page downloaded in the page store')
+argparser.add_argument('--replay', action='store_true', help='rebuild jobadpagedata from the page store without making any requests to the website')
+argparser.add_argument('--pagestore', help='SQLite file used for the page store (default egyptOLX_pages.db, or egyptOLX_shard<i>_pages.db with --shard)')
+argparser.add_argument('--revisit', choices=['velocity', 'weekly'], default='velocity', help='revisit the ads by how fast their page views change, or every week since they were posted')
+argparser.add_argument('--revisit-budget', type=int, default=20000, help='maximum number of ads revisited per day with --revisit velocity')
+argparser.add_argument('--deadline', help='stop starting new work at this time (HH:MM Egypt time) or after this many minutes, the rest is left to the next run')
+argparser.add_argument('--max-requests', type=int, help='stop starting new work after this many requests, the rest is left to the next run')
+argparser.add_argument('--shard', help='i/n to crawl only shard i (0 to n-1) of the subregions and ads into egyptOLX_shard<i>.db, see MergeOLXShards.py')
+argparser.add_argument('--base-url', help='send the requests for https://olx.com.eg to this server instead, e.g. http://127.0.0.1:8000 for LocalTestServer.py')
+argparser.add_argument('--translate', choices=['google', 'stub'], help='translate the ad titles and descriptions with googletrans (or with a stub that leaves them as they are, for testing)')
+args = argparser.parse_args()
+if args.translate is not None:
+    translation = True
+
+#with --shard i/n the subregions and ads are split between n worker nodes by a hash of the subregion or ad id.  Each
+#node crawls its own part into egyptOLX_shard<i>.db (which starts as a copy of egyptOLX.db) and the shards are then
+#merged back into egyptOLX.db with MergeOLXShards.py, which copies the merged database over each shard again
+shard = None
+dbname = "egyptOLX.db"
+if args.shard is not None:
+    shard = tuple(int(value) for value in args.shard.split('/'))
+    if len(shard) != 2 or not 0 <= shard[0] < shard[1]:
+        sys.exit("--shard should be i/n with 0 <= i < n")
+    dbname = "egyptOLX_shard{}.db".format(shard[0])
+if args.pagestore is None:
+    args.pagestore = 'egyptOLX_pages.db' if shard is None else 'egyptOLX_shard{}_pages.db'.format(shard[0])
+
+#FUNCTION:  whether a subregion or ad (by its fsubreg or uniqueadid) is crawled by this shard
+def in_shard(key):
+    return(shard is None or zlib.crc32(str(key).encode('utf-8')) % shard[1] == shard[0])
+
+pagestore = None
+if args.store_pages or args.replay:
+    pagestore = PageStore(args.pagestore)
+
+#the ad text is translated for a whole batch of ads at once (in the prepare thread of the fetch pipeline, ahead of
+#the writer), through a cache of every text translated before, so the same description seen at each revisit (or
+#posted in many ads) is only ever translated once
+translationcache = None
 if translation == True:
-   import googletrans
+    if args.translate == 'stub':
+        translator = StubTranslator()
+    else:
+        import googletrans
+        translator = googletrans.Translator()
+    translationcache = TranslationCache('egyptOLX_translations.db', translator)
+
+#fetch the listing pages of a subregion-sector concurrently, guessing how many are needed from earlier post rates
+speculativepages = True
+maxpagewindow = 6
+
+#stop reading a listing once this many ads in a row are already in jobadpageurls (0 to only stop on the post dates)
+knownrun = 10
+knownstops = 0
+
+#each region-sector listing is read in full once every fulllistingdays days (spread over the days by a hash of the
+#listing) and the ads it no longer shows are marked as likely closed rather than fetched every time (0 to switch off)
+fulllistingdays = 7
+#share of the ads marked likely closed that are fetched anyway to check the inference
+confirmshare = 0.05
+
+#every page request goes through one shared session that keeps connections to the website alive between requests
+#requests to a host that keeps failing are paused by the circuit breaker rather than retried until they time out
+ratelimiter = RateLimiter(rate=requestrate, minrate=minrate, maxrate=maxrate)
+breaker = CircuitBreaker()
+session = HTTPSession(timeout=30, maxidle=maxinflight, ratelimiter=ratelimiter, pagestore=pagestore if args.store_pages else None, breaker=breaker,
+                      rewrites={'https://olx.com.eg': args.base_url.rstrip('/')} if args.base_url else None)
+retrypolicy = RetryPolicy(session, maxattempts=5)
+listingengine = FetchEngine(maxinflight=maxpagewindow, perhostlimit=perhostlimit)
 
 #time on the website is listed in Egypt time
 from pytz import timezone
@@ -40,27 +132,36 @@ print("Start Time: {}".format(datecur))
 start_time = time.time()
 
 # open the sqlite and set the connection on the database
-import sqlite3
-conn = sqlite3.connect("egyptOLX.db")
+#the ad page rows are written by the writer thread of the fetch pipeline while this thread waits on it
+if shard is not None and not os.path.exists(dbname) and os.path.exists("egyptOLX.db"):
+    #a shard starts from a copy of the main database, for the subregions, known ads and visits it has (after that
+    #MergeOLXShards.py copies the merged database over the shard)
+    mainconn = connect_db("egyptOLX.db")
+    shardconn = connect_db(dbname)
+    mainconn.backup(shardconn)
+    shardconn.close()
+    mainconn.close()
+    print("Shard database {} copied from egyptOLX.db".format(dbname))
+conn = connect_db(dbname, check_same_thread=False)
 c = conn.cursor()
 
 #NOTE:  if want to create, reset or alter key tables in our database use 'OLXDatabaseConversion.py'
 
-#FUNCTION:  url request helper, set to only request an item 5 times
+#create the tables, or bring an older database up to date, with the migrations it does not have yet
+migrate_db(conn, migrations)
+
+#the rows are written with executemany and committed in batches of writer.maxrows rows (or every writer.maxdelay
+#seconds) rather than one at a time, whatever is buffered is written when the scraper exits
+writer = BufferedWriter(conn)
+
+#the day's work (region sweep, subregion counts, region-sector listings and ad pages) is kept in the crawlfrontier
+#table so that a run that dies part way through, or the next cron invocation, carries on where it stopped
+frontier = CrawlFrontier(conn, datecur.strftime('%Y-%m-%d'), writer=writer)
+budget = RunBudget(session, get_deadline(args.deadline, datecur), args.max_requests)
+
+#FUNCTION:  url request helper, retries transient errors up to 5 times and returns None if the page is gone (404/410)
 def request_until_succeed(url):
-    req = urlrequest.Request(url)
-    count = 1
-    while count <= 5:
-        try: 
-            response = urlrequest.urlopen(req)
-            if response.getcode() == 200:
-                return(response)
-        except Exception:
-            print("Exception")
-            time.sleep(1)
-            print("Error for URL %s: %s" % (url, datetime.datetime.now()))
-        count+=1
-    return(None)
+    return(retrypolicy.get(url))
 
 
 #FUNCTION: obtains aggregate counts by region of general ad postings and job ad postings
@@ -72,8 +173,7 @@ def get_OLXregiondata():
     downloadtime = datetimecur.strftime('%H:%M')
 
     url = 'https://olx.com.eg/en/sitemap/regions/'
-    req = urlrequest.Request(url)
-    response = urlrequest.urlopen(req)
+    response = session.get(url)
     soup = BeautifulSoup(response, 'html.parser')
     #print(soup)
     
@@ -112,59 +212,86 @@ def get_OLXregiondata():
             fsubregname = re.sub('[-](-)?(-)?','-',fsubregname)
             row = [downloaddate,downloadtime,regionname[i],fregname[i],subregname,fsubregname,totalposts[i],subposts]
             query = '''INSERT OR IGNORE INTO regionadcounts (downloaddate,downloadtime,region,freg,subregion,fsubreg,totalregposts,subposts) VALUES (?,?,?,?,?,?,?,?);'''
-            c.execute(query, row)
+            writer.write(query, row)
     
     #commit entries to the database
-    conn.commit()
+    writer.flush()
 
 # FUNCTION:  loops through the key industries above and regions to investigate the counts of postings
 # under each heading
 # an easier way is to just loop through the general regions  
     
-def write_OLXregionjobdata(rowstart=0):
+# The subregions are swept concurrently by the fetch engine (all requests share the session rate limit) and the
+# counts are written to the database by the buffered writer, progress is printed every printevery subregions.
+# Each subregion is a unit of the crawl frontier that is marked done in the same commit as its counts, so a run
+# that died part way through resumes where it stopped.
+def write_OLXregionjobdata(printevery=20):
     
     # NOTE SHOULD SELECT ONLY MOST RECENT DOWNLOAD DATE OF DATA
-    query = '''SELECT DISTINCT region, freg, subregion, fsubreg FROM regionadcounts WHERE DATE(downloaddate) >= DATE('{}', '-2 days');'''
-    data = pd.read_sql(query.format(datecur.strftime('%Y-%m-%d')),conn)
-    
-    #loop through 365 qism areas to get job data
-    for i, reg in data[rowstart:].iterrows():
-        
-        datetimecur = datetime.datetime.now(tz)
-        downloaddate = datetimecur.strftime('%Y-%m-%d')
-        downloadtime = datetimecur.strftime('%H:%M')
-        region = reg['region']
-        freg = reg['freg']
-        subregion = reg['subregion']
-        fsubreg = reg['fsubreg']
-        url = 'https://olx.com.eg/en/jobs-services/' + fsubreg + '/'
-        subregsector, subreghref = get_OLXJobUrls(url)
+    query = '''SELECT DISTINCT region, freg, subregion, fsubreg FROM regionadcounts WHERE downloaddate >= DATE(?, '-2 days') ORDER BY region, subregion;'''
+    subregions = [reg for reg in c.execute(query, (datecur.strftime('%Y-%m-%d'),)).fetchall() if in_shard(reg[3])]
+    frontier.add('subregion', [(reg[3], list(reg)) for reg in subregions])
+    print("Subregions already written today: {}".format(frontier.counts('subregion').get('done', 0)))
+    
+    query = '''INSERT OR IGNORE INTO regionjobadcounts (downloaddate,downloadtime,region,freg,subregion,fsubreg,sector,urlregsector,totalposts) VALUES (?,?,?,?,?,?,?,?,?);'''
+    written = 0
+    regs = {}
+    
+    def write_subregion(args, result):
+        nonlocal written
+        url = args[0]
+        region, freg, subregion, fsubreg = regs[url]
+        downloaddate, downloadtime, subregsector, subreghref = result
         
         #now want to output this data into the SQL database
+        batch = []
         for sector, numposts in subregsector.items():
             #print(subreghref[sector])
             rowvalues = [downloaddate,downloadtime,region,freg,subregion,fsubreg,sector,subreghref[sector],numposts]
-            query = '''INSERT OR IGNORE INTO regionjobadcounts (downloaddate,downloadtime,region,freg,subregion,fsubreg,sector,urlregsector,totalposts) VALUES (?,?,?,?,?,?,?,?,?);'''
-            c.execute(query,rowvalues)
-         
-        if i % 20 == 0:
-            print(i,rowvalues)
-        # sleep to make sure not too many requests are being made
-        conn.commit()
-        #time.sleep(1)            
+            batch.append(rowvalues)
+        writer.write_many(query, batch)
+        frontier.complete('subregion', fsubreg)
+        
+        written += 1
+        if written % printevery == 0:
+            print(written,batch[-1] if batch else fsubreg)
+    
+    def fail_subregion(args, e):
+        frontier.fail('subregion', regs[args[0]][3])
+    
+    #loop through 365 qism areas to get job data, subregions that failed are handed out again up to maxattempts
+    engine = FetchEngine(maxinflight=maxinflight, perhostlimit=perhostlimit)
+    units = frontier.lease('subregion')
+    while len(units) > 0:
+        tasks = []
+        for fsubreg, reg in units:
+            url = 'https://olx.com.eg/en/jobs-services/' + fsubreg + '/'
+            regs[url] = reg
+            tasks.append((url, (url,)))
+        engine.run(budget.take(tasks), get_OLXsubregionjobcounts, write_subregion, fail_subregion)
+        frontier.release('subregion', [fsubreg for fsubreg, reg in units])
+        if budget.exhausted():
+            break
+        units = frontier.lease('subregion')
+
+#FUNCTION: gets the counts of job ads by sector for one subregion along with the time they were downloaded
+def get_OLXsubregionjobcounts(url):
+    datetimecur = datetime.datetime.now(tz)
+    downloaddate = datetimecur.strftime('%Y-%m-%d')
+    downloadtime = datetimecur.strftime('%H:%M')
+    subregsector, subreghref = get_OLXJobUrls(url)
+    return([downloaddate, downloadtime, subregsector, subreghref])
 
- 
 #FUNCTION: obtains all of the sector variables and associated reference link that will be input into our database
+#Any error other than the page not being found is raised, so that the subregion is failed in the frontier and retried
 def get_OLXJobUrls(url):
     
     sector = {}
     href = {}
     
-    req = urlrequest.Request(url)
-    try:
-        response = urlrequest.urlopen(req)
-    #certain regions have no job postings
-    except:
+    response = request_until_succeed(url)
+    #certain regions have no job postings (the page is not found)
+    if response is None:
         return([sector,href])
         
         
@@ -193,386 +320,406 @@ def get_OLXJobUrls(url):
     
 #FUNCTION:  gets all the job page urls from subregion-sector listings
 #lets automate this so that it only downloads more recent data using last downloaddate
-def get_OLXJobPageUrls(region,freg,subregion,fsubreg,jobsector,url,lastdownloaddate):
-    
-    #query the database to find out the last date of download
-    
-    urllist = []
-    req = urlrequest.Request(url)
-    response = urlrequest.urlopen(req)
-    soup = BeautifulSoup(response, 'html.parser')
-    
-    #now find out the total number of pages available
-    try:
-        nextpage = soup.find('div',attrs={'class':'pager rel clr'})
-        temp = nextpage.find('input',attrs={'type':"submit"})['class']
-        totalpages = re.search(r'(\d+)',str(temp[1])).group(1)
-        #print(temp,totalpages)
-    except:
-        totalpages = 1
-    #print(totalpages)
-    
-    #set the minimum addate to the current date
-    datetimecur = datetime.datetime.now(tz)
-    minaddate = datetimecur.date()
-    cnt=1
+#The listing is read page by page until the ads are older than lastdownloaddate.  In speculative mode the number
+#of pages needed is estimated from postrate (ads posted per day in the subregion-sector before) and that window
+#of pages is fetched concurrently, then extended or cut short based on the post dates actually seen.
+#The listing is also cut short once knownrun ads in a row are in knownids (the ad ids we already have for it), as
+#the post dates only tell us the day and otherwise we re-read pages full of ads we already have.
+#With full set to True every page of the listing is read.  Returns the ids of the ads seen in the listing.
+def get_OLXJobPageUrls(region,freg,subregion,fsubreg,jobsector,url,lastdownloaddate,postrate=None,knownids=None,full=False):
+    global knownstops
+    if knownids is None:
+        knownids = set()
+    stoprun = knownrun
+    if full:
+        lastdownloaddate = datetime.date.min
+        stoprun = 0
+    
+    #the first page also tells us the total number of pages available
+    totalpages, rows, minaddate = get_OLXJobListingPage(url,region,freg,subregion,fsubreg,jobsector)
+    seenids = set(int(row[6]) for row in rows)
+    run = count_knownrun(rows, knownids, 0)
+    write_OLXjobadpageurls(rows)
+    if stoprun and run >= stoprun:
+        knownstops+=1
+        return(seenids)
+    
+    window = 1
+    if full:
+        window = maxpagewindow
+    elif speculativepages and postrate is not None:
+        adsperpage = max(1, len([row for row in rows if row[8] == 0]))
+        days = (datetime.datetime.now(tz).date() - lastdownloaddate).days + 1
+        window = int(math.ceil(postrate*days/adsperpage)) - 1
+    
+    cnt=2
     #check that the minumum ad date for a page is greater than the last downloaddate
-    while(minaddate >= lastdownloaddate and cnt <= int(totalpages)):
-    #for i in range(1,int(totalpages)+1):
-        #print("Enter")
-                
-        newurl = url
-        if cnt > 1:
-            newurl = url + '?page='+str(cnt)
-        #print(cnt, newurl)
-        req = urlrequest.Request(newurl)
-        response = urlrequest.urlopen(req)
-        soup = BeautifulSoup(response, 'html.parser')
+    while(minaddate >= lastdownloaddate and cnt <= totalpages):
+        window = max(1, min(window, maxpagewindow, totalpages - cnt + 1))
+        tasks = []
+        for p in range(cnt, cnt + window):
+            newurl = url + '?page='+str(p)
+            tasks.append((newurl, (newurl,region,freg,subregion,fsubreg,jobsector)))
         
-        #get the current time
-        datetimecur = datetime.datetime.now(tz)
-        datecur = datetimecur.strftime("%Y-%m-%d")
-    
-        adlinks = soup.find_all('div',attrs={'class':'ads__item__info'})
-        adphotos = soup.find_all('div',attrs={'class':"ads__item__photos-holder"})
-        
-        #now loop through all of the relevant data and grab the ad information
-        for i, val1 in enumerate(adphotos):
-            #print(i)
-            val2 = adlinks[i]
-            temp1 = val1.find('img')
-            temp2 = val1.find('span',attrs={'class':"ads__item__paidicon icon paid"})
-            temp3 = val1.find('a',attrs={'data-statkey':'ad.observed.list'})
-            #there are some really old ads that are no longer active and do not have ids so we just skip over this
-            if temp3 is not None:
-                temp3a = temp3['class'][2]
-                #print(temp3a)
-                temp3b = re.search(r'{id:(\d+)}',temp3a)
-                uniqueadid = temp3b.group(1)
-                #print(temp1['src'])
-                temp4 = val2.find('a',attrs={'class':"ads__item__title"})
-                #print(temp4['href'])
-                urllinkshort = temp4['href'].split('/ad/')[1]
-                temp5 = val2.find('p',attrs={'class':'ads__item__date'})
-                tempdate = temp5.get_text().strip()
-                yr = datetimecur.year
-                mt = datetimecur.month
-                day = datetimecur.day
-                if 'Today' in tempdate:
-                    postdate = datecur
-                elif 'Yesterday' in tempdate:
-                    tempdatetime = datetimecur - datetime.timedelta(days=1)
-                    postdate = tempdatetime.strftime("%Y-%m-%d")
-                else:
-                    #print(tempdate)
-                    months = {'Jan':1,'Feb':2,'Mar':3,'Apr':4,'May':5,'Jun':6,'Jul':7,'Aug':8,'Sep':9,'Oct':10,'Nov':11,'Dec':12}
-                    tempdate2 = re.search(r'(\d+)\s+(\w+)',tempdate) 
-                    day = tempdate2.group(1)
-                    mt = months[tempdate2.group(2)]
-                    #ads stay alive for three months tops need to catch cases when cross over between one year to next
-                    if datetimecur.month - mt >= 0:
-                        yr = datetimecur.year
-                    else:
-                        yr = datetimecur.year - 1
-                    postdate = str(yr)+'-'+str(mt)+'-'+str(day)
+        pages = listingengine.fetch_ordered(tasks, get_OLXJobListingPage)
+        for pagetotal, rows, minaddate in pages:
+            seenids.update(int(row[6]) for row in rows)
+            run = count_knownrun(rows, knownids, run)
+            write_OLXjobadpageurls(rows)
+            cnt+=1
+            if minaddate < lastdownloaddate or (stoprun and run >= stoprun):
+                #the rest of the window is not needed so cancel the requests that have not gone out yet
+                pages.close()
+                break
+        if stoprun and run >= stoprun:
+            knownstops+=1
+            break
         
-                i_photo = 0
-                i_featured = 0
-                if 'jobs-services-thumb.png' not in temp1['src']:
-                    i_photo = 1
-                if temp2 is not None:
-                    i_featured = 1
-                rowvalues = [region,freg,subregion,fsubreg,jobsector,postdate,uniqueadid,i_photo,i_featured,urllinkshort]
-                #print(rowvalues)
-                query = '''INSERT OR IGNORE INTO jobadpageurls (region, freg, subregion, fsubreg, jobsector, postdate, uniqueadid, i_photo, i_featured,
-                urllinkshort) VALUES(?,?,?,?,?,?,?,?,?,?);'''
-                c.execute(query,rowvalues)
-                conn.commit()
-    
-        #now store the last date retrieved as the midaddate
-        #print(yr,mt,day)
-        try:
-            minaddate = datetime.date(int(yr),int(mt),int(day))
-        except:
-            minaddate = datetimecur.date()
-        cnt+=1
-        time.sleep(1)
-    conn.commit()
+        #the estimate fell short so keep going with windows of at least two pages
+        if speculativepages and postrate is not None:
+            window = max(2, window)
+    #the new ads are counted and the listing compared with jobadlistings once this returns
+    writer.sync()
+    return(seenids)
+
+#FUNCTION:  carries on the count of ads in a row whose ids are already in knownids (run is the count at the end
+#of the previous page) through rows and returns it, stopping once it reaches knownrun.  The ids in rows are then
+#added to knownids.
+def count_knownrun(rows, knownids, run):
+    for row in rows:
+        if knownrun and run >= knownrun:
+            break
+        #featured ads are pinned to the top of the listing whatever their age so they do not count either way
+        if row[8] == 1:
+            continue
+        if int(row[6]) in knownids:
+            run+=1
+        else:
+            run = 0
+    knownids.update(int(row[6]) for row in rows)
+    return(run)
+
+#FUNCTION:  downloads one page of a subregion-sector listing and returns the total pages, the ads and the oldest post date
+def get_OLXJobListingPage(url,region,freg,subregion,fsubreg,jobsector):
+    response = session.get(url)
+    #get the current time
+    datetimecur = datetime.datetime.now(tz)
+    return(parse_OLXJobPageUrls(response,region,freg,subregion,fsubreg,jobsector,datetimecur))
+
+def write_OLXjobadpageurls(rows):
+    query = '''INSERT OR IGNORE INTO jobadpageurls (region, freg, subregion, fsubreg, jobsector, postdate, uniqueadid, i_photo, i_featured,
+    urllinkshort) VALUES(?,?,?,?,?,?,?,?,?,?);'''
+    writer.write_many(query, rows)
+    
+    #jobadpageurls keeps one row per ad and post date, so the listings the ad was seen in are kept in jobadlistings
+    seendate = datetime.datetime.now(tz).strftime('%Y-%m-%d')
+    query = '''INSERT OR IGNORE INTO jobadlistings (uniqueadid, freg, fsubreg, jobsector, firstseen, lastseen) VALUES (?,?,?,?,?,?);'''
+    writer.write_many(query, [(row[6],row[1],row[3],row[4],seendate,seendate) for row in rows])
+    query = '''UPDATE jobadlistings SET lastseen = ? WHERE uniqueadid = ? AND fsubreg = ? AND jobsector = ?;'''
+    writer.write_many(query, [(seendate,row[6],row[3],row[4]) for row in rows])
+    #an ad that shows up in a listing again was not closed after all
+    query = '''DELETE FROM jobadinferredclosed WHERE uniqueadid = ?;'''
+    writer.write_many(query, [(row[6],) for row in rows])
+
+#FUNCTION:  marks the ads of a region-sector listing that was just read in full, but that it no longer shows, as
+#likely closed.  Ads seen today under another listing and ads not seen for the 3 months an ad stays up are left out.
+def infer_OLXclosedads(fsubreg, jobsector, seenids):
+    seendate = datetime.datetime.now(tz).strftime('%Y-%m-%d')
+    cutoff = (datecur - datetime.timedelta(days=93)).strftime('%Y-%m-%d')
+    query = '''SELECT l.uniqueadid FROM jobadlistings l WHERE l.fsubreg = ? AND l.jobsector = ? AND l.lastseen >= ?
+    AND NOT EXISTS (SELECT 1 FROM jobadlistings o WHERE o.uniqueadid = l.uniqueadid AND o.lastseen = ?);'''
+    missing = [row[0] for row in c.execute(query, (fsubreg, jobsector, cutoff, seendate)).fetchall() if row[0] not in seenids]
+    query = '''INSERT OR IGNORE INTO jobadinferredclosed (uniqueadid, fsubreg, jobsector, inferreddate) VALUES (?,?,?,?);'''
+    writer.write_many(query, [(uniqueadid, fsubreg, jobsector, seendate) for uniqueadid in missing])
+    return(len(missing))
+
+#FUNCTION:  whether the ad marked likely closed is one of the confirmshare of them fetched anyway to check the
+#inference (picked by a hash of the id so a restarted run picks the same ones)
+def is_confirmsample(uniqueadid):
+    return(zlib.crc32(str(uniqueadid).encode('utf-8')) % 1000 < confirmshare*1000)
+
+#FUNCTION:  ads posted per day in a subregion-sector over the previous weeks, used to estimate how many listing pages
+#have to be read to get back to the last download date
+def get_OLXpostrate(fsubreg, jobsector, days=28):
+    query = '''SELECT COUNT(*) FROM jobadpageurls WHERE fsubreg = ? AND jobsector = ? AND postdate >= ?;'''
+    cutoff = (datecur.date() - datetime.timedelta(days=days)).strftime('%Y-%m-%d')
+    cnt = c.execute(query, (fsubreg, jobsector, cutoff)).fetchall()[0][0]
+    return(cnt/days)
 
  
-#FUNCTION:  gets the data from each job page need to alter to insert into database
-#Already checked and cleaned
-def get_OLXJobData(uniqueadid, postdate, url):
-    
-    fields = ['Experience Level','Employment Type','Education Level','Type','Compensation']
-    fielddata = {}
+#FUNCTION:  downloads a job ad page and returns the arguments parse_OLXJobData needs to turn it into a row
+def fetch_OLXJobPage(uniqueadid, postdate, url):
     
     #print(url)
     response = request_until_succeed(url)
-    
-    soup = BeautifulSoup(response, 'html.parser')
-    
-    #get content for ad posting data and check if available as some are no longer available
-    addata = soup.find('span',attrs={'class':'pdingleft10 brlefte5'})
+    page = None
+    if response is not None:
+        page = response.read()
     
     ### note want to add in the actual time download if we are to use the page views as proxy    
     datetimecur = datetime.datetime.now(tz)
-    downloaddate = datetimecur.strftime('%Y-%m-%d')
-    downloadtime = datetimecur.strftime('%H:%M')
+    return(uniqueadid, postdate, page, datetimecur)
+
+#FUNCTION:  translates the titles and descriptions of the ad rows (from parse_OLXJobData) in place, all of the rows
+#with a single call to the translation cache.  The rows are only changed once all of them are translated.
+def translate_OLXtexts(rows):
+    titles = translationcache.translate_many([rowvalues[6].decode('utf-8') for rowvalues in rows])
+    contents = translationcache.translate_many([rowvalues[12].decode('utf-8') for rowvalues in rows])
+    for rowvalues, title, content in zip(rows, titles, contents):
+        rowvalues[6] = title.encode('utf-8')
+        rowvalues[12] = normalize_breaks(content).encode('utf-8')
+        rowvalues[13] = 'EN'
+
+#FUNCTION:  translates the ad rows if translation is switched on.  If the translator fails on the batch the rows are
+#translated one at a time, and the rows it still fails on are stored untranslated (textlanguage 'AR')
+def translate_OLXrows(rows):
+    if translationcache is None:
+        return(rows)
+    rows = [rowvalues for rowvalues in rows if rowvalues[13] == 'AR']
+    try:
+        translate_OLXtexts(rows)
+    except Exception as e:
+        print("Error translating {} ads, translating them one at a time: {}".format(len(rows), e))
+        for rowvalues in rows:
+            try:
+                translate_OLXtexts([rowvalues])
+            except Exception as e:
+                print("Error translating ad {}, stored untranslated: {}".format(rowvalues[2], e))
+    return(rows)
+
+#FUNCTION:  returns the ad row (from parse_OLXJobData) as it is stored, with the line breaks of the description as
+#'>'.  The parser keeps them as they are so that the translator sees the text as it was posted, a '>' written in the
+#ad is not taken for a line break.
+def store_OLXrow(rowvalues):
+    rowvalues = list(rowvalues)
+    if isinstance(rowvalues[12], bytes):
+        rowvalues[12] = rowvalues[12].replace(b'\n', b'>')
+    return(rowvalues)
 
-    adstatus = 'OPEN'
-    # return NULL values if we cannot find the page any longer
-    if addata is None:
-        adstatus = 'CLOSED'
-        return(downloaddate, downloadtime, uniqueadid, postdate, np.NAN, np.NAN, np.NAN, np.NAN, np.NAN, np.NAN, np.NAN, np.NAN, np.NAN, np.NAN, np.NAN, np.NAN, np.NAN, np.NAN, np.NAN, np.NAN, adstatus)        
-    
-    #scrape the page if it does exist
-    addata = addata.get_text().strip()
-    #print(addata)
-    m = re.search(r"at (\d+:\d+, \d+ \w+ \d+), Ad ID: (\d+)",addata)
-    date = m.group(1)
-    adid = m.group(2)
-    dateval = datetime.datetime.strptime(date,'%H:%M, %d %B %Y')
-    postdate = dateval.strftime('%Y-%m-%d') # best time format for spreadsheet programs
-    posttime = dateval.strftime('%H:%M')
-    #print(uniqueadid,adid,postdate)
-    
-    #get title of job advertisement
-    temptitle = soup.find('div',attrs={'class':"clr offerheadinner pding15 pdingright20"})
-    title = temptitle.find('h1').get_text()
-    content = soup.find('div', attrs={'class':"clr", 'id':'textContent'}).get_text().strip()
+#FUNCTION:  rebuilds the jobadpagedata rows from the ad pages kept in the page store without making any requests
+#to the website, e.g. to re-derive historical rows after fixing a bug in parse_OLXJobData
+def replay_OLXjobadpagedata():
 
-    #translate the text as needed
-    if translation == True:
-        translator = googletrans.Translator()
-        content = translator.translate(content).text.replace('\r',' ').replace('\n','>').encode('utf-8')
-        title = translator.translate(title).text.encode('utf-8')
-        texttype = 'EN'
-    else:
-        content = content.replace('\r',' ').replace('\n','>').encode('utf-8')
-        title = title.encode('utf-8')
-        texttype = 'AR'
-    
-    #get main content related to job
-    name_box = soup.find_all('div', attrs={'class': "clr descriptioncontent marginbott20"})
-    
-    for name in name_box:
-        #print(name)
-        newnames = name.find_all('td', attrs={'class' : 'col'})
-        #print(newnames)
-        for name in newnames:
-            cat = name.find('th').get_text().strip()
-            catval = name.find('td').get_text().strip()
-            fielddata[cat] = catval
-            #print(cat)
-            #print(catval)
-
-    #note that not all categories are always included in a job advertisement so we have to make sure there are contingencies
-    for f in fields:
-        if f not in fielddata:
-            fielddata[f] = np.NAN
-
-    views = soup.find_all('div',attrs={'class':'pdingtop10'})
-    #print(views)
-    for v in views:
-        if 'Views' in str(v):
-            m = re.search(r"Views:<strong>(\d+)</strong>", str(v))
-            pageviews = int(m.group(1))
-            #print(num_views)
-            
-    #get content related to compensation/price
-    comp = soup.find('div', attrs={'class': "pricelabel tcenter"})
-    if comp is not None:
-        compensation = comp.get_text().strip().replace(',','').strip(' EGP')
-        #print(compensation)
-    else:
-        compensation = fielddata['Compensation']
+    #the page store is keyed by url so look up the ad id and post date from the short link of each ad
+    query = '''SELECT urllinkshort, uniqueadid, postdate FROM jobadpageurls;'''
+    adurls = {}
+    for urllinkshort, uniqueadid, postdate in c.execute(query).fetchall():
+        adurls[urllinkshort] = (uniqueadid, postdate)
+
+    query = '''INSERT OR REPLACE INTO jobadpagedata (downloaddate,downloadtime,uniqueadid,postdate,posttime,pageviews,title,experiencelevel,educationlevel,type,employtype,compensation,description,textlanguage,userhref,username,userjoinmt,userjoinyear,emailavail,phoneavail,
+    adstatus)
+    VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?);'''
+    replayed = 0
+    skipped = 0
+    #the rows are written (and translated) in batches
+    rows = []
+    for url, fetchtime, status, body in pagestore.iter_fetches('https://olx.com.eg/en/ad/'):
+        urllinkshort = url.split('/en/ad/')[1]
+        #an ad that was gone (404/410) is parsed as the live run does, giving a CLOSED row, the other errors never
+        #produced a row
+        if (status != 200 and status not in gonestatus) or urllinkshort not in adurls:
+            skipped += 1
+            continue
+        uniqueadid, postdate = adurls[urllinkshort]
+        page = body if status == 200 else None
+        rows.append(parse_OLXJobData(uniqueadid, postdate, page, fetchtime.astimezone(tz)))
+        replayed += 1
+        if len(rows) >= 200:
+            translate_OLXrows(rows)
+            writer.write_many(query, [store_OLXrow(rowvalues) for rowvalues in rows])
+            rows = []
+    translate_OLXrows(rows)
+    writer.write_many(query, [store_OLXrow(rowvalues) for rowvalues in rows])
+    writer.flush()
+    print("Replayed pages into jobadpagedata: {} (skipped {})".format(replayed, skipped))
+
+if args.replay:
+    replay_OLXjobadpagedata()
+    pagestore.close()
+    writer.close()
+    conn.close()
+    if translationcache is not None:
+        translationcache.close()
+        print(translationcache.report())
+    print("Run Time: {}".format(time.time()-start_time))
+    sys.exit()
+
+#write one entry per day to the OLXregiondata job database (with --shard only shard 0 sweeps the regions, the
+#others use the subregions of the copy of egyptOLX.db they started from)
+if shard is None or shard[0] == 0:
+    frontier.add('regions', [('sitemap', None)])
+for workkey, payload in frontier.lease('regions') if not budget.exhausted() else []:
     try:
-        compensation = int(compensation)
-    except:
-        compensation = np.NAN
-    #print(compensation)
-    
-    #get content related to identity of user/poster of ad
-    user = soup.find('div', attrs={'class':'user-box'})
-    if user is not None:
-        userhref = user.find('a')['href']
-        #print(userhref)
-        #print(userhref.split('/user/')[1].strip('/'))
-        username=user.find('p', attrs={'class':'user-box__info__name'}).get_text().strip().encode('utf-8')
-        userjoindate=user.find('p', attrs={'class':'user-box__info__age'}).get_text().strip()
-        m=re.search(r'On site since\s+(\w+)\s+(\d+)',userjoindate)
-        userjoinmonth = m.group(1)
-        userjoinyear = int(m.group(2))
+        get_OLXregiondata()
+    except Exception as e:
+        #the subregions swept in the last two days are still used below
+        print("Error for URL %s: %s (%s)" % ('https://olx.com.eg/en/sitemap/regions/', datetime.datetime.now(), e))
+        frontier.fail('regions', workkey)
     else:
-        userhref = np.NAN
-        username = np.NAN
-        userjoindate = np.NAN
-        userjoinmonth = np.NAN
-        userjoinyear = np.NAN
-    
-    #email available?
-    emailinfo = soup.find('div', attrs={'class':"contactbox innerbox br3 bgfff rel"})
-    emailavail = 0
-    if emailinfo is not None:
-        if 'Email Seller' in emailinfo.get_text():
-            emailavail = 1
-
-    #phone available?
-    phoneinfo = soup.find('div', attrs={'class':"contactbox-indent rel brkword"})
-    phoneavail = 0
-    if phoneinfo is not None:
-        if 'Show phone' in phoneinfo.get_text().strip():
-            phoneavail = 1
-    
-    rowvalues = [downloaddate, downloadtime, uniqueadid, postdate, posttime, pageviews, title, fielddata['Experience Level'], fielddata['Education Level'], fielddata['Type'], fielddata['Employment Type'], compensation, content,texttype, userhref, username, userjoinmonth, userjoinyear, emailavail, phoneavail, adstatus]
-    #print(rowvalues)
-    #OLX field for compensation just got changed (17-Dec-2017)
-    return(rowvalues)
-
-#Test for OLXJobData Query
-#get_OLXJobData(np.NAN, np.NAN, 'https://olx.com.eg/en/ad/-ID8t16m.html')
-
-                
-#FUNCTION:  create file listing of all job page urls (should be about ~100K)
-#Note:  Need to alter this to potentially grab only the most recent data
-#Note:  Need to grab indicator if ad is a featured ad
-#Note:  Need to look for indicator 'Today' plus time
-#Note:  Need to look at indicator 'Yesterday' plus time
-#Note:  Then look for date which does not list the year.....will have to take into account when year switches over from 2017 to 2018.
-#Note:  "ads__item__date"
-#Note:  "ads has photo"  if not "ads__item__photos" https://olxegstatic-a.akamaihd.net/dc88180-1111/naspersclassifieds-regional/olxmena-atlas-web/static/img/categories-thumbs/jobs-services-thumb.png
-query = '''INSERT OR IGNORE INTO jobadpageurls (region, freg, subregion, fsubreg, jobsector, postdate, posttime, uniqueadid, i_photo, i_featured,
-        urllinkshort VALUES(?,?,?,?,?,?,?,?,?,?,?);'''
-
-def write_OLXJobUrls(lastdownloaddate, sector,datast=0):
-    #sector names
-    sectornames = []
-    for key, val in sector.items():
-        if key != 'Jobs Wanted':
-            sectornames.append(key)
-        
-    #loop through 365 qism areas to get job data
-    for i, reg in data[datast:].iterrows():
-            
-        print(reg['fsubregname'])
-        #write each regional data to a separate file to reduce having to re-do downloads in case of failure
-        with open('OLX_joburls_'+reg['fsubregname']+'_'+dateval+'.csv', 'w', newline='') as file:
-            w = csv.writer(file)
-            w.writerow(["sector","region","subregion","jobpageurl"])
-            
-            fsubregname = reg['fsubregname']
-            url = 'https://olx.com.eg/en/jobs-services/' + fsubregname + '/'
-            subregsector, subreghref = get_OLXJobUrls(url)
-            
-            #now want to grab each of the urls for each subreg and subsector
-            for subregsector, href in subreghref.items():
-                #print(href)
-                urlpages = get_OLXJobPageUrls(freg,fsubreg,subregsector,href,lastdownloaddate)
-                #print(len(urlpages))
-                for urlp in urlpages:
-                    w.writerow([subregsector,reg['region'],reg['subregion'],urlp])
-            if i % 20 == 0:
-                print(subregsector,reg['region'],reg['subregion'],urlp)
-        file.close()
-                
-#FUNCTION:  write queries from each job page data into the SQL database
-#NOTE:  STILL NEED TO FIX THIS
-def write_OLXjobpagedata(datast=0):
-    
-    #sector names
-    sectornames = []
-    for key, val in sector.items():
-        sectornames.append(key)
-    
-    urllist = {}
-    
-    op = 'a'
-    if datast == 0:
-        op = 'w'
-    
-    #write out the data for each job page
-    with open('OLX_jobpagedata_'+dateval+'.csv', op, newline='') as file:
-        w = csv.writer(file)
-        if datast == 0:
-            w.writerow(["downloaddate","id","url","postdate","sector","region","subregion","jobcontent","num_views","explevel","emptype","educlevel","employertype","compensation"])
-    
-        #loop through 365 qism areas to call the files containing the different urls
-        for i, reg in data[datast:].iterrows():
-            fsubregname = reg['fsubregname']
-            print(fsubregname)
-            urllist[fsubregname]=pd.read_csv('OLX_joburls_'+reg['fsubregname']+'_'+dateval+'.csv')
-            for j, row in urllist[fsubregname].iterrows():
-                temp = row['jobpageurl'].split('ad/')[1]
-                newurl = 'https://olx.com.eg/en/ad/'+temp
-                rowdata = get_OLXjobdata(newurl,row['sector'],row['region'],row['subregion'])
-                w.writerow(rowdata)
-                time.sleep(1)   
-  
-    file.close()
-                
-                
-#write one entry per day to the OLXregiondata job database
-get_OLXregiondata()
+        frontier.complete('regions', workkey)
+    writer.flush()
 
 #Loop through each of the subregions and get the job data counts by sector
 #NOTE:  Because this program runs so slow we should check whether entries exist or not.  If exist do not re-survey.....can start the row sampling from 0 to 365 (good for testing)
+#subregions already surveyed today are marked done in the frontier and skipped
 
-write_OLXregionjobdata(rowstart=0)
+write_OLXregionjobdata()
 print("Run Time to execute write_OLXregionjobdata: {}".format(time.time()-start_time))
 
-#Now insert new data into table jobadpageurls (we probably should query on both sector and subregion since the website is very slow)
-#loop through ~2697 region-qism areas to get job data (this is quite substantial) how to do less?
-datast = 0
-#select only region sectors where total posts have changed at least once over the last 5 days
-query = '''SELECT DISTINCT a.region, a.freg, a.subregion, a.fsubreg, a.sector, a.urlregsector FROM regionjobadcounts a INNER JOIN regionjobadcounts b ON a.region = b.region AND a.subregion = b.subregion AND a.sector = b.sector WHERE DATE(a.downloaddate,'+5 DAYS') >= (SELECT DISTINCT MAX(DATE(downloaddate)) FROM regionjobadcounts) AND (a.totalposts != b.totalposts) AND DATE(a.downloaddate,'-2 DAYS') == DATE(b.downloaddate);'''
-
-regsector = c.execute(query).fetchall()
-print("Region-sectors to grab: {}".format(len(regsector)))
-
-
-# NOTE:  A more efficient query will only hit the pages where there is likely to have been a change in 
-# job ads entered from the last time we have accessed the dataset.... (STILL NEED TO PROGRAM THIS)
-
-for i, reg in enumerate(regsector[datast:]):
-    query = '''SELECT uniqueadid FROM jobadpageurls WHERE fsubreg = '{}' AND jobsector = '{}';'''
-    ids = c.execute(query.format(reg[3],reg[4])).fetchall()
-    #print(ids)
-    query = '''SELECT MAX(DATE(downloaddate)) FROM jobadpagedata WHERE uniqueadid IN (SELECT uniqueadid FROM jobadpageurls WHERE fsubreg = '{}' AND jobsector = '{}');'''
-    lastdate = c.execute(query.format(reg[3],reg[4])).fetchall()[0][0]
+#ids of the ads already in jobadpageurls for each subregion and sector, read once here rather than for every listing
+knownadids = {}
+for fsubreg, jobsector, uniqueadid in c.execute('''SELECT fsubreg, jobsector, uniqueadid FROM jobadpageurls;'''):
+    knownadids.setdefault((fsubreg, jobsector), set()).add(uniqueadid)
+#with --shard the ads found by this run's listings are fetched by this shard whatever their id, as the shard their
+#id falls in does not know about them yet
+startadids = set().union(*knownadids.values())
+
+#FUNCTION:  adds the new ads of one region-sector listing to jobadpageurls
+def write_OLXregionsectorurls(reg):
+    knownids = knownadids.setdefault((reg[3], reg[4]), set())
+    #read the whole listing on its day of the rotation
+    full = fulllistingdays > 0 and zlib.crc32((reg[3]+'/'+reg[4]).encode('utf-8')) % fulllistingdays == datecur.toordinal() % fulllistingdays
+    query = '''SELECT MAX(downloaddate) FROM jobadpagedata WHERE uniqueadid IN (SELECT uniqueadid FROM jobadpageurls WHERE fsubreg = ? AND jobsector = ?);'''
+    lastdate = c.execute(query, (reg[3],reg[4])).fetchall()[0][0]
     print("Last Download Date for sub-region {} and sector {}: {}".format(reg[3],reg[4],lastdate))
-    query = '''SELECT COUNT(*) FROM jobadpageurls WHERE fsubreg == '{}' AND jobsector == '{}';'''
-    oldnumentries = c.execute(query.format(reg[3],reg[4])).fetchall()[0][0]
+    query = '''SELECT COUNT(*) FROM jobadpageurls WHERE fsubreg = ? AND jobsector = ?;'''
+    oldnumentries = c.execute(query, (reg[3],reg[4])).fetchall()[0][0]
     #print("Old numentries: {}".format(oldnumentries))
+    postrate = get_OLXpostrate(reg[3],reg[4])
     if lastdate is None:
         #if no data is in the database lets insert from X days ago
         newdate = datecur - datetime.timedelta(days=30)
         #print(datetime.date(newdate.year,newdate.month,newdate.day))
         #print("I : {}".format(i))
-        get_OLXJobPageUrls(reg[0],reg[1],reg[2],reg[3],reg[4],reg[5],datetime.date(newdate.year,newdate.month,newdate.day))
+        seenids = get_OLXJobPageUrls(reg[0],reg[1],reg[2],reg[3],reg[4],reg[5],datetime.date(newdate.year,newdate.month,newdate.day),postrate,knownids,full)
     else:
         date = lastdate.split(' ')[0]
         temp = date.split('-')
         #if there is data in the database lets only insert data posted after the last date downloaded
-        get_OLXJobPageUrls(reg[0],reg[1],reg[2],reg[3],reg[4],reg[5],datetime.date(int(temp[0]),int(temp[1]),int(temp[2])))
-    query = '''SELECT COUNT(*) FROM jobadpageurls WHERE fsubreg == '{}' AND jobsector == '{}';'''
-    newnumentries = c.execute(query.format(reg[3],reg[4])).fetchall()[0][0]
+        seenids = get_OLXJobPageUrls(reg[0],reg[1],reg[2],reg[3],reg[4],reg[5],datetime.date(int(temp[0]),int(temp[1]),int(temp[2])),postrate,knownids,full)
+    query = '''SELECT COUNT(*) FROM jobadpageurls WHERE fsubreg = ? AND jobsector = ?;'''
+    newnumentries = c.execute(query, (reg[3],reg[4])).fetchall()[0][0]
     print("Number new pages to entered into jobadpageurls for subregion {} and sector {}: {}".format(reg[3],reg[4],newnumentries-oldnumentries))
+    if full:
+        print("Ads marked likely closed for subregion {} and sector {}: {}".format(reg[3],reg[4],infer_OLXclosedads(reg[3],reg[4],seenids)))
+
+#Now insert new data into table jobadpageurls (we probably should query on both sector and subregion since the website is very slow)
+#loop through ~2697 region-qism areas to get job data (this is quite substantial) how to do less?
+#select only region sectors where total posts have changed at least once over the last 5 days
+#the changes are recorded in regionjobadchanges by a trigger as the counts are inserted (see querytrigger['regionjobadcounts_insert'] in OLXDatabaseConversion.py)
+query = '''SELECT DISTINCT region, freg, subregion, fsubreg, sector, urlregsector FROM regionjobadchanges WHERE downloaddate >= DATE((SELECT MAX(downloaddate) FROM regionjobadlatest),'-5 days');'''
+regsector = [reg for reg in c.execute(query).fetchall() if in_shard(reg[3])]
+frontier.add('listing', [(reg[3]+'/'+reg[4], list(reg)) for reg in regsector])
+print("Region-sectors to grab: {} ({} already done today)".format(len(regsector), frontier.counts('listing').get('done', 0)))
+
+
+# NOTE:  A more efficient query will only hit the pages where there is likely to have been a change in 
+# job ads entered from the last time we have accessed the dataset.... (STILL NEED TO PROGRAM THIS)
+
+#region-sectors are leased from the frontier a few at a time so that the leases do not run out while they wait
+units = frontier.lease('listing', limit=20) if not budget.exhausted() else []
+while len(units) > 0:
+    for workkey, reg in budget.take(units):
+        try:
+            write_OLXregionsectorurls(reg)
+        except Exception as e:
+            print("Error for URL %s: %s (%s)" % (reg[5], datetime.datetime.now(), e))
+            frontier.fail('listing', workkey)
+        else:
+            frontier.complete('listing', workkey)
+    frontier.release('listing', [workkey for workkey, reg in units])
+    if budget.exhausted():
+        break
+    units = frontier.lease('listing', limit=20)
+print("Listings stopped early on {} known ads in a row: {}".format(knownrun, knownstops))
     
 #now that we have all of the relevant new urls we want to query on the new urls where we want to grab the data and insert it into the database
 #note the question is how important is it that we obtain data over time for the job AD URLS or simply track distinct listings?
 
-# rotates through the data and grabs the urls for the ads that have been posted today and each week up to 2 months prior
-# This dataset only contains urls where the status is open (not closed)
+#FUNCTION:  picks the open ads to revisit today with the revisit scheduler, from how fast their page views have been
+#changing between the visits stored in jobadpagedata
+def get_OLXrevisits():
+    
+    scheduler = RevisitScheduler(budget=args.revisit_budget, maxinterval=28)
+    #ads are up for a maximum of 3 months
+    cutoff = datecur.date() - datetime.timedelta(days=93)
+    query = '''SELECT u.uniqueadid, u.postdate, u.urllinkshort FROM jobadpageurls u WHERE u.postdate > ? AND NOT EXISTS (SELECT 1 FROM jobadclosed x WHERE x.uniqueadid = u.uniqueadid);'''
+    inferred = get_OLXinferredclosed()
+    for row in c.execute(query, (cutoff.strftime('%Y-%m-%d'),)).fetchall():
+        postdate = to_date(row[1])
+        if postdate is not None and postdate > cutoff and row[0] not in inferred:
+            scheduler.add_ad(row[0], postdate, row)
+    
+    query = '''SELECT uniqueadid, downloaddate, pageviews FROM jobadpagedata WHERE downloaddate >= ?;'''
+    for uniqueadid, downloaddate, pageviews in c.execute(query, (cutoff.strftime('%Y-%m-%d'),)):
+        scheduler.add_snapshot(uniqueadid, downloaddate, pageviews)
+    
+    return(scheduler.schedule(datecur.date()))
 
-jobpageurllist = []
+#FUNCTION:  ids of the ads marked likely closed, which are left out of the revisits unless a fetch found them open
+def get_OLXinferredclosed():
+    query = '''SELECT uniqueadid FROM jobadinferredclosed WHERE confirmstatus IS NULL OR confirmstatus == 'CLOSED';'''
+    return(set(row[0] for row in c.execute(query).fetchall()))
+
+#FUNCTION:  the sample of the ads marked likely closed that is fetched to confirm the inference
+def get_OLXconfirmsample():
+    query = '''SELECT u.uniqueadid, u.postdate, u.urllinkshort FROM jobadinferredclosed i INNER JOIN jobadpageurls u ON i.uniqueadid = u.uniqueadid WHERE i.confirmstatus IS NULL;'''
+    return([row for row in c.execute(query).fetchall() if is_confirmsample(row[0])])
 
-#Ads are up for a maximum of 3 months so if we rotate through for at least 15 weeks this should cover everything
-#NOTE:  TO REDUCE THE RISK THAT WE QUERY TOO MANY FILES TRY TO DROP ALL URLS THAT NO LONGER EXIST FROM jobadpageurls
-for i in range(0,15):
-    d = i*7
-    temp = c.execute('''SELECT uniqueadid, postdate, urllinkshort FROM jobadpageurls WHERE DATE(postdate) == DATE('{}','-{} days') and uniqueadid NOT IN (SELECT DISTINCT uniqueadid FROM jobadpagedata WHERE adstatus == 'CLOSED' OR DATE(postdate) <= DATE('{}','-93 days'));'''.format(datecur.strftime('%Y-%m-%d'),d,datecur)).fetchall()
-    jobpageurllist = jobpageurllist + temp
+jobpageurllist = []
+deferred = []
+#the ads to fetch are only picked once a day, a restarted run carries on with the ones already in the frontier
+pickads = len(frontier.counts('addetail')) == 0
+
+if pickads and args.revisit == 'weekly':
+    # rotates through the data and grabs the urls for the ads that have been posted today and each week up to 2 months prior
+    # This dataset only contains urls where the status is open (not closed)
+    
+    #Ads are up for a maximum of 3 months so if we rotate through for at least 15 weeks this should cover everything
+    #NOTE:  TO REDUCE THE RISK THAT WE QUERY TOO MANY FILES TRY TO DROP ALL URLS THAT NO LONGER EXIST FROM jobadpageurls
+    #all of the weeks are picked with one query, the closed ads are left out with jobadclosed (kept up to date by the
+    #trigger on jobadpagedata) and the ads posted over 3 months ago by the post date of their visits
+    postdates = [(datecur.date() - datetime.timedelta(days=i*7)).strftime('%Y-%m-%d') for i in range(0,15)]
+    cutoff = (datecur.date() - datetime.timedelta(days=93)).strftime('%Y-%m-%d')
+    query = '''SELECT u.uniqueadid, u.postdate, u.urllinkshort FROM jobadpageurls u WHERE u.postdate IN ({})
+        AND NOT EXISTS (SELECT 1 FROM jobadclosed x WHERE x.uniqueadid = u.uniqueadid)
+        AND NOT EXISTS (SELECT 1 FROM jobadpagedata d WHERE d.uniqueadid = u.uniqueadid AND d.postdate <= ?);'''.format(','.join('?'*len(postdates)))
+    jobpageurllist = c.execute(query, postdates + [cutoff]).fetchall()
+    inferred = get_OLXinferredclosed()
+    jobpageurllist = [urlinfo for urlinfo in jobpageurllist if urlinfo[0] not in inferred]
+elif pickads:
+    jobpageurllist = get_OLXrevisits()
+if pickads:
+    #ad pages an earlier run did not get to before its deadline or request budget ran out are fetched first
+    deferred = [urlinfo for workkey, urlinfo in frontier.carry_over('addetail')]
+    print("Ad pages deferred by earlier runs: {}".format(len(deferred)))
+
+#FUNCTION:  keeps one entry per ad in the list of ads to fetch.  An ad can be in jobadpageurls more than once (under
+#another post date, e.g. when it is reposted) so it would otherwise be fetched and inserted more than once a day.
+#The latest post date is kept, the subregions and sectors the ad is listed under are in jobadlistings.
+def dedupe_OLXjobpageurls(jobpageurllist):
+    ads = {}
+    for urlinfo in jobpageurllist:
+        uniqueadid = int(urlinfo[0])
+        if uniqueadid not in ads or (to_date(urlinfo[1]) or datetime.date.min) > (to_date(ads[uniqueadid][1]) or datetime.date.min):
+            ads[uniqueadid] = urlinfo
+    print("Duplicate ads dropped from the pages to query: {}".format(len(jobpageurllist) - len(ads)))
+    return(list(ads.values()))
+
+#FUNCTION:  orders the ads to fetch so that, if the run is cut short by --deadline or --max-requests, the ads never
+#fetched before come first, followed by the revisits from the longest ago last visit to the most recent
+def prioritize_OLXjobpageurls(jobpageurllist):
+    lastvisits = dict(c.execute('''SELECT uniqueadid, MAX(downloaddate) FROM jobadpagedata GROUP BY uniqueadid;''').fetchall())
+    return(sorted(jobpageurllist, key=lambda urlinfo: (urlinfo[0] in lastvisits, lastvisits.get(urlinfo[0], ''))))
+
+if fulllistingdays > 0 and pickads:
+    confirmsample = get_OLXconfirmsample()
+    print("Ads marked likely closed fetched to confirm: {}".format(len(confirmsample)))
+    jobpageurllist = jobpageurllist + confirmsample
+
+if shard is not None:
+    jobpageurllist = [urlinfo for urlinfo in jobpageurllist if in_shard(urlinfo[0]) or urlinfo[0] not in startadids]
+jobpageurllist = dedupe_OLXjobpageurls(deferred + prioritize_OLXjobpageurls(jobpageurllist))
 
 #check how many queries we will make based on the numbers
 #these are the urls for which we want to re-sample and obtain the daily data.
@@ -580,16 +727,40 @@ print("Number of pages to query: {}".format(len(jobpageurllist)))
 #print(jobpageurlquerylist)
 
 #run through the url pages and retrieve the information we are then going to insert this information into our key database
-    
-for urlinfo in jobpageurllist:
+#pages are downloaded and parsed concurrently by the fetch pipeline, and the rows are written in batches by its writer thread
+def write_OLXjobadpagedata(batch):
     query = '''INSERT OR IGNORE INTO jobadpagedata (downloaddate,downloadtime,uniqueadid,postdate,posttime,pageviews,title,experiencelevel,educationlevel,type,employtype,compensation,description,textlanguage,userhref,username,userjoinmt,userjoinyear,emailavail,phoneavail,
     adstatus)
     VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?);'''
-    url = 'https://olx.com.eg/en/ad/'+urlinfo[2]
-    rowvalues = get_OLXJobData(urlinfo[0],urlinfo[1],url)
     #print(rowvalues)
-    c.execute(query, rowvalues)
-conn.commit() 
+    writer.write_many(query, [store_OLXrow(rowvalues) for args, rowvalues in batch])
+    #record what the page showed for the ads that were marked likely closed
+    query = '''UPDATE jobadinferredclosed SET confirmstatus = ? WHERE uniqueadid = ?;'''
+    writer.write_many(query, [(rowvalues[20], rowvalues[2]) for args, rowvalues in batch])
+    for args, rowvalues in batch:
+        frontier.complete('addetail', args[0])
+
+def fail_OLXjobadpagedata(args, e):
+    frontier.fail('addetail', args[0])
+
+#ads already fetched today are marked done in the frontier and are not fetched again by a restarted run
+frontier.add('addetail', [(urlinfo[0], list(urlinfo)) for urlinfo in jobpageurllist])
+
+pipeline = FetchPipeline(maxinflight=maxinflight, perhostlimit=perhostlimit, parseworkers=parseworkers)
+units = frontier.lease('addetail', limit=500) if not budget.exhausted() else []
+while len(units) > 0:
+    jobpagetasks = []
+    for workkey, urlinfo in units:
+        url = 'https://olx.com.eg/en/ad/'+urlinfo[2]
+        jobpagetasks.append((url, (urlinfo[0],urlinfo[1],url)))
+    pipeline.run(budget.take(jobpagetasks), fetch_OLXJobPage, parse_OLXJobData, write_OLXjobadpagedata, fail_OLXjobadpagedata, preparefunc=translate_OLXrows if translationcache is not None else None)
+    frontier.release('addetail', [workkey for workkey, urlinfo in units])
+    if budget.exhausted():
+        break
+    units = frontier.lease('addetail', limit=500)
+if budget.exhausted():
+    counts = frontier.counts('addetail')
+    print("Ad pages deferred to the next run: {}".format(counts.get('pending', 0) + counts.get('leased', 0)))
 
 #NEED TO THINK ABOUT HOW TO ARCHIVE A SUBSET OF THE DATA ON OCCASSION......(FOR FUTURE)
 
@@ -627,11 +798,26 @@ query = '''SELECT DISTINCT uniqueadid FROM jobadpagedata;'''
 temp = c.execute(query)
 print("Distinct ads in table jobadpagedata: {}".format(len(temp.fetchall())))
 
+query = '''SELECT COUNT(*), COUNT(confirmstatus), SUM(confirmstatus == 'CLOSED') FROM jobadinferredclosed;'''
+temp = c.execute(query).fetchall()[0]
+print("Ads marked likely closed: {}, fetched to confirm: {}, confirmed closed: {}".format(temp[0], temp[1], temp[2] or 0))
+
 #Produce some summary statistics that convey the quality of the job scrape
 
 
-conn.commit() 
-conn.close()
-
+print(frontier.report())
 
+writer.close()
+conn.close()
+print(writer.report())
+
+session.close()
+print(session.report())
+print(retrypolicy.report())
+if pagestore is not None:
+    pagestore.close()
+    print(pagestore.report())
+if translationcache is not None:
+    translationcache.close()
+    print(translationcache.report())
 print("Run Time: {}".format(time.time()-start_time))
\ No newline at end of file
@@ -0,0 +1,315 @@
+###############################################################################################################
+# Shared fetch engine for the OLX and Wuzzuf scrapers
+#
+# Fetching the job ad pages one at a time through a blocking urlopen means nearly all of the run time is spent
+# waiting on the network.  The engine below keeps a bounded number of requests in flight on a thread pool (with a
+# cap on the number of concurrent requests made to any one host), runs the existing page functions
+# (get_OLXJobData, get_WuzzufJobData) in the worker threads and hands every finished row back to the thread that
+# called run() so that a single SQLite connection does all of the writing.
+#
+# FetchPipeline splits the same work into three stages so that a slow parse does not hold up the network and a
+# commit does not hold up the parsing:
+#
+#   fetch  -> IO threads download the raw pages (the same host limits as FetchEngine)
+#   parse  -> a process pool runs the pure parse functions of ParsePages.py on the downloaded pages
+#   write  -> a single writer thread hands the rows to the database in batches
+#
+# An optional prepare stage (e.g. translating the ad text, which waits on another website) runs in a thread of its
+# own between the parsers and the writer, so that it neither holds up the writing nor loses the rows when it fails.
+#
+# Each stage is bounded (maxinflight fetches, queuesize pages waiting on the parsers and queuesize rows waiting
+# on the writer) so a slow stage holds back the ones before it instead of filling up memory.  The average and
+# maximum depth of each queue is printed as the pipeline runs, the stage with the fullest queue is the bottleneck.
+#
+# Used by ScrapeEgyptOLX_cloudv2.py and ScrapeWuzzuf_cloudv2.py
+###############################################################################################################
+
+import os
+import queue
+import threading
+import time
+import datetime
+from urllib.parse import urlsplit
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+
+class FetchEngine:
+
+    # maxinflight: number of pages being fetched/parsed at the same time
+    # perhostlimit: maximum number of those requests that may go to the same host
+    def __init__(self, maxinflight=8, perhostlimit=4):
+        self.maxinflight = maxinflight
+        self.perhostlimit = min(perhostlimit, maxinflight)
+        self.hostlimits = {}
+        self.lock = threading.Lock()
+        self.stats = {'submitted': 0, 'completed': 0, 'errors': 0, 'cancelled': 0}
+
+    #FUNCTION: returns the semaphore that caps concurrent requests to the host of the url
+    def get_hostlimit(self, url):
+        host = urlsplit(url).netloc
+        with self.lock:
+            if host not in self.hostlimits:
+                self.hostlimits[host] = threading.BoundedSemaphore(self.perhostlimit)
+            return(self.hostlimits[host])
+
+    def run_task(self, workfunc, url, args):
+        with self.get_hostlimit(url):
+            return(workfunc(*args))
+
+    #FUNCTION: runs workfunc(*args) for each (url, args) in tasks and calls writefunc(args, result) in the calling
+    #thread as each one finishes (or errorfunc(args, exception) if it raised).  Returns the number of tasks that
+    #completed.
+    def run(self, tasks, workfunc, writefunc, errorfunc=None):
+
+        start_time = time.time()
+        tasks = iter(tasks)
+        inflight = {}
+
+        with ThreadPoolExecutor(max_workers=self.maxinflight) as executor:
+
+            #keep the pool topped up to maxinflight requests
+            def submit_next():
+                for url, args in tasks:
+                    future = executor.submit(self.run_task, workfunc, url, args)
+                    inflight[future] = (url, args)
+                    self.stats['submitted'] += 1
+                    return(True)
+                return(False)
+
+            while len(inflight) < self.maxinflight and submit_next():
+                pass
+
+            while inflight:
+                done, pending = wait(inflight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    url, args = inflight.pop(future)
+                    try:
+                        result = future.result()
+                    except Exception as e:
+                        #a single bad page should not take down the rest of the run
+                        self.stats['errors'] += 1
+                        print("Error for URL %s: %s (%s)" % (url, datetime.datetime.now(), e))
+                        if errorfunc is not None:
+                            errorfunc(args, e)
+                    else:
+                        writefunc(args, result)
+                        self.stats['completed'] += 1
+                    submit_next()
+
+        print("Fetch engine: {} completed, {} errors in {} seconds".format(self.stats['completed'], self.stats['errors'], round(time.time()-start_time, 1)))
+        return(self.stats['completed'])
+
+    #FUNCTION: runs workfunc(*args) for each (url, args) in tasks concurrently and yields the results in the order of
+    #tasks.  If the caller stops reading early (or closes the generator) the tasks not yet started are cancelled.
+    def fetch_ordered(self, tasks, workfunc):
+        executor = ThreadPoolExecutor(max_workers=self.maxinflight)
+        futures = []
+        for url, args in tasks:
+            futures.append(executor.submit(self.run_task, workfunc, url, args))
+            self.stats['submitted'] += 1
+        try:
+            for future in futures:
+                result = future.result()
+                self.stats['completed'] += 1
+                yield(result)
+        finally:
+            for future in futures:
+                if future.cancel():
+                    self.stats['cancelled'] += 1
+            executor.shutdown(wait=True)
+
+
+class FetchPipeline(FetchEngine):
+
+    # maxinflight/perhostlimit: as for FetchEngine, for the fetch stage
+    # parseworkers: number of parsing processes (None for one per cpu, 0 to parse in the fetch threads instead)
+    # queuesize: maximum number of pages waiting on the parsers and of rows waiting on the writer
+    # batchsize: number of rows handed to the writer at a time
+    # reportevery: seconds between printing the queue depths
+    def __init__(self, maxinflight=8, perhostlimit=4, parseworkers=None, queuesize=100, batchsize=100, reportevery=60):
+        FetchEngine.__init__(self, maxinflight, perhostlimit)
+        self.parseworkers = parseworkers if parseworkers is not None else (os.cpu_count() or 1)
+        self.queuesize = queuesize
+        self.batchsize = batchsize
+        self.reportevery = reportevery
+        self.depths = {'fetch': [0, 0, 0], 'parse': [0, 0, 0], 'prepare': [0, 0, 0], 'write': [0, 0, 0]}
+
+    #FUNCTION: records the current depth of each stage, kept as [sum, max, samples]
+    def sample_depths(self, fetching, parsing, writequeue, preparequeue=None):
+        stages = [('fetch', len(fetching)), ('parse', len(parsing)), ('write', writequeue.qsize())]
+        if preparequeue is not None:
+            stages.append(('prepare', preparequeue.qsize()))
+        for stage, depth in stages:
+            self.depths[stage][0] += depth
+            self.depths[stage][1] = max(self.depths[stage][1], depth)
+            self.depths[stage][2] += 1
+
+    def report_depths(self):
+        depths = []
+        for stage in ('fetch', 'parse', 'prepare', 'write'):
+            total, maxdepth, samples = self.depths[stage]
+            if stage == 'prepare' and samples == 0:
+                continue
+            depths.append('{} avg {} max {}'.format(stage, round(total/max(samples, 1), 1), maxdepth))
+        return("Queue depths: " + ', '.join(depths))
+
+    #FUNCTION: the writer thread, calls writefunc(batch) with lists of (args, row) and errorfunc(args, exception)
+    #for the tasks that failed.  Stops at the None put on the queue once everything else is done.
+    def write_rows(self, writequeue, writefunc, errorfunc, writererror):
+        batch = []
+        while True:
+            try:
+                item = writequeue.get(timeout=1)
+            except queue.Empty:
+                item = 'flush'
+            try:
+                if item is None or item == 'flush':
+                    #write what there is whenever the queue runs dry so rows do not sit in a part filled batch
+                    if batch:
+                        writefunc(batch)
+                        batch = []
+                    if item is None:
+                        return
+                    continue
+                kind, args, value = item
+                if kind == 'row':
+                    batch.append((args, value))
+                    if len(batch) >= self.batchsize:
+                        writefunc(batch)
+                        batch = []
+                elif errorfunc is not None:
+                    errorfunc(args, value)
+            except Exception as e:
+                #keep draining the queue so the other stages do not block, the error is raised once they are done
+                if not writererror:
+                    writererror.append(e)
+                batch = []
+                if item is None:
+                    return
+
+    #FUNCTION: the prepare thread, calls preparefunc(rows) on the rows of each batch and hands them on to the writer.
+    #A batch preparefunc fails on is written as it is.  Stops at the None put on the queue once everything is done.
+    def prepare_rows(self, preparequeue, writequeue, preparefunc):
+        batch = []
+        while True:
+            try:
+                item = preparequeue.get(timeout=1)
+            except queue.Empty:
+                item = 'flush'
+            if item is not None and item != 'flush':
+                if item[0] != 'row':
+                    writequeue.put(item)
+                    continue
+                batch.append(item)
+                if len(batch) < self.batchsize:
+                    continue
+            if batch:
+                try:
+                    preparefunc([value for kind, args, value in batch])
+                except Exception as e:
+                    print("Error preparing {} rows, written as they are: {}".format(len(batch), e))
+                for row in batch:
+                    writequeue.put(row)
+                batch = []
+            if item is None:
+                writequeue.put(None)
+                return
+
+    def fetch_and_parse(self, fetchfunc, parsefunc, url, args):
+        return(parsefunc(*self.run_task(fetchfunc, url, args)))
+
+    #FUNCTION: for each (url, args) in tasks runs fetchfunc(*args) in the IO threads, parsefunc(*fetched) on what it
+    #returned in the process pool and writefunc(batch) in the writer thread.  parsefunc has to be importable by the
+    #parsing processes (e.g. a function of ParsePages.py).  With preparefunc, preparefunc(rows) is called on each batch
+    #of rows in the prepare thread before it is written.  Returns the number of tasks that completed.
+    def run(self, tasks, fetchfunc, parsefunc, writefunc, errorfunc=None, preparefunc=None):
+
+        start_time = time.time()
+        lastreport = start_time
+        tasks = iter(tasks)
+        fetching = {}
+        parsing = {}
+        writequeue = queue.Queue(maxsize=self.queuesize)
+        writererror = []
+
+        #the parsing processes have to be forked before any threads are started, or a child can inherit a lock held by
+        #one of them (e.g. by the writer or its sqlite connection).  ProcessPoolExecutor only starts its processes on
+        #the first submit, so a task is run and waited on here, which forks all of them at once
+        parsepool = None
+        if self.parseworkers > 0:
+            parsepool = ProcessPoolExecutor(max_workers=self.parseworkers)
+            parsepool.submit(int).result()
+        writer = threading.Thread(target=self.write_rows, args=(writequeue, writefunc, errorfunc, writererror))
+        writer.start()
+        #with a preparefunc the rows go through the prepare thread on their way to the writer
+        rowqueue = writequeue
+        preparer = None
+        if preparefunc is not None:
+            rowqueue = queue.Queue(maxsize=self.queuesize)
+            preparer = threading.Thread(target=self.prepare_rows, args=(rowqueue, writequeue, preparefunc))
+            preparer.start()
+
+        try:
+            with ThreadPoolExecutor(max_workers=self.maxinflight) as executor:
+
+                #keep maxinflight pages downloading as long as the parsers are keeping up
+                def submit_next():
+                    for url, args in tasks:
+                        if parsepool is None:
+                            future = executor.submit(self.fetch_and_parse, fetchfunc, parsefunc, url, args)
+                        else:
+                            future = executor.submit(self.run_task, fetchfunc, url, args)
+                        fetching[future] = (url, args)
+                        self.stats['submitted'] += 1
+                        return(True)
+                    return(False)
+
+                def task_error(url, args, e):
+                    self.stats['errors'] += 1
+                    print("Error for URL %s: %s (%s)" % (url, datetime.datetime.now(), e))
+                    rowqueue.put(('error', args, e))
+
+                more = True
+                while more or fetching or parsing:
+                    while more and len(fetching) < self.maxinflight and len(parsing) < self.queuesize:
+                        more = submit_next()
+
+                    self.sample_depths(fetching, parsing, writequeue, preparequeue=None if preparer is None else rowqueue)
+                    if time.time() - lastreport >= self.reportevery:
+                        lastreport = time.time()
+                        print("Pipeline: {} completed, {} errors. {}".format(self.stats['completed'], self.stats['errors'], self.report_depths()))
+
+                    done, pending = wait(list(fetching) + list(parsing), timeout=self.reportevery, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        if future in fetching:
+                            url, args = fetching.pop(future)
+                            try:
+                                result = future.result()
+                            except Exception as e:
+                                task_error(url, args, e)
+                                continue
+                            if parsepool is not None:
+                                parsing[parsepool.submit(parsefunc, *result)] = (url, args)
+                                continue
+                        else:
+                            url, args = parsing.pop(future)
+                            try:
+                                result = future.result()
+                            except Exception as e:
+                                task_error(url, args, e)
+                                continue
+                        #blocks while the writer is behind, which in turn holds back the fetching
+                        rowqueue.put(('row', args, result))
+                        self.stats['completed'] += 1
+        finally:
+            rowqueue.put(None)
+            if preparer is not None:
+                preparer.join()
+            writer.join()
+            if parsepool is not None:
+                parsepool.shutdown(wait=True)
+
+        print("Fetch pipeline: {} completed, {} errors in {} seconds. {}".format(self.stats['completed'], self.stats['errors'], round(time.time()-start_time, 1), self.report_depths()))
+        if writererror:
+            raise writererror[0]
+        return(self.stats['completed'])
@@ -0,0 +1,184 @@
+###############################################################################################################
+# Durable crawl frontier for the scrapers
+#
+# The day's work lists (subregions to sweep, region-sectors to list, ad pages to fetch) used to live only in
+# memory, so a crash part way through meant starting the whole day again or editing rowstart/datast by hand.
+# CrawlFrontier keeps every unit of work in a crawlfrontier table of the scraper's own database together with its
+# status, number of attempts and lease time:
+#
+#   pending  -> waiting to be fetched
+#   leased   -> handed to a run until leaseuntil, after which any run may take it again (e.g. if that run died)
+#   done     -> finished
+#   failed   -> gave up after maxattempts
+#
+# Units are added with INSERT OR IGNORE so a restarted run can add the same work again and only the units that
+# are not done yet are handed out.  This also lets a day's crawl be split across several short cron invocations.
+#
+# complete() and fail() do not commit, so that the caller can commit them together with the rows written for the
+# unit.  lease() commits any open transaction on the connection before taking the units.  With a BufferedWriter
+# (ScrapeDatabase.py) complete() and fail() are buffered with the rows and the commits go through the writer.
+#
+# RunBudget stops a run from starting new work once its --deadline has passed or it has made --max-requests
+# requests.  The units it did not get to stay pending, and carry_over() hands the ones left over from earlier days
+# to the next day's run so that it fetches them first.
+###############################################################################################################
+
+import json
+import time
+import datetime
+
+
+class CrawlFrontier:
+
+    # conn: SQLite connection to the scraper database (the crawlfrontier table is created if it does not exist)
+    # rundate: day of the crawl the units belong to, units of other days are never handed out
+    # leaseseconds: how long a leased unit is held before another run may take it
+    # maxattempts: number of times a unit is tried before it is marked failed
+    # keepdays: frontiers older than this many days are deleted
+    # writer: BufferedWriter the scraper writes its rows with, if any
+    def __init__(self, conn, rundate, leaseseconds=900, maxattempts=3, keepdays=7, writer=None):
+        self.conn = conn
+        self.writer = writer
+        self.rundate = rundate
+        self.leaseseconds = leaseseconds
+        self.maxattempts = maxattempts
+
+        c = self.conn.cursor()
+        c.execute('''CREATE TABLE IF NOT EXISTS crawlfrontier (
+            rundate DATE,
+            worktype VARCHAR(20),
+            workkey VARCHAR(200),
+            payload TEXT,
+            status VARCHAR(10),
+            attempts INTEGER,
+            leaseuntil REAL,
+            PRIMARY KEY(rundate,worktype,workkey));''')
+        c.execute('''CREATE INDEX IF NOT EXISTS crawlfrontier_status ON crawlfrontier (rundate,worktype,status);''')
+        cutoff = datetime.datetime.strptime(rundate, '%Y-%m-%d') - datetime.timedelta(days=keepdays)
+        c.execute('''DELETE FROM crawlfrontier WHERE rundate < ?;''', (cutoff.strftime('%Y-%m-%d'),))
+        self.commit()
+
+    #FUNCTION: commits the connection, after writing the rows buffered by the writer
+    def commit(self):
+        if self.writer is not None:
+            self.writer.flush()
+        else:
+            self.conn.commit()
+
+    def execute(self, query, params):
+        if self.writer is not None:
+            self.writer.write(query, params)
+        else:
+            self.conn.execute(query, params)
+
+    #FUNCTION: adds (workkey, payload) units of worktype, units already in the frontier are left as they are.
+    #Returns the number of new units.
+    def add(self, worktype, units):
+        c = self.conn.cursor()
+        before = self.conn.total_changes
+        c.executemany('''INSERT OR IGNORE INTO crawlfrontier (rundate,worktype,workkey,payload,status,attempts,leaseuntil) VALUES (?,?,?,?,'pending',0,0);''',
+                      [(self.rundate, worktype, str(workkey), json.dumps(payload)) for workkey, payload in units])
+        self.commit()
+        return(self.conn.total_changes - before)
+
+    #FUNCTION: leases up to limit units of worktype that are pending or whose lease has run out and returns them as
+    #a list of (workkey, payload)
+    def lease(self, worktype, limit=None):
+        now = time.time()
+        self.commit()
+        c = self.conn.cursor()
+        #take a write lock first so that two runs can not lease the same units
+        c.execute('''BEGIN IMMEDIATE;''')
+        #units whose last lease ran out on their final attempt are not handed out again
+        query = '''UPDATE crawlfrontier SET status = 'failed' WHERE rundate = ? AND worktype = ? AND status = 'leased' AND leaseuntil < ? AND attempts >= ?;'''
+        c.execute(query, (self.rundate, worktype, now, self.maxattempts))
+        query = '''SELECT workkey, payload FROM crawlfrontier WHERE rundate = ? AND worktype = ? AND (status = 'pending' OR (status = 'leased' AND leaseuntil < ?)) ORDER BY rowid LIMIT ?;'''
+        units = c.execute(query, (self.rundate, worktype, now, -1 if limit is None else limit)).fetchall()
+        query = '''UPDATE crawlfrontier SET status = 'leased', attempts = attempts + 1, leaseuntil = ? WHERE rundate = ? AND worktype = ? AND workkey = ?;'''
+        c.executemany(query, [(now + self.leaseseconds, self.rundate, worktype, workkey) for workkey, payload in units])
+        self.conn.commit()
+        return([(workkey, json.loads(payload)) for workkey, payload in units])
+
+    def complete(self, worktype, workkey):
+        query = '''UPDATE crawlfrontier SET status = 'done' WHERE rundate = ? AND worktype = ? AND workkey = ?;'''
+        self.execute(query, (self.rundate, worktype, str(workkey)))
+
+    #FUNCTION: puts units that were leased but never started (e.g. when the run budget ran out) back to pending,
+    #without counting the lease as an attempt
+    def release(self, worktype, workkeys):
+        query = '''UPDATE crawlfrontier SET status = 'pending', attempts = attempts - 1, leaseuntil = 0 WHERE rundate = ? AND worktype = ? AND workkey = ? AND status = 'leased';'''
+        self.commit()
+        self.conn.executemany(query, [(self.rundate, worktype, str(workkey)) for workkey in workkeys])
+        self.commit()
+
+    #FUNCTION: returns the (workkey, payload) units of worktype that runs of earlier days did not get to, oldest
+    #first, and marks them carried so that they are only handed on once.  Does not commit, so that the caller can add
+    #them to this day's frontier in the same commit.
+    def carry_over(self, worktype):
+        query = '''SELECT rundate, workkey, payload FROM crawlfrontier WHERE rundate < ? AND worktype = ? AND status IN ('pending','leased') ORDER BY rundate, rowid;'''
+        units = self.conn.execute(query, (self.rundate, worktype)).fetchall()
+        query = '''UPDATE crawlfrontier SET status = 'carried' WHERE rundate = ? AND worktype = ? AND workkey = ?;'''
+        self.conn.executemany(query, [(rundate, worktype, workkey) for rundate, workkey, payload in units])
+        return([(workkey, json.loads(payload)) for rundate, workkey, payload in units])
+
+    #FUNCTION: puts the unit back to pending so it is tried again, or marks it failed after maxattempts
+    def fail(self, worktype, workkey):
+        query = '''UPDATE crawlfrontier SET status = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END, leaseuntil = 0 WHERE rundate = ? AND worktype = ? AND workkey = ?;'''
+        self.execute(query, (self.maxattempts, self.rundate, worktype, str(workkey)))
+
+    #FUNCTION: returns the number of units of worktype with each status
+    def counts(self, worktype):
+        query = '''SELECT status, COUNT(*) FROM crawlfrontier WHERE rundate = ? AND worktype = ? GROUP BY status;'''
+        return(dict(self.conn.execute(query, (self.rundate, worktype)).fetchall()))
+
+    def report(self):
+        query = '''SELECT DISTINCT worktype FROM crawlfrontier WHERE rundate = ? ORDER BY worktype;'''
+        lines = []
+        for (worktype,) in self.conn.execute(query, (self.rundate,)).fetchall():
+            counts = self.counts(worktype)
+            lines.append("Frontier {} {}: {} done, {} failed, {} still to do".format(self.rundate, worktype, counts.get('done', 0), counts.get('failed', 0), counts.get('pending', 0) + counts.get('leased', 0)))
+        return('\n'.join(lines))
+
+
+class RunBudget:
+
+    # session: HTTPSession whose requests are counted against maxrequests
+    # deadline: time (as returned by time.time()) after which no new work is started, None for no deadline
+    # maxrequests: number of requests after which no new work is started, None for no limit
+    def __init__(self, session, deadline=None, maxrequests=None):
+        self.session = session
+        self.deadline = deadline
+        self.maxrequests = maxrequests
+        self.reason = None
+
+    #FUNCTION: whether the run is out of time or requests, work already started is left to finish
+    def exhausted(self):
+        if self.reason is None:
+            if self.deadline is not None and time.time() >= self.deadline:
+                self.reason = 'deadline'
+            elif self.maxrequests is not None and self.session.stats['requests'] >= self.maxrequests:
+                self.reason = 'request budget'
+            if self.reason is not None:
+                print("Run {} reached at {}, no new work is started".format(self.reason, datetime.datetime.now()))
+        return(self.reason is not None)
+
+    #FUNCTION: yields the items until the run is out of time or requests
+    def take(self, items):
+        for item in items:
+            if self.exhausted():
+                return
+            yield(item)
+
+
+#FUNCTION: turns the --deadline option into a time.time() value, either a clock time 'HH:MM' (the next time it comes
+#round after now, a timezone aware datetime) or a number of minutes from now
+def get_deadline(value, now):
+    if value is None:
+        return(None)
+    if ':' in value:
+        hour, minute = value.split(':')
+        deadline = now.replace(hour=int(hour), minute=int(minute), second=0, microsecond=0)
+        if deadline <= now:
+            deadline = deadline + datetime.timedelta(days=1)
+        return(time.time() + (deadline - now).total_seconds())
+    return(time.time() + float(value)*60)
@@ -0,0 +1,113 @@
+###############################################################################################################
+# Revisit scheduler for the OLX and Wuzzuf job ads
+#
+# The scrapers used to re-fetch every open ad posted exactly 0, 7, 14, ... days ago, however fast its page views
+# (OLX) or applicants (Wuzzuf) were changing.  RevisitScheduler estimates how fast each ad's counters change from
+# the snapshots already in the database and gives each ad a next visit date:
+#
+#   velocity  = smoothed change per day between consecutive snapshots (for an ad seen once, the counters at that
+#               visit divided by the days it had been up)
+#   nextvisit = lastvisit + mindelta/velocity days, kept between mininterval and maxinterval days
+#
+# Of the ads that are due, the daily budget of requests is filled with ads never visited first, then ads not
+# visited for maxinterval days (so closed ads are still noticed), then the ads with the largest expected change
+# since the last visit (velocity x days since last visit).  Active ads get dense time series while dormant ads
+# are only checked every maxinterval days.
+###############################################################################################################
+
+import math
+import datetime
+
+
+class RevisitScheduler:
+
+    # budget: maximum number of ads to revisit per day
+    # mininterval/maxinterval: least and most days between two visits of an ad
+    # mindelta: change in the counters worth a visit
+    # smoothing: weight of the newest snapshot in the velocity estimate
+    def __init__(self, budget=20000, mininterval=1, maxinterval=28, mindelta=5, smoothing=0.5):
+        self.budget = budget
+        self.mininterval = mininterval
+        self.maxinterval = maxinterval
+        self.mindelta = mindelta
+        self.smoothing = smoothing
+        self.ads = {}
+        self.snapshots = {}
+
+    #FUNCTION: adds an open ad that may be revisited, item is what is returned for it by schedule()
+    def add_ad(self, adid, postdate, item):
+        self.ads[adid] = (to_date(postdate), item)
+
+    #FUNCTION: adds one stored visit of an ad (added with add_ad) with the total of its counters at that visit,
+    #e.g. the page views
+    def add_snapshot(self, adid, downloaddate, value):
+        if adid not in self.ads:
+            return
+        try:
+            value = float(value)
+        except (TypeError, ValueError):
+            return
+        if math.isnan(value):
+            return
+        self.snapshots.setdefault(adid, {})[to_date(downloaddate)] = value
+
+    #FUNCTION: returns the estimated change per day of the ad's counters and the date of its last visit
+    def get_velocity(self, adid, postdate):
+        snapshots = sorted(self.snapshots.get(adid, {}).items())
+        if len(snapshots) == 0:
+            return(None, None)
+        lastdate, lastvalue = snapshots[0]
+        #before there are two visits, assume the counters grew evenly since the ad was posted
+        velocity = lastvalue/max(1, (lastdate - postdate).days) if postdate is not None else 0.0
+        for date, value in snapshots[1:]:
+            days = (date - lastdate).days
+            if days > 0:
+                change = max(0.0, value - lastvalue)/days
+                velocity = self.smoothing*change + (1 - self.smoothing)*velocity
+                lastdate, lastvalue = date, value
+        return(velocity, lastdate)
+
+    #FUNCTION: returns the next visit date of an ad from its velocity and last visit
+    def get_nextvisit(self, velocity, lastvisit):
+        if velocity <= 0:
+            interval = self.maxinterval
+        else:
+            interval = min(self.maxinterval, max(self.mininterval, int(math.ceil(self.mindelta/velocity))))
+        return(lastvisit + datetime.timedelta(days=interval))
+
+    #FUNCTION: returns the items of the ads to visit on today, highest expected gain first, up to the budget
+    def schedule(self, today):
+        ranked = []
+        stats = {'new': 0, 'overdue': 0, 'due': 0, 'notdue': 0}
+        for adid, (postdate, item) in self.ads.items():
+            velocity, lastvisit = self.get_velocity(adid, postdate)
+            if lastvisit is None:
+                stats['new'] += 1
+                ranked.append((2, float('inf'), item))
+                continue
+            elapsed = (today - lastvisit).days
+            if elapsed < self.mininterval or today < self.get_nextvisit(velocity, lastvisit):
+                stats['notdue'] += 1
+            elif elapsed >= self.maxinterval:
+                stats['overdue'] += 1
+                ranked.append((1, elapsed, item))
+            else:
+                stats['due'] += 1
+                ranked.append((0, velocity*elapsed, item))
+        ranked.sort(key=lambda r: (r[0], r[1]), reverse=True)
+        print("Revisit scheduler: {} new, {} overdue, {} due, {} not due, budget {}".format(stats['new'], stats['overdue'], stats['due'], stats['notdue'], self.budget))
+        return([item for rank, gain, item in ranked[:self.budget]])
+
+
+#FUNCTION: turns a stored date (e.g. '2017-12-5' or '2017-12-05 00:00:00') into a date
+def to_date(value):
+    if value is None:
+        return(None)
+    if isinstance(value, datetime.datetime):
+        return(value.date())
+    if isinstance(value, datetime.date):
+        return(value)
+    try:
+        return(datetime.datetime.strptime(str(value).split(' ')[0], '%Y-%m-%d').date())
+    except ValueError:
+        return(None)
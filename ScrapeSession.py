@@ -0,0 +1,417 @@
+###############################################################################################################
+# Shared HTTP session for the OLX and Wuzzuf scrapers
+#
+# Opening a new urlrequest for every page means a fresh TCP+TLS handshake for each of the 100K+ pages requested
+# a day.  HTTPSession keeps a pool of keep-alive connections per host that every fetch in both scrapers goes
+# through, asks for gzip/deflate compressed pages and counts how many connections were opened versus reused.
+#
+# session.get(url) behaves like urlopen: it follows redirects, raises urllib.error.HTTPError for 4xx/5xx
+# responses and returns a response with getcode() and read() that can be handed straight to BeautifulSoup.
+#
+# Politeness is handled by RateLimiter, a per-host token bucket that the session waits on before every request.
+# It backs off when a site returns 403/429/5xx errors or slows down and ramps back up while responses are healthy,
+# so that we get as much throughput as the sites tolerate without hand tuned time.sleep calls.
+#
+# CircuitBreaker counts the failed requests (connection errors, timeouts, 403, 429 and 5xx) to each host.  After
+# threshold failures in a row the host is taken as down and every request to it waits out a cool down, which
+# doubles each time the first request after it fails again, instead of the whole run being spent on timeouts.
+#
+# RetryPolicy replaces the request_until_succeed loops of the scrapers.  Only a 404/410 (an ad that was taken down)
+# means the page is gone.  Transient errors (connection errors, timeouts, 403 when the site is blocking us for a while,
+# 408, 429 and 5xx) are retried with exponential backoff and jitter, any other error is raised so that the page is
+# failed and fetched again later rather than being taken as gone.
+###############################################################################################################
+
+import gzip
+import time
+import random
+import socket
+import zlib
+import datetime
+import threading
+import http.client
+import urllib.error
+import urllib.request as urlrequest
+from urllib.parse import urlsplit, urljoin
+
+#errors that mean a pooled keep-alive connection was closed by the server while it sat idle
+staleerrors = (http.client.RemoteDisconnected, http.client.CannotSendRequest, BrokenPipeError, ConnectionResetError)
+
+#statuses of a page that was taken down, and of a site that is refusing or throttling our requests (with 5xx)
+gonestatus = (404, 410)
+failstatus = (403, 429)
+
+
+class CircuitOpenError(Exception):
+    pass
+
+
+class SessionResponse:
+
+    def __init__(self, url, status, reason, headers, body):
+        self.url = url
+        self.status = status
+        self.reason = reason
+        self.headers = headers
+        self.body = body
+
+    def getcode(self):
+        return(self.status)
+
+    def geturl(self):
+        return(self.url)
+
+    def read(self):
+        return(self.body)
+
+
+class RateLimiter:
+
+    # rate: starting requests per second allowed to each host
+    # minrate/maxrate: the limits the rate is allowed to move between as it adapts (maxrate defaults to 4x rate)
+    # burst: number of requests that can be sent back to back after an idle period
+    # backoff: factor the rate is cut by on a 403/429/5xx/connection error, rampstep: requests per second added back
+    # after each healthy response
+    # spikefactor: a response slower than this multiple of the recent average latency (and slower than minspike
+    # seconds) counts as a slowdown
+    def __init__(self, rate=2.0, minrate=0.2, maxrate=None, burst=2, backoff=0.5, rampstep=0.05, spikefactor=3.0, minspike=1.0):
+        self.startrate = rate
+        self.minrate = minrate
+        self.maxrate = maxrate if maxrate is not None else rate*4
+        self.burst = burst
+        self.backoff = backoff
+        self.rampstep = rampstep
+        self.spikefactor = spikefactor
+        self.minspike = minspike
+        self.hosts = {}
+        self.lock = threading.Lock()
+        self.stats = {'waited': 0.0, 'backoffs': 0}
+
+    def get_host(self, host):
+        if host not in self.hosts:
+            self.hosts[host] = {'rate': self.startrate, 'tokens': float(self.burst), 'updated': time.monotonic(), 'latency': None}
+        return(self.hosts[host])
+
+    #FUNCTION: blocks until the token bucket for the host allows another request
+    def acquire(self, host):
+        while True:
+            with self.lock:
+                state = self.get_host(host)
+                now = time.monotonic()
+                state['tokens'] = min(self.burst, state['tokens'] + (now - state['updated'])*state['rate'])
+                state['updated'] = now
+                if state['tokens'] >= 1:
+                    state['tokens'] -= 1
+                    return
+                wait = (1 - state['tokens'])/state['rate']
+                self.stats['waited'] += wait
+            time.sleep(wait)
+
+    #FUNCTION: adapts the rate for the host from the outcome of a request (status is None on a connection error)
+    def record(self, host, status, latency):
+        with self.lock:
+            state = self.get_host(host)
+            if status is None or status in failstatus or status >= 500:
+                state['rate'] = max(self.minrate, state['rate']*self.backoff)
+                state['tokens'] = min(state['tokens'], 0)
+                self.stats['backoffs'] += 1
+                return
+            if state['latency'] is not None and latency > max(self.minspike, self.spikefactor*state['latency']):
+                state['rate'] = max(self.minrate, state['rate']*(1 + self.backoff)/2)
+                self.stats['backoffs'] += 1
+            else:
+                state['rate'] = min(self.maxrate, state['rate'] + self.rampstep)
+            #moving average of latency so a single slow page does not reset the baseline
+            if state['latency'] is None:
+                state['latency'] = latency
+            else:
+                state['latency'] = 0.8*state['latency'] + 0.2*latency
+
+    def report(self):
+        rates = ', '.join('{} {} req/s'.format(host, round(state['rate'], 2)) for host, state in self.hosts.items())
+        return("Rate limiter: {} backoffs, {} seconds waited, current rates: {}".format(self.stats['backoffs'], round(self.stats['waited'], 1), rates))
+
+
+class CircuitBreaker:
+
+    # threshold: number of failed requests in a row after which the host is taken as down
+    # cooldown: seconds requests to a host that is down wait before it is tried again, doubled (up to maxcooldown)
+    # every time that try fails as well
+    # maxpause: total seconds the breaker may hold back requests to a host in a run, after that requests to the host
+    # fail straight away with CircuitOpenError while it is open (one request still goes through after each cool
+    # down) so the run can finish
+    def __init__(self, threshold=5, cooldown=30, maxcooldown=600, maxpause=3600):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.maxcooldown = maxcooldown
+        self.maxpause = maxpause
+        self.hosts = {}
+        self.lock = threading.Lock()
+        self.stats = {'opened': 0, 'paused': 0.0, 'rejected': 0}
+
+    def get_host(self, host):
+        if host not in self.hosts:
+            self.hosts[host] = {'failures': 0, 'openuntil': 0.0, 'cooldown': self.cooldown, 'paused': 0.0}
+        return(self.hosts[host])
+
+    #FUNCTION: blocks while the breaker for the host is open, raises CircuitOpenError once the host has been paused
+    #for maxpause seconds
+    def acquire(self, host):
+        while True:
+            with self.lock:
+                state = self.get_host(host)
+                wait = state['openuntil'] - time.monotonic()
+                if wait <= 0:
+                    return
+                if state['paused'] > self.maxpause:
+                    self.stats['rejected'] += 1
+                    raise CircuitOpenError("{} is down, circuit breaker open".format(host))
+            time.sleep(wait)
+
+    def open(self, state, cooldown):
+        state['cooldown'] = cooldown
+        state['openuntil'] = time.monotonic() + cooldown
+        state['paused'] += cooldown
+        self.stats['opened'] += 1
+        self.stats['paused'] += cooldown
+
+    #FUNCTION: records the outcome of a request to the host (status is None on a connection error)
+    def record(self, host, status):
+        with self.lock:
+            state = self.get_host(host)
+            if status is not None and status not in failstatus and status < 500:
+                state['failures'] = 0
+                state['cooldown'] = self.cooldown
+                return
+            state['failures'] += 1
+            if state['failures'] == self.threshold:
+                self.open(state, state['cooldown'])
+            elif state['failures'] > self.threshold and state['openuntil'] <= time.monotonic():
+                #the first request after the cool down failed too, so wait longer before the next try
+                self.open(state, min(self.maxcooldown, state['cooldown']*2))
+
+    def report(self):
+        return("Circuit breaker: opened {} times, {} seconds paused, {} requests refused".format(self.stats['opened'], round(self.stats['paused'], 1), self.stats['rejected']))
+
+
+class RetryPolicy:
+
+    # session: HTTPSession the requests are sent through
+    # maxattempts: number of times a request is tried on transient errors
+    # basedelay/maxdelay: the wait before retry n is a random time up to basedelay*2**(n-1) seconds, at most maxdelay
+    def __init__(self, session, maxattempts=5, basedelay=1.0, maxdelay=60.0):
+        self.session = session
+        self.maxattempts = maxattempts
+        self.basedelay = basedelay
+        self.maxdelay = maxdelay
+        self.lock = threading.Lock()
+        self.stats = {'retries': 0, 'permanent': 0, 'transient': 0, 'gaveup': 0}
+
+    def count(self, stat):
+        with self.lock:
+            self.stats[stat] += 1
+
+    #FUNCTION: whether an error raised by session.get is worth retrying
+    def is_transient(self, e):
+        if isinstance(e, CircuitOpenError):
+            return(False)
+        if isinstance(e, urllib.error.HTTPError):
+            return(e.code == 408 or e.code in failstatus or e.code >= 500)
+        return(isinstance(e, (urllib.error.URLError, socket.timeout, http.client.HTTPException, OSError)))
+
+    #FUNCTION: returns the seconds to wait before the given retry, using the Retry-After header of a 429/503 if set
+    def get_delay(self, attempt, e):
+        delay = random.uniform(0, min(self.maxdelay, self.basedelay*2**(attempt-1)))
+        if isinstance(e, urllib.error.HTTPError) and e.headers is not None:
+            try:
+                delay = max(delay, min(self.maxdelay, float(e.headers.get('Retry-After'))))
+            except (TypeError, ValueError):
+                pass
+        return(delay)
+
+    #FUNCTION: requests the url, retrying on transient errors.  Returns the response, or None when the page is
+    #permanently gone (a 404/410 for an ad that was taken down).  Raises the last error when the page could not be
+    #fetched after maxattempts tries, the host is down or the error is neither transient nor a page that is gone.
+    def get(self, url):
+        attempt = 1
+        while True:
+            try:
+                return(self.session.get(url))
+            except Exception as e:
+                if not self.is_transient(e):
+                    if isinstance(e, urllib.error.HTTPError) and e.code in gonestatus:
+                        self.count('permanent')
+                        return(None)
+                    self.count('gaveup')
+                    raise
+                self.count('transient')
+                if attempt >= self.maxattempts:
+                    self.count('gaveup')
+                    raise
+                print("Error for URL %s: %s (%s), retrying" % (url, datetime.datetime.now(), e))
+                self.count('retries')
+                time.sleep(self.get_delay(attempt, e))
+                attempt += 1
+
+    def report(self):
+        return("Retries: {} transient errors, {} retries, {} pages gone, {} pages given up on".format(self.stats['transient'], self.stats['retries'], self.stats['permanent'], self.stats['gaveup']))
+
+
+class HTTPSession:
+
+    # timeout: seconds to wait on connecting or on any read from the socket
+    # maxidle: number of idle keep-alive connections kept per host
+    # ratelimiter: RateLimiter shared by everything that uses the session (None to send requests unthrottled)
+    # pagestore: PageStore that keeps a copy of every page fetched (None to not keep the pages)
+    # breaker: CircuitBreaker that holds back requests to a host that is down (None to not use one)
+    # rewrites: {'https://olx.com.eg': 'http://127.0.0.1:8000'} to send the requests for a site to another server
+    # instead, e.g. LocalTestServer.py (pages are still stored in the page store under the site's own url)
+    def __init__(self, timeout=30, maxidle=8, maxredirects=5, ratelimiter=None, pagestore=None, breaker=None, rewrites=None):
+        self.timeout = timeout
+        self.rewrites = rewrites or {}
+        self.ratelimiter = ratelimiter
+        self.breaker = breaker
+        self.pagestore = pagestore
+        self.maxidle = maxidle
+        self.maxredirects = maxredirects
+        self.headers = dict(urlrequest.build_opener().addheaders)
+        self.headers['Accept-Encoding'] = 'gzip, deflate'
+        self.headers['Connection'] = 'keep-alive'
+        self.idle = {}
+        self.lock = threading.Lock()
+        self.stats = {'requests': 0, 'opened': 0, 'reused': 0}
+
+    def count(self, stat, n=1):
+        with self.lock:
+            self.stats[stat] += n
+
+    #FUNCTION: takes an idle connection to the host from the pool or opens a new one
+    def get_connection(self, scheme, host):
+        with self.lock:
+            pool = self.idle.get((scheme, host))
+            if pool:
+                self.stats['reused'] += 1
+                return(pool.pop(), True)
+            self.stats['opened'] += 1
+        return(self.new_connection(scheme, host), False)
+
+    def new_connection(self, scheme, host):
+        if scheme == 'https':
+            return(http.client.HTTPSConnection(host, timeout=self.timeout))
+        return(http.client.HTTPConnection(host, timeout=self.timeout))
+
+    def release_connection(self, scheme, host, connection):
+        with self.lock:
+            pool = self.idle.setdefault((scheme, host), [])
+            if len(pool) < self.maxidle:
+                pool.append(connection)
+                return
+        connection.close()
+
+    #FUNCTION: sends a single request (no redirects) through the circuit breaker and the rate limiter
+    def send(self, url):
+        if self.ratelimiter is None and self.breaker is None:
+            return(self.send_request(url))
+
+        host = urlsplit(url).netloc
+        if self.breaker is not None:
+            self.breaker.acquire(host)
+        if self.ratelimiter is not None:
+            self.ratelimiter.acquire(host)
+        start = time.monotonic()
+        try:
+            result = self.send_request(url)
+        except Exception:
+            self.record(host, None, time.monotonic() - start)
+            raise
+        self.record(host, result[0], time.monotonic() - start)
+        return(result)
+
+    def record(self, host, status, latency):
+        if self.breaker is not None:
+            self.breaker.record(host, status)
+        if self.ratelimiter is not None:
+            self.ratelimiter.record(host, status, latency)
+
+    #FUNCTION: sends a single request (no redirects) and returns the status, headers and decoded body
+    def send_request(self, url):
+        parts = urlsplit(url)
+        path = parts.path or '/'
+        if parts.query:
+            path = path + '?' + parts.query
+
+        connection, reused = self.get_connection(parts.scheme, parts.netloc)
+        try:
+            connection.request('GET', path, headers=self.headers)
+            response = connection.getresponse()
+            body = response.read()
+        except staleerrors:
+            connection.close()
+            if not reused:
+                raise
+            #the server dropped the idle connection, so try once more on a new one
+            self.count('opened')
+            connection = self.new_connection(parts.scheme, parts.netloc)
+            try:
+                connection.request('GET', path, headers=self.headers)
+                response = connection.getresponse()
+                body = response.read()
+            except Exception:
+                connection.close()
+                raise
+        except Exception:
+            connection.close()
+            raise
+
+        if response.will_close:
+            connection.close()
+        else:
+            self.release_connection(parts.scheme, parts.netloc, connection)
+
+        encoding = response.getheader('Content-Encoding', '').lower()
+        if encoding == 'gzip':
+            body = gzip.decompress(body)
+        elif encoding == 'deflate':
+            try:
+                body = zlib.decompress(body)
+            except zlib.error:
+                body = zlib.decompress(body, -zlib.MAX_WBITS)
+
+        return(response.status, response.reason, response.msg, body)
+
+    #FUNCTION: requests the url and follows redirects, raising HTTPError on 4xx/5xx just as urlopen does
+    def get(self, url):
+        requesturl = url
+        for prefix, replacement in self.rewrites.items():
+            if url.startswith(prefix):
+                url = replacement + url[len(prefix):]
+                break
+        fetchtime = datetime.datetime.now(datetime.timezone.utc)
+        for i in range(self.maxredirects + 1):
+            self.count('requests')
+            status, reason, headers, body = self.send(url)
+            if status in (301, 302, 303, 307, 308) and headers.get('Location'):
+                url = urljoin(url, headers['Location'])
+                continue
+            #pages are stored under the url that was asked for so that they can be looked up again on replay
+            if self.pagestore is not None:
+                self.pagestore.save(requesturl, status, body, fetchtime)
+            if status >= 400:
+                raise urllib.error.HTTPError(url, status, reason, headers, None)
+            return(SessionResponse(url, status, reason, headers, body))
+        raise urllib.error.HTTPError(url, status, 'Too many redirects', headers, None)
+
+    def close(self):
+        with self.lock:
+            for pool in self.idle.values():
+                for connection in pool:
+                    connection.close()
+            self.idle = {}
+
+    def report(self):
+        report = "Requests: {}, connections opened: {}, connections reused: {}".format(self.stats['requests'], self.stats['opened'], self.stats['reused'])
+        if self.ratelimiter is not None:
+            report = report + '\n' + self.ratelimiter.report()
+        if self.breaker is not None:
+            report = report + '\n' + self.breaker.report()
+        return(report)
@@ -32,16 +32,71 @@ import re
 import datetime
 import time
 import csv
+import argparse
+import zlib
+from ScrapeEngine import FetchPipeline
+from ScrapeSession import HTTPSession, RateLimiter, CircuitBreaker, RetryPolicy, gonestatus
+from PageStore import PageStore
+from ScrapeScheduler import RevisitScheduler
+from ScrapeFrontier import CrawlFrontier, RunBudget, get_deadline
+from ScrapeDatabase import BufferedWriter, connect_db, migrate_db, delete_unusedtexts
+from ParsePages import parse_WuzzufJobData
+from WuzzufDatabaseConversion import migrations, textkeys
+
+#number of job pages fetched at the same time and the maximum of those that may be sent to wuzzuf.net at once
+maxinflight = 6
+perhostlimit = 3
+
+#number of processes parsing the job pages while they are downloaded (None for one per cpu)
+parseworkers = None
+
+#stop reading the listing once this many jobs in a row are already known (0 to only stop on the post dates)
+knownrun = 10
+
+#the whole listing is read once every fulllistingdays days and the jobs it no longer shows are marked as likely
+#closed rather than fetched every time (0 to switch off)
+fulllistingdays = 7
+#share of the jobs marked likely closed that are fetched anyway to check the inference
+confirmshare = 0.05
+
+#target requests per second to wuzzuf.net, the rate limiter adapts between minrate and maxrate as the site responds
+requestrate = 2
+minrate = 0.2
+maxrate = 5
+
+argparser = argparse.ArgumentParser(description='Scrape the Wuzzuf job ads into wuzzuf.db')
+argparser.add_argument('--store-pages', action='store_true', help='keep a compressed copy of every page downloaded in the page store')
+argparser.add_argument('--replay', action='store_true', help='rebuild pagedata from the page store without making any requests to the website')
+argparser.add_argument('--pagestore', default='wuzzuf_pages.db', help='SQLite file used for the page store')
+argparser.add_argument('--revisit', choices=['velocity', 'weekly'], default='velocity', help='revisit the jobs by how fast their applicants change, or every week since they were posted')
+argparser.add_argument('--revisit-budget', type=int, default=1000, help='maximum number of jobs revisited per day with --revisit velocity')
+argparser.add_argument('--deadline', help='stop starting new work at this time (HH:MM Egypt time) or after this many minutes, the rest is left to the next run')
+argparser.add_argument('--max-requests', type=int, help='stop starting new work after this many requests, the rest is left to the next run')
+args = argparser.parse_args()
+
+pagestore = None
+if args.store_pages or args.replay:
+    pagestore = PageStore(args.pagestore)
+
+#every page request goes through one shared session that keeps connections to the website alive between requests
+#requests to a host that keeps failing are paused by the circuit breaker rather than retried until they time out
+ratelimiter = RateLimiter(rate=requestrate, minrate=minrate, maxrate=maxrate)
+breaker = CircuitBreaker()
+session = HTTPSession(timeout=30, maxidle=maxinflight, ratelimiter=ratelimiter, pagestore=pagestore if args.store_pages else None, breaker=breaker)
+retrypolicy = RetryPolicy(session, maxattempts=5)
 
 start_time = time.time()
 
 # open the sqlite and set the connection on the database
-import sqlite3
-conn = sqlite3.connect("wuzzuf.db")
+#the page rows are written by the writer thread of the fetch pipeline while this thread waits on it
+conn = connect_db("wuzzuf.db", check_same_thread=False)
 c = conn.cursor()
 
 #NOTE:  if want to reset or alter key tables in our database use 'WuzzufDatabaseConversion.py'
 
+#create the tables, or bring an older database up to date, with the migrations it does not have yet
+migrate_db(conn, migrations)
+
 #display the information for the tables
 query ='''PRAGMA table_info(urltable);'''
 #print(c.execute(query).fetchall())
@@ -60,17 +115,26 @@ print("Start Time: {}".format(datecur))
 # Run through all of the job ads and get the most recent job ad urls that have been posted to the website, 
 # but have not yet been downloaded.  
 # Have the URLs stored to a list which is returned
-def get_WuzuffJobUrls(lastdownloaddate):
+# The listing also stops once knownrun jobs in a row are in knownids (the ids of the jobs we already have), as the
+# post dates only tell us the day and otherwise we re-read pages of jobs we already have.
+# With full set to True every page of the listing is read.
+def get_WuzuffJobUrls(lastdownloaddate, knownids=None, full=False):
 
     url = 'https://wuzzuf.net/search/jobs?start=0&filters%5Bcountry%5D%5B0%5D=Egypt'
     nextpage = True
     urlinfo = []
+    if knownids is None:
+        knownids = set()
+    run = 0
+    stoprun = knownrun
+    if full:
+        lastdownloaddate = datetime.date.min
+        stoprun = 0
 
     #check the dates of the pages that are listed
-    while nextpage:
+    while nextpage and not budget.exhausted():
     
-        req = urlrequest.Request(url)
-        response = urlrequest.urlopen(req)
+        response = session.get(url)
         soup = BeautifulSoup(response, 'html.parser')
     
         # objective is to get the links from the page and put it in a list to call and run through
@@ -88,17 +152,23 @@ def get_WuzuffJobUrls(lastdownloaddate):
             temp = re.search(r'[jobs/p/|internship/](\d+)-',url)
             uniqueid = temp.group(1)
             urlinfo.append([uniqueid,dateval.strftime('%Y-%m-%d'),temptime['title'],url])
+            if int(uniqueid) in knownids:
+                run+=1
+            elif not (stoprun and run >= stoprun):
+                run = 0
         
         # get the next set of job listings for this classification only if we have not already collected the data
         #print(dateval.date())
-        if dateval.date() >= lastdownloaddate:
+        if stoprun and run >= stoprun:
+            print("Stopped the listing after {} known jobs in a row".format(run))
+            nextpage = False
+        elif dateval.date() >= lastdownloaddate:
             nextpg = name_box.find('li', attrs={'class': 'pag-next'})
             try:
                 url = nextpg.find_all('a', href=True)[0]['href']
                 #Print out length to track number of urls retrieved
                 #print(len(url_jobs))
-                # sleep so that we do not bombard the website with requests
-                time.sleep(3)
+                # no sleep needed here as the session rate limiter keeps us from bombarding the website with requests
             except AttributeError:
                 nextpage = False
         else:
@@ -108,232 +178,131 @@ def get_WuzuffJobUrls(lastdownloaddate):
 
     return(data)
 
-#Function keeps requesting page or until it hits limit of 5 requests
+#Function retries transient errors up to 5 times and returns None if the page is gone (404/410)
 def request_until_succeed(url):
-    req = urlrequest.Request(url)
-    count = 1
-    while count <= 5:
-        try: 
-            response = urlrequest.urlopen(req)
-            if response.getcode() == 200:
-                return(response)
-        except Exception:
-            time.sleep(1)
-            print("Error for URL %s: %s" % (url, datetime.datetime.now()))
-        count+=1
-    return(None)
+    return(retrypolicy.get(url))
     
 #this page scrapes individual job advertisement pages and returns the row of relevant data collected
-punctuation = [";",",","'","&"]
 def get_WuzzufJobData(uniqueid,urlname,postdate):
+    return(parse_WuzzufJobData(*fetch_WuzzufJobPage(uniqueid,urlname,postdate)))
+
+#this downloads a job page and returns the arguments parse_WuzzufJobData needs to turn it into a row
+def fetch_WuzzufJobPage(uniqueid,urlname,postdate):
 
     ### note want to add in the actual time download if we are to use the page views as proxy       
     datetimecur = datetime.datetime.now(tz)
-    downloaddate = datetimecur.strftime('%Y-%m-%d')
-    downloadtime = datetimecur.strftime('%H:%M')
 
     #request the url page
     response = request_until_succeed(urlname)
-    
-    #if was not able to retrieve any of the data in 5 function calls then simply return the data empty
-    if response is None:
-         stat = 'NOT FOUND'
-         job_data = [uniqueid, postdate, np.NAN, downloaddate, downloadtime, stat,np.NAN,np.NAN,np.NAN,np.NAN,np.NAN,np.NAN,np.NAN,np.NAN,np.NAN,np.NAN,np.NAN,np.NAN,np.NAN,np.NAN,np.NAN,np.NAN,np.NAN,np.NAN,np.NAN,np.NAN,np.NAN]
-         return(job_data)
-    
-    soup = BeautifulSoup(response, 'html.parser')
-    #print(soup)
-        
-    #check job status and see if it is open or closed
-    stat = "OPEN"
-    status = soup.find('div',attrs={'class':"alert alert-danger alert-job col-sm-12"})
-    
-    if status is not None:
-         stat = "CLOSED"
-    
-    #obtain main job data
-    
-    mainjobdata = soup.find('div', attrs={'class': 'job-main-card content-card'})
-    
-    #there is a few postings that may not be completely filled in
-    if mainjobdata is None:
-         job_data = [uniqueid, postdate, np.NAN, downloaddate, downloadtime, stat,np.NAN,np.NAN,np.NAN,np.NAN,np.NAN,np.NAN,np.NAN,np.NAN,np.NAN,np.NAN,np.NAN,np.NAN,np.NAN,np.NAN,np.NAN,np.NAN,np.NAN,np.NAN,np.NAN,np.NAN,np.NAN]
-         return(job_data)
-
-    #print(mainjobdata)
-    jobdata = mainjobdata.find_all(['h1','a','span'])
-    #print(jobdata)
-    jobinfo = {}
-
-    for d in jobdata:
-         try:
-              if d['class'][0] in ['job-title','job-company-name','job-company-location']:
-                   jobinfo[d['class'][0]] = d.get_text().strip().encode('utf-8')
-                   #print(jobinfo[d['class'][0]])
-         except KeyError:
-              pass
-
-    #get stats on applicants
-    try:
-        num_applicants = mainjobdata.find_all('div', attrs={'class': 'applicants-num'})[0].get_text()
-    except IndexError:
-        num_applicants = 0
-        
-    try:
-        num_vacancies = mainjobdata.find_all('span', attrs={'class': 'vacancies-num'})[0].get_text()
-    except IndexError:
-        num_vacancies = 0
-
-    stats = mainjobdata.find_all('div', attrs={'class': 'applicants-stat-num'})
-    #print(stats)
-    try:
-        num_seen = stats[0].get_text()
-    except IndexError:
-        num_seen = 0
-    try:
-        num_shortlist = stats[1].get_text()
-    except IndexError:
-        num_shortlist = 0
-    try:
-        num_rejected = stats[2].get_text()
-    except IndexError:
-        num_rejected = 0
-        
-    #get date when posted and download date
-    post_date = mainjobdata.find('p', attrs={'class': 'job-post-date'})
-    #print(mainjobdata.find('time',datetime=True))
-    #temp = mainjobdata.find('time',datetime=True)
-    #print(temp['datetime'])
-    #print(datetime.datetime.strptime(temp['datetime'],'%Y-%m-%dT%H:%M:%S'))
-    
-    #print(post_date['title'])
-    try:
-        pdate = datetime.datetime.strptime(post_date['title'],'%A, %B %d, %Y at %I:%M%p')
-    except ValueError:
-        pdate = datetime.datetime.strptime(post_date['title'],'%A, %B %d, %Y at%I:%M%p')
-    postdate = pdate.strftime('%Y-%m-%d')
-    posttime = pdate.strftime('%H:%M') # best time format for spreadsheet programs
-    
-    #now still need to split the post-date into a term that is valid
-    #print(post_date['title'])
-    
-    #obtain job summary information
-    jobsumm = soup.find('div', attrs={'class': 'row job-summary'})
-    jobsummdata = jobsumm.find_all(['dl'])
-    #print(jobsumm)
-    #print(jobdata)
-    for d in jobsummdata:
-        try:
-            temp = re.sub('\s+',' ',d.get_text()).strip().split(":")
-            name = re.sub('\s',"_",temp[0].lower())
-            if name in ['languages']:
-                jobinfo[name] = temp[1].strip().split(',')
-                jobinfo['languages'] = '>'.join(jobinfo['languages'])
-            elif name in ['salary']:
-                if 'Negotiable' in temp[1].strip().split(','):
-                    jobinfo[name] = temp[1].strip().split(',')
-                else:
-                    newtemp = temp[1].strip().replace(',','')
-                    jobinfo[name] = [newtemp]
-                jobinfo['salary']='>'.join(jobinfo['salary'])
-            else:
-                jobinfo[name] = temp[1].strip()
-        except KeyError:
-            pass
-        
-    #these columns are not consistent across jobs so need to take this into account
-    columns = ['experience_needed','career_level','job_type','salary','education_level','gender','travel_frequency','languages','vacancies']
-    for c in columns:
-        if c not in jobinfo:
-            jobinfo[c] = "NA"
-       
-    jobcard = soup.find('div', attrs={'class': "about-job content-card"})
-    #print(jobcard)
-    data = jobcard.find_all('div', attrs={'class': "labels-wrapper"})
-    #print(data)
-    jobroles = []
-    for d in data:
-        for role in d.find_all(['a']):
-            jobroles.append(role.get_text().strip())    
-    jobinfo['roles'] = '>'.join(jobroles)
-    #print(jobroles)
-        
-    #obtain job requirements, key words, and industry indicators
-    jobreqs = soup.find('div', attrs={'class': "job-requirements content-card"})
-    #print(jobreqs)
-    if jobreqs is not None:
-        data = jobreqs.find_all('meta', content=True)
-        keywords = []
-        try:
-            temp = data[0]['content']
-            for t in temp.split(', '):
-                keywords.append(t)
-            jobinfo['keywords'] = keywords
-        except IndexError:
-            jobinfo['keywords'] = []
-    else:
-        jobinfo['keywords'] = []
-    jobinfo['keywords']='>'.join(jobinfo['keywords']).encode('utf-8')
-    #print(jobinfo['keywords'])
-    
-    try:
-        data = jobreqs.find_all('li')
-        reqs = []
-        for d in data:
-            temp = d.get_text().lower().strip('.')
-            for p in punctuation:
-                temp = temp.replace(';','')
-            reqs.append(temp)
-        jobinfo['requirements'] = reqs
-        #print(reqs)
-    except:
-        jobinfo['requirements'] = []
-    jobinfo['requirements']='>'.join(jobinfo['requirements']).encode('utf-8')
-    
-    industries = soup.find('div', attrs={"class": "industries labels-wrapper"})
-    inds = []
-    
-    try:
-        indust = industries.find_all(['a'])
-        for ind in indust:
-            inds.append(ind.get_text().strip())
-    except:
-        pass
-    jobinfo['industries'] = '>'.join(inds).encode('utf-8')
-
-    #print(jobinfo)
-    # now let us return the dictionary entries to write to a csv file.  
-    #Note that we may need to split so we do not have problem with commas
-    job_data = [uniqueid, postdate, posttime, downloaddate, downloadtime, stat,jobinfo['job-title'],jobinfo['job-company-name'],jobinfo['job-company-location'],num_applicants,num_vacancies,num_seen,
-               num_shortlist,num_rejected,jobinfo['experience_needed'],jobinfo['career_level'],jobinfo['job_type'],jobinfo['salary'],
-               jobinfo['education_level'],jobinfo['gender'],jobinfo['travel_frequency'],jobinfo['languages'],jobinfo['vacancies'],jobinfo['roles'],jobinfo['keywords'],jobinfo['requirements'],jobinfo['industries']]
-    
-    return(job_data)
+    page = None
+    if response is not None:
+        page = response.read()
+    return(uniqueid,postdate,page,datetimecur)
+
     
 #query the latest data in the table that will inform our scraping tool
-conn = sqlite3.connect("wuzzuf.db")
-c = conn.cursor()
+#the rows are written with executemany and committed in batches of writer.maxrows rows (or every writer.maxdelay
+#seconds) rather than one at a time, whatever is buffered is written when the scraper exits
+writer = BufferedWriter(conn)
+
+#the job pages to fetch each day are kept in the crawlfrontier table (see ScrapeFrontier.py) so that the ones a run
+#did not get to before its --deadline or --max-requests are fetched first by the next run
+frontier = CrawlFrontier(conn, datecur.strftime('%Y-%m-%d'), writer=writer)
+budget = RunBudget(session, get_deadline(args.deadline, datecur), args.max_requests)
+
+#this rebuilds the pagedata rows from the job pages kept in the page store without making any requests to the website
+#e.g. to re-derive historical rows after fixing a bug in parse_WuzzufJobData
+def replay_pagedata():
+
+    #the page store is keyed by url so look up the id and post date of each job from its url
+    #jobs that have since been archived are no longer in urltable so these are matched on the id in the url
+    joburls = {}
+    for uniqueid, urls, postdate in c.execute('''SELECT uniqueid, urls, postdate FROM urltable;''').fetchall():
+        joburls[urls] = (uniqueid, postdate)
+    archived = {}
+    for uniqueid, postdate in c.execute('''SELECT DISTINCT uniqueid, postdate FROM archivedpagedata;''').fetchall():
+        archived[str(uniqueid)] = postdate
+
+    query = '''INSERT OR REPLACE INTO {} (uniqueid,postdate,posttime,downloaddate,downloadtime,stat,jobtitle,
+    company,location,num_applicants,num_vacancies,num_seen,num_shortlisted,num_rejected,experience_needed,career_level,
+    job_type, salary,education_level,gender,travel_frequency,languages,vacancies,roles,keywords,requirements,industries)
+    VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?);'''
+    replayed = 0
+    skipped = 0
+    for url, fetchtime, status, body in pagestore.iter_fetches('https://wuzzuf.net/'):
+        #skip the search listing pages, and the errors other than a job that was gone (404/410), which never produced
+        #a row in the live run
+        if '/search/' in url:
+            continue
+        if status != 200 and status not in gonestatus:
+            skipped += 1
+            continue
+        if url in joburls:
+            uniqueid, postdate = joburls[url]
+            table = 'pagedata'
+        else:
+            temp = re.search(r'[jobs/p/|internship/](\d+)-',url)
+            if temp is None or temp.group(1) not in archived:
+                skipped += 1
+                continue
+            uniqueid = temp.group(1)
+            postdate = archived[uniqueid]
+            table = 'archivedpagedata'
+        page = body if status == 200 else None
+        rowvalues = parse_WuzzufJobData(uniqueid,postdate,page,fetchtime.astimezone(tz))
+        writer.write(query.format(table), rowvalues)
+        replayed += 1
+    writer.flush()
+    print("Replayed pages into pagedata: {} (skipped {})".format(replayed, skipped))
+
+if args.replay:
+    replay_pagedata()
+    pagestore.close()
+    writer.close()
+    c.close()
+    print("Run Time: {}".format(time.time()-start_time))
+    sys.exit()
 query = "SELECT MAX(postdate) FROM urltable"
 lastdate = c.execute(query).fetchall()[0][0]
 print("Last Date Downloaded: {}".format(lastdate))
+#ids of the jobs already collected, to stop the listing once it gets back to them
+query = '''SELECT uniqueid FROM urltable UNION SELECT uniqueid FROM archivedpagedata;'''
+knownids = set(row[0] for row in c.execute(query).fetchall())
+#read the whole listing on its day of the rotation
+fulllisting = fulllistingdays > 0 and datecur.toordinal() % fulllistingdays == 0
 if lastdate is None:
     #if no data is in the database lets insert from 29 days ago
     newdate = datecur - datetime.timedelta(days=29)
     #print(datetime.date(newdate.year,newdate.month,newdate.day))
-    urldata = get_WuzuffJobUrls(datetime.date(newdate.year,newdate.month,newdate.day))
+    urldata = get_WuzuffJobUrls(datetime.date(newdate.year,newdate.month,newdate.day),knownids,fulllisting)
 else:
     #if there is data in the database lets only insert data posted after the last date downloaded
     temp = lastdate.split('-')
-    urldata = get_WuzuffJobUrls(datetime.date(int(temp[0]),int(temp[1]),int(temp[2])))
+    urldata = get_WuzuffJobUrls(datetime.date(int(temp[0]),int(temp[1]),int(temp[2])),knownids,fulllisting)
     
 print("Maximum new pages to enter into urltable: {}".format(len(urldata)))
     
 #insert all of the new data retrieved from the website into the urltable
-for i, row in urldata.iterrows():
-    #only inserts into table where there is unique id and postdate (else ignore's the entry)
-    query = '''INSERT OR IGNORE INTO urltable (uniqueid,postdate,urlpostdatetime,urls) VALUES (?,?,?,?);'''
-    c.execute(query, row)
-conn.commit()
+#only inserts into table where there is unique id and postdate (else ignore's the entry)
+query = '''INSERT OR IGNORE INTO urltable (uniqueid,postdate,urlpostdatetime,urls) VALUES (?,?,?,?);'''
+writer.write_many(query, urldata[['uniqueid','postdate','datetime','url']].values.tolist())
+#a job that shows up in the listing again was not closed after all
+query = '''DELETE FROM inferredclosed WHERE uniqueid = ?;'''
+writer.write_many(query, [(int(uniqueid),) for uniqueid in urldata['uniqueid']])
+writer.flush()
+
+#FUNCTION: marks the open jobs that a listing read in full no longer shows as likely closed
+def infer_closedjobs(urldata):
+    seenids = set(int(uniqueid) for uniqueid in urldata['uniqueid'])
+    missing = [row[0] for row in c.execute('''SELECT DISTINCT uniqueid FROM urltable;''').fetchall() if row[0] not in seenids]
+    query = '''INSERT OR IGNORE INTO inferredclosed (uniqueid, inferreddate) VALUES (?,?);'''
+    writer.write_many(query, [(uniqueid, datecur.strftime('%Y-%m-%d')) for uniqueid in missing])
+    writer.flush()
+    return(len(missing))
+
+#a listing cut short by the run budget was not read in full
+if fulllisting and not budget.exhausted():
+    print("Jobs marked likely closed: {}".format(infer_closedjobs(urldata)))
 
 #query master table and see how many items have been inserted so far
 temp = c.execute('''SELECT * FROM urltable;''').fetchall()
@@ -342,14 +311,64 @@ temp = c.execute('''SELECT * FROM urltable;''').fetchall()
 #query the master table in order to insert into our main table holding the page data
 datenow = datecur.strftime('%Y-%m-%d')
 
-# rotates through the data and grabs the urls for the ads that have been posted today and each week up to 2 months prior
-# This dataset only contains urls where the status is open (not closed)
-jobpageurlquerylist = []
+#this picks the jobs to revisit today with the revisit scheduler, from how fast their number of applicants has been
+#changing between the visits stored in pagedata
+def get_revisits():
+    #jobs are moved out of urltable once they are archived, closedjobs leaves out the closed ones listed again since
+    scheduler = RevisitScheduler(budget=args.revisit_budget, maxinterval=14)
+    inferred = get_inferredclosed()
+    for row in c.execute('''SELECT u.uniqueid, u.urls, u.postdate FROM urltable u WHERE NOT EXISTS (SELECT 1 FROM closedjobs x WHERE x.uniqueid = u.uniqueid);''').fetchall():
+        if row[0] not in inferred:
+            scheduler.add_ad(row[0], row[2], row)
+    for uniqueid, downloaddate, num_applicants in c.execute('''SELECT uniqueid, downloaddate, num_applicants FROM pagedata;'''):
+        scheduler.add_snapshot(uniqueid, downloaddate, num_applicants)
+    return(scheduler.schedule(datecur.date()))
+
+#FUNCTION: ids of the jobs marked likely closed, which are left out of the revisits unless a fetch found them open
+def get_inferredclosed():
+    query = '''SELECT uniqueid FROM inferredclosed WHERE confirmstatus IS NULL OR confirmstatus != 'OPEN';'''
+    return(set(row[0] for row in c.execute(query).fetchall()))
+
+#FUNCTION: the share of the jobs marked likely closed that is fetched anyway to check the inference (picked by a
+#hash of the id so that the same jobs are picked on every run)
+def get_confirmsample():
+    query = '''SELECT u.uniqueid, u.urls, u.postdate FROM inferredclosed i INNER JOIN urltable u ON i.uniqueid = u.uniqueid WHERE i.confirmstatus IS NULL;'''
+    return([row for row in c.execute(query).fetchall() if zlib.crc32(str(row[0]).encode('utf-8')) % 1000 < confirmshare*1000])
+
+#FUNCTION: orders the jobs to fetch so that, if the run is cut short by --deadline or --max-requests, the jobs never
+#fetched before come first, followed by the revisits from the longest ago last visit to the most recent
+def prioritize_jobpageurls(jobpageurlquerylist):
+    lastvisits = dict(c.execute('''SELECT uniqueid, MAX(downloaddate) FROM pagedata GROUP BY uniqueid;''').fetchall())
+    return(sorted(jobpageurlquerylist, key=lambda urlinfo: (urlinfo[0] in lastvisits, lastvisits.get(urlinfo[0], ''))))
 
-for i in range(0,8):
-    d = i*7
-    temp = c.execute('''SELECT uniqueid, urls, postdate FROM urltable WHERE DATE(postdate) == DATE('{}','-{} days');'''.format(datecur.strftime('%Y-%m-%d'),d)).fetchall()
-    jobpageurlquerylist = jobpageurlquerylist + temp 
+jobpageurlquerylist = []
+deferred = []
+#the jobs to fetch are only picked once a day, a restarted run carries on with the ones already in the frontier
+pickjobs = len(frontier.counts('jobpage')) == 0
+
+if pickjobs and args.revisit == 'weekly':
+    # rotates through the data and grabs the urls for the ads that have been posted today and each week up to 2 months prior
+    # This dataset only contains urls where the status is open (not closed)
+    #all of the weeks are picked with one query, leaving out the closed jobs listed again since they were archived
+    postdates = [(datecur.date() - datetime.timedelta(days=i*7)).strftime('%Y-%m-%d') for i in range(0,8)]
+    query = '''SELECT u.uniqueid, u.urls, u.postdate FROM urltable u WHERE u.postdate IN ({})
+        AND NOT EXISTS (SELECT 1 FROM closedjobs x WHERE x.uniqueid = u.uniqueid);'''.format(','.join('?'*len(postdates)))
+    jobpageurlquerylist = c.execute(query, postdates).fetchall()
+    inferred = get_inferredclosed()
+    jobpageurlquerylist = [urlinfo for urlinfo in jobpageurlquerylist if urlinfo[0] not in inferred]
+elif pickjobs:
+    jobpageurlquerylist = get_revisits()
+if pickjobs:
+    #job pages an earlier run did not get to before its deadline or request budget ran out are fetched first
+    deferred = [urlinfo for workkey, urlinfo in frontier.carry_over('jobpage')]
+    print("Job pages deferred by earlier runs: {}".format(len(deferred)))
+
+if fulllistingdays > 0 and pickjobs:
+    confirmsample = get_confirmsample()
+    print("Jobs marked likely closed fetched to confirm: {}".format(len(confirmsample)))
+    jobpageurlquerylist = jobpageurlquerylist + [urlinfo for urlinfo in confirmsample if urlinfo not in jobpageurlquerylist]
+deferredids = set(urlinfo[0] for urlinfo in deferred)
+jobpageurlquerylist = deferred + [urlinfo for urlinfo in prioritize_jobpageurls(jobpageurlquerylist) if urlinfo[0] not in deferredids]
 
 #check how many queries we will make based on the numbers
 #these are the urls for which we want to re-sample and obtain the daily data.
@@ -357,22 +376,45 @@ print("Number of pages to query: {}".format(len(jobpageurlquerylist)))
 #print(jobpageurlquerylist)
 
 #run through the url pages and retrieve the information we are then going to insert this information into our key database
-for urlinfo in jobpageurlquerylist:
+#pages are downloaded and parsed concurrently by the fetch pipeline, and the rows are written in batches by its writer thread
+def write_pagedata(batch):
     query = '''INSERT OR IGNORE INTO pagedata (uniqueid,postdate,posttime,downloaddate,downloadtime,stat,jobtitle,
     company,location,num_applicants,num_vacancies,num_seen,num_shortlisted,num_rejected,experience_needed,career_level,
     job_type, salary,education_level,gender,travel_frequency,languages,vacancies,roles,keywords,requirements,industries)
     VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?);'''
-    rowvalues = get_WuzzufJobData(urlinfo[0],urlinfo[1],urlinfo[2])
     #print(rowvalues)
-    c.execute(query, rowvalues)
-    conn.commit()
+    writer.write_many(query, [rowvalues for args, rowvalues in batch])
+    #record what the page showed for the jobs that were marked likely closed
+    query = '''UPDATE inferredclosed SET confirmstatus = ? WHERE uniqueid = ?;'''
+    writer.write_many(query, [(rowvalues[5], rowvalues[0]) for args, rowvalues in batch])
+    for args, rowvalues in batch:
+        frontier.complete('jobpage', args[0])
+
+def fail_pagedata(args, e):
+    frontier.fail('jobpage', args[0])
+
+#jobs already fetched today are marked done in the frontier and are not fetched again by a restarted run
+frontier.add('jobpage', [(urlinfo[0], list(urlinfo)) for urlinfo in jobpageurlquerylist])
+
+pipeline = FetchPipeline(maxinflight=maxinflight, perhostlimit=perhostlimit, parseworkers=parseworkers)
+units = frontier.lease('jobpage', limit=500) if not budget.exhausted() else []
+while len(units) > 0:
+    jobpagetasks = [(urlinfo[1], (urlinfo[0],urlinfo[1],urlinfo[2])) for workkey, urlinfo in units]
+    pipeline.run(budget.take(jobpagetasks), fetch_WuzzufJobPage, parse_WuzzufJobData, write_pagedata, fail_pagedata)
+    frontier.release('jobpage', [workkey for workkey, urlinfo in units])
+    if budget.exhausted():
+        break
+    units = frontier.lease('jobpage', limit=500)
+if budget.exhausted():
+    counts = frontier.counts('jobpage')
+    print("Job pages deferred to the next run: {}".format(counts.get('pending', 0) + counts.get('leased', 0)))
     
-conn.commit() 
+writer.flush()
 
 #Create an archived database where we select information out of the main job database and place it
 #into a stored archived database we need to do this because the free cloud system only has limited amount of storage.
-query = '''INSERT OR IGNORE INTO archivedpagedata SELECT * FROM pagedata WHERE uniqueid in (SELECT DISTINCT uniqueid FROM pagedata WHERE stat == 'CLOSED' OR DATE(postdate) == DATE('{}','-{} days'));'''
-temp1 = c.execute(query.format(datecur,57))
+query = '''INSERT OR IGNORE INTO archivedpagedata SELECT * FROM pagedata WHERE uniqueid in (SELECT DISTINCT uniqueid FROM pagedata WHERE stat == 'CLOSED' OR postdate == DATE(?,'-{} days'));'''
+temp1 = c.execute(query.format(57), (datecur.strftime('%Y-%m-%d'),))
 #print(len(temp1.fetchall()))
 
 query = '''DELETE FROM urltable WHERE uniqueid in (SELECT DISTINCT uniqueid FROM archivedpagedata);'''
@@ -380,7 +422,8 @@ c.execute(query)
 temp2 = c.execute(query)
 #print(len(temp2.fetchall()))
 
-query = '''DELETE FROM pagedata WHERE uniqueid in (SELECT DISTINCT uniqueid FROM archivedpagedata);'''
+#pagedata and archivedpagedata are views, the rows are deleted from their fact tables
+query = '''DELETE FROM factpagedata WHERE uniqueid in (SELECT DISTINCT uniqueid FROM factarchivedpagedata);'''
 c.execute(query)
 temp3 = c.execute(query)
 #print(len(temp3.fetchall()))
@@ -399,6 +442,10 @@ query = '''SELECT * FROM archivedpagedata;'''
 temp6 = c.execute(query)
 print("Entries in table archivedpagedata: {}".format(len(temp6.fetchall())))
 
+query = '''SELECT COUNT(*), COUNT(confirmstatus), SUM(confirmstatus != 'OPEN') FROM inferredclosed;'''
+temp = c.execute(query).fetchall()[0]
+print("Jobs marked likely closed: {}, fetched to confirm: {}, confirmed closed: {}".format(temp[0], temp[1], temp[2] or 0))
+
 conn.commit() 
 
 #ideally want to extract data from both page data and archived page data to place in csv file
@@ -419,9 +466,19 @@ if datecur.day == 1:
     file.close()
         
     #clear information from the archivedpagedata
-    query = '''DELETE FROM archivedpagedata WHERE uniqueid in (SELECT uniqueid FROM archivedpagedata);'''
+    query = '''DELETE FROM factarchivedpagedata WHERE uniqueid in (SELECT uniqueid FROM factarchivedpagedata);'''
     c.execute(query)
-conn.commit()
-c.close()
 
+#the texts only the deleted rows had
+print("Texts deleted from textstore: {}".format(delete_unusedtexts(c, textkeys)))
+writer.close()
+c.close()
+print(writer.report())
+
+session.close()
+print(session.report())
+print(retrypolicy.report())
+if pagestore is not None:
+    pagestore.close()
+    print(pagestore.report())
 print("Run Time: {}".format(time.time()-start_time))
\ No newline at end of file
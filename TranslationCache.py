@@ -0,0 +1,172 @@
+###############################################################################################################
+# Translation cache for the OLX ad text
+#
+# Most OLX ads are in Arabic and are translated with googletrans, one network round trip per text.  The same text
+# comes up again and again: every revisit of an ad stores the same description, and many ads are posted with the
+# same boilerplate.  TranslationCache keeps every translation in its own SQLite file keyed by a hash of the
+# normalized text (whitespace collapsed, unicode normalized), so a text is only ever translated once:
+#
+#   translate_many(texts)  -> looks all of the texts up in the cache and sends the ones it does not have to the
+#                             translator in batches, several texts joined into one request
+#
+# The cache is bounded to maxentries translations, the ones used least recently are evicted first.
+#
+# StubTranslator stands in for googletrans.Translator (e.g. for testing without the network) and returns the text
+# unchanged.
+#
+# Used by ScrapeEgyptOLX_cloudv2.py and AnalyzeOLX_v2.py
+###############################################################################################################
+
+import time
+import hashlib
+import threading
+import unicodedata
+
+from ScrapeDatabase import connect_db
+
+#character marking where one of the texts joined into one request ends.  It is from the private use area of unicode,
+#which the translator leaves as it is, and is taken out of the texts first so that it cannot occur in them
+marker = '\ue000'
+separator = '\n' + marker + '\n'
+
+
+class StubTranslation:
+
+    def __init__(self, text, dest):
+        self.text = text
+        self.dest = dest
+
+
+class StubTranslator:
+
+    def __init__(self):
+        self.calls = 0
+
+    #FUNCTION: same call as googletrans.Translator.translate, the text comes back unchanged
+    def translate(self, text, dest='en'):
+        self.calls += 1
+        return(StubTranslation(text, dest))
+
+
+class TranslationCache:
+
+    # dbname: SQLite file the translations are kept in
+    # translator: googletrans.Translator (or StubTranslator) used for the texts not in the cache
+    # dest: language translated into
+    # maxentries: number of translations kept, the least recently used are evicted beyond this
+    # maxchars: maximum length of the texts joined into one request (googletrans takes up to 5000 characters)
+    def __init__(self, dbname, translator, dest='en', maxentries=200000, maxchars=4500):
+        self.dbname = dbname
+        self.translator = translator
+        self.dest = dest
+        self.maxentries = maxentries
+        self.maxchars = maxchars
+        self.conn = connect_db(dbname, check_same_thread=False)
+        self.lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0, 'requests': 0, 'split': 0, 'evicted': 0}
+
+        c = self.conn.cursor()
+        c.execute('''CREATE TABLE IF NOT EXISTS translations (
+            texthash VARCHAR(40),
+            translated TEXT,
+            lastused REAL,
+            PRIMARY KEY(texthash));''')
+        c.execute('''CREATE INDEX IF NOT EXISTS translations_lastused ON translations (lastused);''')
+        self.conn.commit()
+        self.entries = c.execute('''SELECT COUNT(*) FROM translations;''').fetchall()[0][0]
+
+    #FUNCTION: returns the text with the differences that do not change its translation taken out
+    def normalize(self, text):
+        return(' '.join(unicodedata.normalize('NFKC', text).split()))
+
+    def get_hash(self, text):
+        return(hashlib.sha1((self.dest + ':' + self.normalize(text)).encode('utf-8')).hexdigest())
+
+    def translate(self, text):
+        return(self.translate_many([text])[0])
+
+    #FUNCTION: returns the translations of texts, in the same order.  Values that are not text (e.g. NaN for an ad
+    #that was closed) and empty texts are returned as they are.
+    def translate_many(self, texts):
+        hashes = {}
+        for text in texts:
+            if isinstance(text, str) and text.strip() != '':
+                hashes.setdefault(self.get_hash(text), text)
+
+        with self.lock:
+            found = self.lookup(list(hashes))
+            self.stats['hits'] += len(found)
+            missing = [(texthash, text) for texthash, text in hashes.items() if texthash not in found]
+            self.stats['misses'] += len(missing)
+            for batch in self.get_batches(missing):
+                translated = self.translate_batch([text for texthash, text in batch])
+                for (texthash, text), translation in zip(batch, translated):
+                    found[texthash] = translation
+                self.store([(texthash, found[texthash]) for texthash, text in batch])
+
+        return([found[self.get_hash(text)] if isinstance(text, str) and text.strip() != '' else text for text in texts])
+
+    #FUNCTION: returns {texthash: translation} for the hashes in the cache and marks them as just used
+    def lookup(self, texthashes):
+        found = {}
+        now = time.time()
+        for i in range(0, len(texthashes), 500):
+            chunk = texthashes[i:i+500]
+            query = '''SELECT texthash, translated FROM translations WHERE texthash IN ({});'''.format(','.join('?'*len(chunk)))
+            found.update(self.conn.execute(query, chunk).fetchall())
+        self.conn.executemany('''UPDATE translations SET lastused = ? WHERE texthash = ?;''', [(now, texthash) for texthash in found])
+        self.conn.commit()
+        return(found)
+
+    #FUNCTION: splits the (texthash, text) pairs into batches that fit in one request
+    def get_batches(self, pairs):
+        batch = []
+        length = 0
+        for texthash, text in pairs:
+            if batch and length + len(separator) + len(text) > self.maxchars:
+                yield(batch)
+                batch = []
+                length = 0
+            batch.append((texthash, text))
+            length += len(separator) + len(text)
+        if batch:
+            yield(batch)
+
+    #FUNCTION: translates the texts with a single request, or one request each if the translation does not come back
+    #with a marker between each of them
+    def translate_batch(self, texts):
+        if len(texts) > 1:
+            self.stats['requests'] += 1
+            joined = separator.join(text.replace(marker, '') for text in texts)
+            translated = self.translator.translate(joined, dest=self.dest).text.split(marker)
+            if len(translated) == len(texts):
+                return([translation.strip() for translation in translated])
+            self.stats['split'] += 1
+        translations = []
+        for text in texts:
+            self.stats['requests'] += 1
+            translations.append(self.translator.translate(text, dest=self.dest).text)
+        return(translations)
+
+    #FUNCTION: adds the translations to the cache and evicts the least recently used beyond maxentries
+    def store(self, translations):
+        now = time.time()
+        c = self.conn.cursor()
+        c.executemany('''INSERT OR REPLACE INTO translations (texthash, translated, lastused) VALUES (?,?,?);''', [(texthash, translated, now) for texthash, translated in translations])
+        self.entries += len(translations)
+        if self.entries > self.maxentries:
+            self.entries = c.execute('''SELECT COUNT(*) FROM translations;''').fetchall()[0][0]
+            excess = self.entries - self.maxentries
+            if excess > 0:
+                c.execute('''DELETE FROM translations WHERE texthash IN (SELECT texthash FROM translations ORDER BY lastused LIMIT ?);''', (excess,))
+                self.stats['evicted'] += excess
+                self.entries -= excess
+        self.conn.commit()
+
+    def close(self):
+        with self.lock:
+            self.conn.commit()
+            self.conn.close()
+
+    def report(self):
+        return("Translation cache {}: {} hits, {} misses, {} translation requests ({} batches translated one text at a time), {} evicted".format(self.dbname, self.stats['hits'], self.stats['misses'], self.stats['requests'], self.stats['split'], self.stats['evicted']))
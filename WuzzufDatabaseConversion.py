@@ -1,15 +1,22 @@
 ###############################################################################################################
 # This code aims to help update the database by saving old database files into a new one
 #
+# The tables are created and changed by the migrations below the schema, whose versions are recorded in the
+# schemaversion table of wuzzuf.db.  The scraper applies any the database does not have yet when it starts (or run
+# this file to do so).
 ###############################################################################################################
 
 # open the sqlite and set the connection on the database
-import sqlite3
+from ScrapeDatabase import connect_db, migrate_db, normalize_datecolumns, querytextstore, get_storetext, get_storedtext, store_texts, encode_deltas
 
 # in sqlite the only option to convert table is to rename temporary table, create new table, and then drop old table
+# (see rebuild_table() in ScrapeDatabase.py for a migration that needs to)
 
 #SCHEMA FOR THE RELEVANT TABLES
 
+#the schema as it is once all of the migrations below have been applied.  The tables, triggers and indexes that a
+#later migration replaced are only in the migrations that create them.
+
 querycreate = {}
 
 querycreate['urltable']='''CREATE TABLE IF NOT EXISTS urltable 
@@ -19,7 +26,89 @@ querycreate['urltable']='''CREATE TABLE IF NOT EXISTS urltable
 	postdate DATE,
 	PRIMARY KEY(uniqueid,postdate));'''
 	
-querycreate['pagedata']='''CREATE TABLE IF NOT EXISTS pagedata (
+#jobs missing from a listing that was read in full, so likely closed without fetching their page.  confirmstatus
+#is the stat found when one is fetched anyway (NULL until then)
+querycreate['inferredclosed'] = '''CREATE TABLE IF NOT EXISTS inferredclosed (
+		uniqueid INTEGER,
+		inferreddate DATE,
+		confirmstatus VARCHAR(10),
+		PRIMARY KEY(uniqueid));
+		'''
+
+#jobs a fetch found closed, with the date of the first such fetch.  Kept up to date by the trigger on deltapagedata, and
+#kept when the job is archived, so that a closed job listed again is not revisited
+querycreate['closedjobs'] = '''CREATE TABLE IF NOT EXISTS closedjobs (
+		uniqueid INTEGER,
+		closeddate DATE,
+		PRIMARY KEY(uniqueid));
+		'''
+	
+queryindex = {}
+#the jobs posted on a day
+queryindex['urltable'] = '''CREATE INDEX IF NOT EXISTS urltable_postdate ON urltable (postdate);'''
+
+querytrigger = {}
+
+#TEXT STORE
+
+#the job title, roles, keywords, requirements and industries of a job rarely change between its visits, so they are
+#stored once in textstore (see ScrapeDatabase.py).  pagedata and archivedpagedata are views of factpagedata and
+#factarchivedpagedata, which only hold the keys of the texts, and the rows inserted into a view are written to its
+#fact table by its INSTEAD OF trigger.
+textcolumns = ['jobtitle','roles','keywords','requirements','industries']
+pagetables = ['pagedata','archivedpagedata']
+#the columns of the fact tables holding the keys of the texts
+textkeys = {'fact'+t: [column+'key' for column in textcolumns] for t in pagetables}
+
+queryview = {}
+for t in pagetables:
+    queryview[t] = '''CREATE VIEW IF NOT EXISTS {0} AS
+    SELECT f.uniqueid, f.postdate, f.posttime, f.downloaddate, f.downloadtime, f.stat, {1}, f.company, f.location, f.num_applicants,
+    f.num_vacancies, f.num_seen, f.num_shortlisted, f.num_rejected, f.experience_needed, f.career_level, f.job_type, f.salary, f.education_level,
+    f.gender, f.travel_frequency, f.languages, f.vacancies, {2}, {3}, {4}, {5}
+    FROM fact{0} f;'''.format(t, *[get_storedtext('f.'+column+'key', column) for column in textcolumns])
+
+    querytrigger[t+'_insert'] = '''CREATE TRIGGER IF NOT EXISTS {0}_insert INSTEAD OF INSERT ON {0}
+    BEGIN
+        {1}
+        INSERT INTO fact{0} (uniqueid,postdate,posttime,downloaddate,downloadtime,stat,jobtitlekey,company,location,num_applicants,num_vacancies,num_seen,
+        num_shortlisted,num_rejected,experience_needed,career_level,job_type,salary,education_level,gender,travel_frequency,languages,vacancies,
+        roleskey,keywordskey,requirementskey,industrieskey)
+        VALUES (NEW.uniqueid, NEW.postdate, NEW.posttime, NEW.downloaddate, NEW.downloadtime, NEW.stat, textkey(NEW.jobtitle), NEW.company, NEW.location,
+        NEW.num_applicants, NEW.num_vacancies, NEW.num_seen, NEW.num_shortlisted, NEW.num_rejected, NEW.experience_needed, NEW.career_level, NEW.job_type,
+        NEW.salary, NEW.education_level, NEW.gender, NEW.travel_frequency, NEW.languages, NEW.vacancies, textkey(NEW.roles), textkey(NEW.keywords),
+        textkey(NEW.requirements), textkey(NEW.industries));
+    END;'''.format(t, '\n        '.join(get_storetext(column) for column in textcolumns))
+
+#factpagedata and factarchivedpagedata are stored as a base row for each job in basepagedata and basearchivedpagedata
+#and a delta row for each visit in deltapagedata and deltaarchivedpagedata, which hold the columns below and the others
+#only where they differ from the base row (see encode_deltas() in ScrapeDatabase.py).  The fact tables are then views of
+#the two, so pagedata and archivedpagedata are unchanged.
+visitcolumns = ['uniqueid','postdate','downloaddate','downloadtime','stat','num_applicants','num_seen','num_shortlisted','num_rejected']
+deltatables = [prefix+t for t in pagetables for prefix in ['base','delta']]
+
+#the closed jobs and the jobs posted on a day that are archived, the visits of a job (last visit and applicants),
+#covering so that the table itself is not read, and the trigger that keeps closedjobs up to date
+querytrigger['deltapagedata'] = '''CREATE TRIGGER IF NOT EXISTS deltapagedata_closed AFTER INSERT ON deltapagedata
+    WHEN NEW.stat == 'CLOSED'
+    BEGIN
+        INSERT OR IGNORE INTO closedjobs (uniqueid,closeddate) VALUES (NEW.uniqueid, NEW.downloaddate);
+    END;'''
+queryindex['deltapagedata_stat'] = '''CREATE INDEX IF NOT EXISTS deltapagedata_stat ON deltapagedata (stat,uniqueid);'''
+queryindex['deltapagedata_postdate'] = '''CREATE INDEX IF NOT EXISTS deltapagedata_postdate ON deltapagedata (postdate,uniqueid);'''
+queryindex['deltapagedata'] = '''CREATE INDEX IF NOT EXISTS deltapagedata_job ON deltapagedata (uniqueid,downloaddate,num_applicants);'''
+
+tables = ['urltable','pagedata','archivedpagedata','inferredclosed','closedjobs']
+
+#columns holding a date, stored as 'YYYY-MM-DD'
+datecolumns = {'urltable': ['postdate'], 'pagedata': ['downloaddate','postdate'], 'archivedpagedata': ['downloaddate','postdate'], 'inferredclosed': ['inferreddate'], 'closedjobs': ['closeddate']}
+
+#MIGRATIONS
+
+#urltable and the tables of the jobs as they were first created, since replaced by the views of store_pagetexts()
+def create_basetables(c):
+    querybase = {}
+    querybase['pagedata']='''CREATE TABLE IF NOT EXISTS pagedata (
 		uniqueid INTEGER,
 		postdate DATE,
 		posttime VARCHAR(5),
@@ -50,7 +139,7 @@ querycreate['pagedata']='''CREATE TABLE IF NOT EXISTS pagedata (
 		PRIMARY KEY(uniqueid,postdate,downloaddate));
 		'''
 
-querycreate['archivedpagedata'] = '''CREATE TABLE IF NOT EXISTS archivedpagedata (
+    querybase['archivedpagedata'] = '''CREATE TABLE IF NOT EXISTS archivedpagedata (
 		uniqueid INTEGER,
 		postdate DATE,
 		posttime VARCHAR(5),
@@ -80,14 +169,142 @@ querycreate['archivedpagedata'] = '''CREATE TABLE IF NOT EXISTS archivedpagedata
 		industries VARCHAR(100),
 		PRIMARY KEY(uniqueid,postdate,downloaddate));
 		'''
-	
-tables = ['urltable','pagedata','archivedpagedata']
+
+    c.execute(querycreate['urltable'])
+    for t in ['pagedata','archivedpagedata']:
+        c.execute(querybase[t])
+
+def create_inferredclosed(c):
+    c.execute(querycreate['inferredclosed'])
+
+def normalize_dates(c):
+    normalize_datecolumns(c, datecolumns)
+
+def create_indexes(c):
+    c.execute(queryindex['urltable'])
+    querypage = {}
+    #the closed jobs and the jobs posted on a day that are archived
+    querypage['pagedata_stat'] = '''CREATE INDEX IF NOT EXISTS pagedata_stat ON pagedata (stat,uniqueid);'''
+    querypage['pagedata_postdate'] = '''CREATE INDEX IF NOT EXISTS pagedata_postdate ON pagedata (postdate,uniqueid);'''
+    #the visits of a job (last visit and applicants), covering so that the table itself is not read
+    querypage['pagedata'] = '''CREATE INDEX IF NOT EXISTS pagedata_job ON pagedata (uniqueid,downloaddate,num_applicants);'''
+    for t in ['pagedata_stat','pagedata_postdate','pagedata']:
+        c.execute(querypage[t])
+
+#creates closedjobs and fills it from the jobs already fetched, including the archived ones
+def create_closedjobs(c):
+    queryclosed = '''CREATE TRIGGER IF NOT EXISTS pagedata_closed AFTER INSERT ON pagedata
+    WHEN NEW.stat == 'CLOSED'
+    BEGIN
+        INSERT OR IGNORE INTO closedjobs (uniqueid,closeddate) VALUES (NEW.uniqueid, NEW.downloaddate);
+    END;'''
+    c.execute(querycreate['closedjobs'])
+    for t in ['archivedpagedata','pagedata']:
+        c.execute('''INSERT OR IGNORE INTO closedjobs (uniqueid,closeddate) SELECT uniqueid, MIN(downloaddate) FROM {} WHERE stat == 'CLOSED' GROUP BY uniqueid;'''.format(t))
+    c.execute(queryclosed)
+    temp = c.execute('''SELECT COUNT(*) FROM closedjobs;''').fetchall()
+    print("Number of entries in table closedjobs: {}".format(temp[0][0]))
+
+#moves the texts of pagedata and archivedpagedata to textstore
+def store_pagetexts(c):
+    queryfact = '''CREATE TABLE IF NOT EXISTS fact{} (
+		uniqueid INTEGER,
+		postdate DATE,
+		posttime VARCHAR(5),
+		downloaddate DATE,
+		downloadtime VARCHAR(5),
+		stat VARCHAR(10),
+		jobtitlekey INTEGER,
+		company VARCHAR(50),
+		location VARCHAR(50),
+		num_applicants INTEGER,
+		num_vacancies INTEGER,
+		num_seen INTEGER,
+		num_shortlisted INTEGER,
+		num_rejected INTEGER,
+		experience_needed VARCHAR(50),
+		career_level VARCHAR(50),
+		job_type VARCHAR(50),
+		salary VARCHAR(50),
+		education_level VARCHAR(50),
+		gender VARCHAR(10),
+		travel_frequency VARCHAR(20),
+		languages VARCHAR(30),
+		vacancies VARCHAR(15),
+		roleskey INTEGER,
+		keywordskey INTEGER,
+		requirementskey INTEGER,
+		industrieskey INTEGER,
+		PRIMARY KEY(uniqueid,postdate,downloaddate));
+		'''
+    c.execute(querytextstore)
+    for t in pagetables:
+        columns = [row[1] for row in c.execute('''PRAGMA table_info({});'''.format(t)).fetchall()]
+        c.execute('''ALTER TABLE {} RENAME TO {}_temp;'''.format(t, t))
+        c.execute(queryfact.format(t))
+        c.execute(queryview[t])
+        c.execute(querytrigger[t+'_insert'])
+        store_texts(c, t+'_temp', textcolumns)
+        newcolumns = [column+'key' if column in textcolumns else column for column in columns]
+        values = ['textkey({})'.format(column) if column in textcolumns else column for column in columns]
+        c.execute('''INSERT INTO fact{} ({}) SELECT {} FROM {}_temp;'''.format(t, ', '.join(newcolumns), ', '.join(values), t))
+        c.execute('''DROP TABLE {}_temp;'''.format(t))
+    #the trigger and indexes of pagedata (see create_indexes() and create_closedjobs()), on factpagedata
+    queryfactclosed = '''CREATE TRIGGER IF NOT EXISTS factpagedata_closed AFTER INSERT ON factpagedata
+    WHEN NEW.stat == 'CLOSED'
+    BEGIN
+        INSERT OR IGNORE INTO closedjobs (uniqueid,closeddate) VALUES (NEW.uniqueid, NEW.downloaddate);
+    END;'''
+    queryfactindex = {}
+    queryfactindex['factpagedata_stat'] = '''CREATE INDEX IF NOT EXISTS factpagedata_stat ON factpagedata (stat,uniqueid);'''
+    queryfactindex['factpagedata_postdate'] = '''CREATE INDEX IF NOT EXISTS factpagedata_postdate ON factpagedata (postdate,uniqueid);'''
+    queryfactindex['factpagedata'] = '''CREATE INDEX IF NOT EXISTS factpagedata_job ON factpagedata (uniqueid,downloaddate,num_applicants);'''
+    c.execute(queryfactclosed)
+    for t in ['factpagedata_stat','factpagedata_postdate','factpagedata']:
+        c.execute(queryfactindex[t])
+    temp = c.execute('''SELECT COUNT(*) FROM textstore;''').fetchall()
+    print("Number of entries in table textstore: {}".format(temp[0][0]))
+
+#stores factpagedata and factarchivedpagedata as the base row of each job and the changes of each visit
+def encode_pagedeltas(c):
+    for t in pagetables:
+        encode_deltas(c, 'fact'+t, 'uniqueid', visitcolumns)
+    c.execute(querytrigger['deltapagedata'])
+    for t in ['deltapagedata_stat','deltapagedata_postdate','deltapagedata']:
+        c.execute(queryindex[t])
+    for t in deltatables:
+        temp = c.execute('''SELECT COUNT(*) FROM {};'''.format(t)).fetchall()
+        print("Number of entries in table {}: {}".format(t,temp[0][0]))
+
+#the insert triggers of pagedata and archivedpagedata again, to compare a text with the one already stored under its key
+def check_textkeys(c):
+    for t in pagetables:
+        c.execute('''DROP TRIGGER IF EXISTS {}_insert;'''.format(t))
+        c.execute(querytrigger[t+'_insert'])
+
+#(version, description, migration) in the order they are applied, add new ones at the end
+migrations = [
+    (1, 'urltable, pagedata and archivedpagedata', create_basetables),
+    (2, 'inferredclosed', create_inferredclosed),
+    (3, 'dates stored as YYYY-MM-DD', normalize_dates),
+    (4, 'indexes for the queries of the scraper', create_indexes),
+    (5, 'closedjobs kept up to date by a trigger on pagedata', create_closedjobs),
+    (6, 'texts of pagedata and archivedpagedata stored once in textstore', store_pagetexts),
+    (7, 'pagedata and archivedpagedata stored as the base row of each job and the changes of each visit', encode_pagedeltas),
+    (8, 'texts inserted into pagedata and archivedpagedata compared with the text stored under their key', check_textkeys),
+    ]
+
+#brings wuzzuf.db up to the latest version
+def migrate():
+    conn = connect_db("wuzzuf.db")
+    print("Version of wuzzuf.db: {}".format(migrate_db(conn, migrations)))
+    conn.close()
     
 #Report standard statistics and counts of the data that is in each of the tables    
 def report_statistics():
     
-	conn = sqlite3.connect("wuzzuf.db")
-	c = conn.cursor()
+    conn = connect_db("wuzzuf.db")
+    c = conn.cursor()
     
     for i, t in enumerate(tables):
         query ='''SELECT * FROM {};'''
@@ -97,10 +314,8 @@ def report_statistics():
         schema = c.execute(query.format(t)).fetchall()
         print(schema)
         
-        if t == "urltable":
-            query = '''SELECT MAX(DATE(postdate)) FROM {};'''.format(t)
-        else:
-            query = '''SELECT MAX(DATE(downloaddate)) FROM {};'''.format(t)
+        datecol = datecolumns[t][0]
+        query = '''SELECT MAX({}) FROM {};'''.format(datecol,t)
         
         print(c.execute(query).fetchall())
         lastdate = c.execute(query).fetchall()[0][0]
@@ -109,10 +324,7 @@ def report_statistics():
         #Check the most recent data and report counts, means for each of the data points in the dataset
         for j, row in enumerate(schema):
             var = row[1]
-            if t == "jobadpageurls":
-                querystats = '''SELECT DATE(postdate), AVG({}), COUNT({}) FROM {} GROUP BY DATE(postdate);'''.format(var,var,t,lastdate)
-            else:
-                querystats = '''SELECT DATE(downloaddate), AVG({}), COUNT({}) FROM {} GROUP BY DATE(downloaddate);'''.format(var,var,t,lastdate)
+            querystats = '''SELECT {}, AVG({}), COUNT({}) FROM {} GROUP BY {};'''.format(datecol,var,var,t,datecol)
             print(querystats)
             queryresults = {}
             print("{}: {}".format(var,c.execute(querystats).fetchall()))
@@ -121,43 +333,27 @@ def report_statistics():
 
     c.close()
 	
-#function resets all of the tables
+#function resets all of the tables (drops them and creates them again with all of the migrations)
 def reset_tables():
 
-    for i, t in enumerate(tables):
+    conn = connect_db("wuzzuf.db")
+    c = conn.cursor()
+
+    #the views (factpagedata and factarchivedpagedata among them from version 7) are dropped before the tables
+    for (t,) in c.execute('''SELECT name FROM sqlite_master WHERE type = 'view';''').fetchall():
+        c.execute('''DROP VIEW IF EXISTS {};'''.format(t))
+    for i, t in enumerate(tables + ['fact'+t for t in pagetables] + deltatables + ['textstore','schemaversion']):
         deletequery = '''DROP TABLE IF EXISTS {};'''
-        c.execute(deletequery.format(table[i]))
-        c.execute(querycreate[t])
-        query ='''PRAGMA table_info({});'''
-        print(c.execute(query.format(table[i])).fetchall())
+        c.execute(deletequery.format(t))
     conn.commit()
+    migrate_db(conn, migrations)
+    for i, t in enumerate(tables):
+        query ='''PRAGMA table_info({});'''
+        print(c.execute(query.format(t)).fetchall())
     conn.close()
 	
-def update_table(tablename,newtablequery):
-	
-	conn = sqlite3.connect("wuzzuf.db")
-	c = conn.cursor()
-	
-	query = "ALTER TABLE {} RENAME TO {}_temp;"
-	c.execute(query.format(tablename,tablename))
-	
-	c.execute(newtablequery)
-	
-	query = "INSERT INTO {} SELECT * FROM {}_temp;"
-	c.execute(query.format(tablename,tablename))
-	query ='''PRAGMA table_info({});'''
-	print(c.execute(query.format(tablename)).fetchall())
-	
-	query = '''DROP TABLE IF EXISTS {}_temp;'''
-	c.execute(query.format(tablename))
-	
-	temp = c.execute('''SELECT * FROM {};'''.format(tablename)).fetchall()
-	print("Number of entries in converted table {}: {}".format(tablename,len(temp)))
-	
-	conn.commit()
-	conn.close()
-
 # Comment or uncomment as needed
-reset_tables()
-# report_statistics()
-# update_table()   
+if __name__ == '__main__':
+    migrate()
+    # reset_tables()
+    # report_statistics()
@@ -0,0 +1,5 @@
+#the scripts and modules of the repository are top level files, so the tests import them from the repository root
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
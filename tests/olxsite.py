@@ -0,0 +1,137 @@
+#pages of a stand-in OLX site for the tests that crawl end to end: they are stored in a page store and served by
+#LocalTestServer.py, and the scraper is run against it as if the clock were some days ahead (see shiftclock.py)
+import os
+import sys
+import time
+import socket
+import datetime
+import subprocess
+
+from pytz import timezone
+
+from PageStore import PageStore
+from ScrapeDatabase import connect_db
+
+repo = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+site = 'https://olx.com.eg'
+months = ['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec']
+today = datetime.datetime.now(timezone('Africa/Cairo')).date()
+
+
+def fsub(subregion):
+    return(subregion.lower().replace(' ', '-'))
+
+
+def listing_date(date):
+    return('{} {}'.format(date.day, months[date.month-1]))
+
+
+def get_date(day):
+    return((today + datetime.timedelta(days=day)).strftime('%Y-%m-%d'))
+
+
+#FUNCTION: the sitemap page with the subregions of each region, regions is {region: [subregion]}
+def sitemap_page(regions):
+    page = '<div class="content text">'
+    for region, subregions in sorted(regions.items()):
+        page += '<div class="bgef pding5_10 marginbott10 margintop20 clr">{} (100)</div><div class="clr marginbott10"><ul>'.format(region)
+        page += ''.join('<li>{} (10)</li>'.format(subregion) for subregion in subregions) + '</ul></div>'
+    return(page + '</div>')
+
+
+#FUNCTION: the page of a subregion with the number of ads in each of its sectors, sectors is {sector: count}
+def subregion_page(f, sectors):
+    page = '<div class="wrapper">'
+    for sector, count in sorted(sectors.items()):
+        page += '<a class="topLink tdnone " href="{}/en/jobs-services/{}/{}/"><span class="link">{}</span><span class="counter nowrap">{}</span></a>'.format(site, sector.lower(), f, sector, count)
+    return(page + '</div>')
+
+
+#FUNCTION: the pages of the listing of a subregion-sector, {path: page}, ads is [(uniqueadid, postdate)] in the order
+#they are listed and perpage of them are shown on each page
+def listing_pages(f, sector, ads, perpage=20):
+    pages = {}
+    totalpages = max(1, (len(ads) + perpage - 1)//perpage)
+    for p in range(totalpages):
+        page = '<div class="pager rel clr"><input type="submit" class="x pageextended:{}"/></div>'.format(totalpages)
+        for uniqueadid, postdate in ads[p*perpage:(p + 1)*perpage]:
+            page += '<div class="ads__item__photos-holder"><img src="x/jobs-services-thumb.png"/><a data-statkey="ad.observed.list" class="a b {{id:{}}}">x</a></div>'.format(uniqueadid)
+            page += '<div class="ads__item__info"><a class="ads__item__title" href="{}/en/ad/job-ID{}.html">t</a><p class="ads__item__date">{}</p></div>'.format(site, uniqueadid, listing_date(postdate))
+        path = '/en/jobs-services/{}/{}/'.format(sector.lower(), f)
+        if p > 0:
+            path = path + '?page={}'.format(p + 1)
+        pages[path] = '<html><body>' + page + '</body></html>'
+    return(pages)
+
+
+#FUNCTION: the page of an open ad, {path: page}
+def ad_page(uniqueadid, postdate, views):
+    page = '''<html><body><div class="clr offerheadinner pding15 pdingright20"><h1> Job {0} </h1>
+<span class="pdingleft10 brlefte5">Added at 10:15, {1} {2} {3}, Ad ID: {0}</span></div>
+<div class="clr descriptioncontent marginbott20"><div class="clr" id="textContent"> Description of job {0} </div></div>
+<div class="pdingtop10">Views:<strong>{4}</strong></div></body></html>'''.format(uniqueadid, postdate.day, postdate.strftime('%B'), postdate.year, views)
+    return({'/en/ad/job-ID{}.html'.format(uniqueadid): page})
+
+
+#FUNCTION: stores the pages {path: page} of the site on the given day in the page store served by LocalTestServer.py,
+#a page of None is taken down (answered with a 404)
+def write_pages(tmp_path, pages, day):
+    pagestore = PageStore(os.path.join(tmp_path, 'pages.db'))
+    fetchtime = datetime.datetime(2018, 1, 1, tzinfo=datetime.timezone.utc) + datetime.timedelta(days=day)
+    for path, page in pages.items():
+        if page is None:
+            pagestore.save(site + path, 404, b'', fetchtime)
+        else:
+            pagestore.save(site + path, 200, page.encode('utf-8'), fetchtime)
+    pagestore.close()
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return(s.getsockname()[1])
+
+
+def start_server(tmp_path, port):
+    server = subprocess.Popen([sys.executable, os.path.join(repo, 'LocalTestServer.py'), '--pagestore', 'pages.db', '--port', str(port)], cwd=tmp_path, stdout=subprocess.DEVNULL)
+    for i in range(100):
+        try:
+            socket.create_connection(('127.0.0.1', port)).close()
+            return(server)
+        except OSError:
+            time.sleep(0.1)
+    server.kill()
+    raise RuntimeError("LocalTestServer.py did not start")
+
+
+#FUNCTION: runs a script in tmp_path as if it were day days later and returns what it printed
+def run(tmp_path, args, day=0):
+    env = dict(os.environ, PYTHONPATH=repo)
+    command = [sys.executable, os.path.join(repo, 'tests', 'shiftclock.py'), str(day)] + args
+    result = subprocess.run(command, cwd=tmp_path, env=env, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, timeout=600)
+    assert result.returncode == 0, result.stdout.decode('utf-8', 'replace')[-3000:]
+    return(result.stdout.decode('utf-8', 'replace'))
+
+
+#FUNCTION: runs the OLX scraper (with the extra args) against the pages stored in tmp_path and returns what it printed
+def scrape(tmp_path, day, args=None):
+    port = free_port()
+    server = start_server(tmp_path, port)
+    try:
+        return(run(tmp_path, [os.path.join(repo, 'ScrapeEgyptOLX_cloudv2.py'), '--base-url', 'http://127.0.0.1:{}'.format(port)] + (args or []), day))
+    finally:
+        server.terminate()
+        server.wait()
+
+
+#FUNCTION: the rows of a query on the egyptOLX.db of tmp_path
+def query_db(tmp_path, query, params=()):
+    conn = connect_db(os.path.join(tmp_path, 'egyptOLX.db'))
+    rows = conn.execute(query, params).fetchall()
+    conn.close()
+    return(rows)
+
+
+#FUNCTION: the ids of the ads fetched on the given day
+def get_visits(tmp_path, day):
+    return(set(row[0] for row in query_db(tmp_path, '''SELECT uniqueadid FROM jobadpagedata WHERE downloaddate = ?;''', (get_date(day),))))
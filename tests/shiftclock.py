@@ -0,0 +1,24 @@
+#runs a script as if the clock were some days ahead, so that a test can crawl several days in a row
+#
+#   python tests/shiftclock.py <days> ScrapeEgyptOLX_cloudv2.py <args>
+import sys
+import runpy
+import datetime
+
+
+class ShiftedDatetime(datetime.datetime):
+
+    shift = datetime.timedelta(0)
+
+    @classmethod
+    def now(cls, tz=None):
+        return(super().now(tz) + cls.shift)
+
+
+if __name__ == '__main__':
+    #the class is taken from the imported module rather than __main__ so that the parsing processes can unpickle it
+    import shiftclock
+    shiftclock.ShiftedDatetime.shift = datetime.timedelta(days=int(sys.argv[1]))
+    datetime.datetime = shiftclock.ShiftedDatetime
+    sys.argv = sys.argv[2:]
+    runpy.run_path(sys.argv[0], run_name='__main__')
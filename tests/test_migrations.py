@@ -0,0 +1,315 @@
+#the migrations of egyptOLX.db and wuzzuf.db keep the rows of a database made before them: the tables they replace
+#with views read back the original rows (with the dates as YYYY-MM-DD), and the scrapers' inserts, replays, archive
+#moves and deletes through the views work on the migrated database as they did on the tables.  The counts of the
+#region-sectors inserted are compared with the latest ones and only the changes are recorded
+import random
+import datetime
+import collections
+
+import pytest
+
+import OLXDatabaseConversion as olx
+import WuzzufDatabaseConversion as wuzzuf
+from ScrapeDatabase import connect_db, migrate_db, normalize_date, delete_unusedtexts
+
+olxpagequery = '''INSERT OR {} INTO jobadpagedata (downloaddate,downloadtime,uniqueadid,postdate,posttime,pageviews,title,experiencelevel,educationlevel,type,employtype,compensation,description,textlanguage,userhref,username,userjoinmt,userjoinyear,emailavail,phoneavail,
+    adstatus)
+    VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?);'''
+olxpagecolumns = ['downloaddate','downloadtime','uniqueadid','postdate','posttime','pageviews','title','experiencelevel','educationlevel','type','employtype','compensation','description','textlanguage','userhref','username','userjoinmt','userjoinyear','emailavail','phoneavail','adstatus']
+
+wuzzufpagecolumns = ['uniqueid','postdate','posttime','downloaddate','downloadtime','stat','jobtitle','company','location','num_applicants','num_vacancies','num_seen','num_shortlisted','num_rejected',
+    'experience_needed','career_level','job_type','salary','education_level','gender','travel_frequency','languages','vacancies','roles','keywords','requirements','industries']
+wuzzufpagequery = '''INSERT OR {} INTO {} ({}) VALUES ({});'''.format('{}', '{}', ','.join(wuzzufpagecolumns), ','.join('?'*len(wuzzufpagecolumns)))
+
+
+def unpadded(date):
+    return('{}-{}-{}'.format(date.year, date.month, date.day))
+
+
+def padded(date):
+    return(date.strftime('%Y-%m-%d'))
+
+
+def get_rows(c, table, columns):
+    return(c.execute('''SELECT {} FROM {};'''.format(', '.join(columns), table)).fetchall())
+
+
+#FUNCTION: the rows as normalize_datecolumns leaves them: the dates as YYYY-MM-DD, and of two rows with the same key
+#once the dates are normalized the one whose dates already were is kept
+def normalized(rows, columns, datecolumns, keys):
+    kept = {}
+    for row in rows:
+        new = tuple(normalize_date(value) if column in datecolumns else value for column, value in zip(columns, row))
+        key = tuple(new[columns.index(column)] for column in keys)
+        if key not in kept or new == row:
+            kept[key] = new
+    return(sorted_rows(kept.values()))
+
+
+def sorted_rows(rows):
+    return(sorted(rows, key=repr))
+
+
+def baseline_tables(c, tables):
+    return(dict((t, [row[1] for row in c.execute('''PRAGMA table_info({});'''.format(t)).fetchall()]) for t in tables))
+
+
+def get_keys(c, table):
+    info = c.execute('''PRAGMA table_info({});'''.format(table)).fetchall()
+    return([row[1] for row in sorted(info, key=lambda row: row[5]) if row[5] > 0])
+
+
+#FUNCTION: an egyptOLX.db as the scraper wrote it before the migrations: counts, urls and visits of a few hundred ads
+#with the post dates of the listings not zero padded, descriptions posted in several ads and ads that closed
+def make_olxbaseline(c):
+    rnd = random.Random(1)
+    start = datetime.date(2017, 12, 1)
+    subregions = [('Cairo', 'cairo', 'Maadi', 'maadi'), ('Cairo', 'cairo', 'Nasr City', 'nasr-city'), ('Giza', 'giza', 'Dokki', 'dokki'), (None, None, None, None)]
+    sectors = ['accounting', 'sales', 'jobs-wanted', None]
+    descriptions = ['Description {}\r\nline two'.format(i).encode('utf-8') for i in range(15)] + [None]
+    for day in range(5):
+        date = start + datetime.timedelta(days=day)
+        for region, freg, subregion, fsubreg in subregions[:3]:
+            c.execute('''INSERT INTO regionadcounts VALUES (?,?,?,?,?,?,?,?);''', (padded(date), '10:00', region, freg, subregion, fsubreg, 1000 + day, 100 + rnd.randint(0, 3)))
+            for sector in sectors[:3]:
+                c.execute('''INSERT INTO regionjobadcounts VALUES (?,?,?,?,?,?,?,?,?);''', (padded(date), '10:05', region, freg, subregion, fsubreg, sector, '/en/jobs-services/{}/{}/'.format(sector, fsubreg), rnd.randint(0, 2)))
+    for uniqueadid in range(1000, 1300):
+        region, freg, subregion, fsubreg = rnd.choice(subregions)
+        sector = rnd.choice(sectors)
+        postdate = start + datetime.timedelta(days=rnd.randint(0, 3))
+        c.execute('''INSERT INTO jobadpageurls VALUES (?,?,?,?,?,?,?,?,?,?);''', (region, freg, subregion, fsubreg, sector, unpadded(postdate), uniqueadid, rnd.randint(0, 1), rnd.randint(0, 1), 'job-ID{}.html'.format(uniqueadid)))
+        title = rnd.choice([b'Accountant', b'Sales', 'Job {}'.format(uniqueadid).encode('utf-8')])
+        description = rnd.choice(descriptions)
+        pageviews = rnd.randint(0, 50)
+        visits = rnd.randint(1, 4)
+        for visit in range(visits):
+            downloaddate = postdate + datetime.timedelta(days=visit*2)
+            closed = visit == visits - 1 and rnd.random() < 0.2
+            if closed:
+                row = (padded(downloaddate), '11:00', None, None, None, None, None, uniqueadid, padded(postdate)) + (None,)*16 + ('CLOSED',)
+            else:
+                pageviews += rnd.randint(0, 30)
+                if rnd.random() < 0.2:
+                    description = rnd.choice(descriptions)
+                row = (padded(downloaddate), '11:{:02d}'.format(visit), region, freg, subregion, fsubreg, sector, uniqueadid, padded(postdate), '09:30', pageviews, title,
+                    'Entry level', rnd.choice(['Bachelors', None]), 'Full time', None, rnd.choice([None, 3000]), description, 'AR', '/user/{}'.format(uniqueadid % 7),
+                    'User', 2016, 'Mar', rnd.randint(0, 1), rnd.randint(0, 1), 'OPEN')
+            c.execute('''INSERT INTO jobadpagedata VALUES ({});'''.format(','.join('?'*26)), row)
+    #an ad stored under its post date in both forms, the normalized one is kept
+    c.execute('''INSERT INTO jobadpageurls VALUES (?,?,?,?,?,?,?,?,?,?);''', ('Cairo', 'cairo', 'Maadi', 'maadi', 'sales', '2017-12-05', 2000, 0, 0, 'job-ID2000.html'))
+    c.execute('''INSERT INTO jobadpageurls VALUES (?,?,?,?,?,?,?,?,?,?);''', ('Cairo', 'cairo', 'Maadi', 'maadi', 'sales', '2017-12-5', 2000, 1, 1, 'job-ID2000.html'))
+
+
+@pytest.fixture
+def olxdb(tmp_path):
+    conn = connect_db(str(tmp_path / 'egyptOLX.db'))
+    c = conn.cursor()
+    migrate_db(conn, olx.migrations[:1])
+    make_olxbaseline(c)
+    conn.commit()
+    columns = baseline_tables(c, olx.viewtables)
+    keys = dict((t, get_keys(c, t)) for t in olx.viewtables)
+    expected = dict((t, normalized(get_rows(c, t, columns[t]), columns[t], olx.datecolumns[t], keys[t])) for t in olx.viewtables)
+    assert migrate_db(conn, olx.migrations) == olx.migrations[-1][0]
+    yield conn, columns, expected
+    conn.close()
+
+
+def test_olx_views_return_the_original_rows(olxdb):
+    conn, columns, expected = olxdb
+    c = conn.cursor()
+    for t in olx.viewtables:
+        assert c.execute('''SELECT type FROM sqlite_master WHERE name = ?;''', (t,)).fetchall() == [('view',)]
+        assert sorted_rows(get_rows(c, t, columns[t])) == expected[t], t
+    assert len(expected['jobadpageurls']) == 301
+    #the visits are stored as deltas of a base row for each ad, and each text once
+    assert c.execute('''SELECT COUNT(*) FROM basejobadpagedata;''').fetchall()[0][0] == 300
+    assert c.execute('''SELECT COUNT(*) FROM deltajobadpagedata;''').fetchall()[0][0] == len(expected['jobadpagedata'])
+    texts = set(value for row in expected['jobadpagedata'] for value in (row[columns['jobadpagedata'].index('title')], row[columns['jobadpagedata'].index('description')]) if value is not None)
+    assert c.execute('''SELECT COUNT(*) FROM textstore;''').fetchall()[0][0] == len(texts)
+    #the tables filled by the migrations from the original rows
+    closed = collections.defaultdict(list)
+    for row in expected['jobadpagedata']:
+        if row[-1] == 'CLOSED':
+            closed[row[7]].append(row[0])
+    assert sorted(c.execute('''SELECT uniqueadid, closeddate FROM jobadclosed;''').fetchall()) == sorted((adid, min(dates)) for adid, dates in closed.items())
+    latest = {}
+    for row in expected['regionjobadcounts']:
+        key = (row[2], row[4], row[6])
+        if key not in latest or latest[key][0] < row[0]:
+            latest[key] = (row[0], row[8])
+    assert sorted((row[0], row[1], row[2], row[3], row[4]) for row in c.execute('''SELECT region, subregion, sector, downloaddate, totalposts FROM regionjobadlatest;''').fetchall()) == sorted(key + value for key, value in latest.items())
+
+
+def test_olx_inserts_into_the_views(olxdb):
+    conn, columns, expected = olxdb
+    c = conn.cursor()
+    visits = [dict(zip(columns['jobadpagedata'], row)) for row in expected['jobadpagedata']]
+    visit = [row for row in visits if row['adstatus'] == 'OPEN' and row['region'] is not None][0]
+    textcount = c.execute('''SELECT COUNT(*) FROM textstore;''').fetchall()[0][0]
+
+    #a visit already stored is left as it is by the scraper's INSERT OR IGNORE
+    duplicate = dict(visit, pageviews=visit['pageviews'] + 100, downloadtime='23:59')
+    c.execute(olxpagequery.format('IGNORE'), [duplicate[column] for column in olxpagecolumns])
+    #a new visit of an ad already stored, with another description, and a visit of a new ad with the same texts
+    revisit = dict(visit, downloaddate='2018-01-20', downloadtime='12:00', pageviews=visit['pageviews'] + 7, description=b'A new description')
+    c.execute(olxpagequery.format('IGNORE'), [revisit[column] for column in olxpagecolumns])
+    newad = dict(revisit, uniqueadid=5000, postdate='2018-01-20')
+    c.execute(olxpagequery.format('IGNORE'), [newad[column] for column in olxpagecolumns])
+    closedvisit = dict((column, None) for column in olxpagecolumns)
+    closedvisit.update(downloaddate='2018-01-21', downloadtime='12:00', uniqueadid=5000, postdate='2018-01-20', adstatus='CLOSED')
+    c.execute(olxpagequery.format('IGNORE'), [closedvisit[column] for column in olxpagecolumns])
+    conn.commit()
+
+    def get_visit(uniqueadid, downloaddate):
+        query = '''SELECT {} FROM jobadpagedata WHERE uniqueadid = ? AND downloaddate = ?;'''.format(', '.join(olxpagecolumns))
+        return([dict(zip(olxpagecolumns, row)) for row in c.execute(query, (uniqueadid, downloaddate)).fetchall()])
+
+    assert get_visit(visit['uniqueadid'], visit['downloaddate']) == [dict((column, visit[column]) for column in olxpagecolumns)]
+    assert get_visit(revisit['uniqueadid'], '2018-01-20') == [dict((column, revisit[column]) for column in olxpagecolumns)]
+    assert get_visit(5000, '2018-01-20') == [dict((column, newad[column]) for column in olxpagecolumns)]
+    assert get_visit(5000, '2018-01-21') == [closedvisit]
+    assert c.execute('''SELECT region, subregion, jobsector FROM jobadpagedata WHERE uniqueadid = 5000 AND downloaddate = '2018-01-20';''').fetchall() == [(None, None, None)]
+    assert c.execute('''SELECT closeddate FROM jobadclosed WHERE uniqueadid = 5000;''').fetchall() == [('2018-01-21',)]
+    assert c.execute('''SELECT COUNT(*) FROM textstore;''').fetchall()[0][0] == textcount + 1
+    assert c.execute('''SELECT COUNT(*) FROM jobadpagedata;''').fetchall()[0][0] == len(expected['jobadpagedata']) + 3
+
+    #a replay rewrites the visit
+    replayed = dict(visit, pageviews=visit['pageviews'] + 1, title=b'Replayed title')
+    c.execute(olxpagequery.format('REPLACE'), [replayed[column] for column in olxpagecolumns])
+    conn.commit()
+    assert get_visit(visit['uniqueadid'], visit['downloaddate']) == [dict((column, replayed[column]) for column in olxpagecolumns)]
+    assert c.execute('''SELECT COUNT(*) FROM jobadpagedata;''').fetchall()[0][0] == len(expected['jobadpagedata']) + 3
+
+    #the counts and urls of the listings
+    count = [row for row in expected['regionjobadcounts'] if row[0] == '2017-12-05'][0]
+    c.execute('''INSERT OR IGNORE INTO regionjobadcounts (downloaddate,downloadtime,region,freg,subregion,fsubreg,sector,urlregsector,totalposts) VALUES (?,?,?,?,?,?,?,?,?);''', ('2017-12-06',) + count[1:8] + (count[8] + 5,))
+    c.execute('''INSERT OR IGNORE INTO regionjobadcounts (downloaddate,downloadtime,region,freg,subregion,fsubreg,sector,urlregsector,totalposts) VALUES (?,?,?,?,?,?,?,?,?);''', ('2017-12-06',) + count[1:8] + (count[8] + 9,))
+    assert c.execute('''SELECT totalposts FROM regionjobadcounts WHERE downloaddate = '2017-12-06' AND subregion = ? AND sector = ?;''', (count[4], count[6])).fetchall() == [(count[8] + 5,)]
+    assert c.execute('''SELECT oldtotalposts, totalposts FROM regionjobadchanges WHERE downloaddate = '2017-12-06' AND subregion = ? AND sector = ?;''', (count[4], count[6])).fetchall() == [(count[8], count[8] + 5)]
+    c.execute('''INSERT OR IGNORE INTO jobadpageurls (region,freg,subregion,fsubreg,jobsector,postdate,uniqueadid,i_photo,i_featured,urllinkshort) VALUES (?,?,?,?,?,?,?,?,?,?);''', ('Alexandria', 'alexandria', 'Smouha', 'smouha', 'sales', '2018-01-20', 5000, 0, 1, 'job-ID5000.html'))
+    c.execute('''INSERT OR IGNORE INTO jobadpageurls (region,freg,subregion,fsubreg,jobsector,postdate,uniqueadid,i_photo,i_featured,urllinkshort) VALUES (?,?,?,?,?,?,?,?,?,?);''', ('Alexandria', 'alexandria', 'Smouha', 'smouha', 'sales', '2018-01-20', 5000, 1, 1, 'job-ID5000.html'))
+    assert c.execute('''SELECT region, subregion, jobsector, i_photo FROM jobadpageurls WHERE uniqueadid = 5000;''').fetchall() == [('Alexandria', 'Smouha', 'sales', 0)]
+
+
+def test_olx_count_changes(tmp_path):
+    conn = connect_db(str(tmp_path / 'egyptOLX.db'))
+    migrate_db(conn, olx.migrations)
+    c = conn.cursor()
+    query = '''INSERT OR IGNORE INTO regionjobadcounts (downloaddate,downloadtime,region,freg,subregion,fsubreg,sector,urlregsector,totalposts) VALUES (?,?,?,?,?,?,?,?,?);'''
+    def insert(date, subregion, sector, totalposts):
+        c.execute(query, (date, '10:05', 'Cairo', 'cairo', subregion, subregion.lower(), sector, '/en/jobs-services/{}/{}/'.format(sector, subregion.lower()), totalposts))
+    insert('2018-01-01', 'Maadi', 'sales', 10)
+    insert('2018-01-01', 'Dokki', 'sales', 4)
+    #the next day one count changed, one stayed the same and a sector was listed for the first time
+    insert('2018-01-02', 'Maadi', 'sales', 12)
+    insert('2018-01-02', 'Dokki', 'sales', 4)
+    insert('2018-01-02', 'Dokki', 'accounting', 1)
+    #a second sweep of the same day is ignored
+    insert('2018-01-02', 'Maadi', 'sales', 15)
+    conn.commit()
+    assert sorted(c.execute('''SELECT downloaddate, subregion, sector, oldtotalposts, totalposts FROM regionjobadchanges;''').fetchall()) == [
+        ('2018-01-01', 'Dokki', 'sales', None, 4), ('2018-01-01', 'Maadi', 'sales', None, 10),
+        ('2018-01-02', 'Dokki', 'accounting', None, 1), ('2018-01-02', 'Maadi', 'sales', 10, 12)]
+    assert sorted(c.execute('''SELECT subregion, sector, downloaddate, totalposts FROM regionjobadlatest;''').fetchall()) == [
+        ('Dokki', 'accounting', '2018-01-02', 1), ('Dokki', 'sales', '2018-01-02', 4), ('Maadi', 'sales', '2018-01-02', 12)]
+    conn.close()
+
+
+#FUNCTION: a wuzzuf.db as the scraper wrote it before the migrations, with the dates not zero padded
+def make_wuzzufbaseline(c):
+    rnd = random.Random(2)
+    start = datetime.date(2017, 11, 1)
+    requirements = ['Requirement {}\nand more'.format(i) for i in range(10)] + [None]
+    for uniqueid in range(100, 260):
+        postdate = start + datetime.timedelta(days=rnd.randint(0, 5))
+        c.execute('''INSERT INTO urltable VALUES (?,?,?,?);''', (uniqueid, 'https://wuzzuf.net/jobs/p/{}-job'.format(uniqueid), 'Monday', unpadded(postdate)))
+        applicants = rnd.randint(0, 20)
+        table = 'archivedpagedata' if uniqueid % 9 == 0 else 'pagedata'
+        visits = rnd.randint(1, 4)
+        jobrequirements = rnd.choice(requirements)
+        for visit in range(visits):
+            applicants += rnd.randint(0, 15)
+            if rnd.random() < 0.2:
+                jobrequirements = rnd.choice(requirements)
+            stat = 'CLOSED' if visit == visits - 1 and rnd.random() < 0.2 else 'OPEN'
+            downloaddate = postdate + datetime.timedelta(days=visit*3)
+            row = (uniqueid, unpadded(postdate), '10:15', unpadded(downloaddate), '12:{:02d}'.format(visit), stat, rnd.choice(['Accountant', 'Engineer']), 'Company {}'.format(uniqueid % 5), 'Cairo',
+                applicants, 1, applicants*2, rnd.randint(0, 3), 0, '1-3 years', 'Entry Level', 'Full Time', None, 'Bachelor', 'Male', None, 'English', '1 open position',
+                'Accounting', 'excel,accounting', jobrequirements, 'Banking')
+            c.execute(wuzzufpagequery.format('IGNORE', table), row)
+
+
+@pytest.fixture
+def wuzzufdb(tmp_path):
+    conn = connect_db(str(tmp_path / 'wuzzuf.db'))
+    c = conn.cursor()
+    migrate_db(conn, wuzzuf.migrations[:1])
+    make_wuzzufbaseline(c)
+    conn.commit()
+    columns = baseline_tables(c, wuzzuf.pagetables + ['urltable'])
+    keys = dict((t, get_keys(c, t)) for t in columns)
+    expected = dict((t, normalized(get_rows(c, t, columns[t]), columns[t], wuzzuf.datecolumns[t], keys[t])) for t in columns)
+    assert migrate_db(conn, wuzzuf.migrations) == wuzzuf.migrations[-1][0]
+    yield conn, columns, expected
+    conn.close()
+
+
+def test_wuzzuf_views_return_the_original_rows(wuzzufdb):
+    conn, columns, expected = wuzzufdb
+    c = conn.cursor()
+    for t in columns:
+        assert sorted_rows(get_rows(c, t, columns[t])) == expected[t], t
+    for t in wuzzuf.pagetables:
+        assert c.execute('''SELECT type FROM sqlite_master WHERE name = ?;''', (t,)).fetchall() == [('view',)]
+        assert c.execute('''SELECT COUNT(*) FROM delta{};'''.format(t)).fetchall()[0][0] == len(expected[t])
+        assert c.execute('''SELECT COUNT(*) FROM base{};'''.format(t)).fetchall()[0][0] == len(set(row[0] for row in expected[t]))
+    closed = collections.defaultdict(list)
+    for t in wuzzuf.pagetables:
+        for row in expected[t]:
+            if row[5] == 'CLOSED':
+                closed[row[0]].append(row[3])
+    assert sorted(c.execute('''SELECT uniqueid, closeddate FROM closedjobs;''').fetchall()) == sorted((uniqueid, min(dates)) for uniqueid, dates in closed.items())
+
+
+def test_wuzzuf_inserts_and_archive(wuzzufdb):
+    conn, columns, expected = wuzzufdb
+    c = conn.cursor()
+    visits = [dict(zip(wuzzufpagecolumns, row)) for row in expected['pagedata']]
+    visit = visits[0]
+
+    #the scraper's INSERT OR IGNORE leaves a visit already stored as it is and adds the new ones
+    c.execute(wuzzufpagequery.format('IGNORE', 'pagedata'), [dict(visit, num_applicants=999)[column] for column in wuzzufpagecolumns])
+    revisit = dict(visit, downloaddate='2017-12-20', num_applicants=visit['num_applicants'] + 3, requirements='Changed requirements', stat='CLOSED')
+    c.execute(wuzzufpagequery.format('IGNORE', 'pagedata'), [revisit[column] for column in wuzzufpagecolumns])
+    newjob = dict(visit, uniqueid=900, postdate='2017-12-19', downloaddate='2017-12-20', stat='OPEN')
+    c.execute(wuzzufpagequery.format('IGNORE', 'pagedata'), [newjob[column] for column in wuzzufpagecolumns])
+    conn.commit()
+    query = '''SELECT {} FROM pagedata WHERE uniqueid = ? ORDER BY downloaddate;'''.format(', '.join(wuzzufpagecolumns))
+    assert [dict(zip(wuzzufpagecolumns, row)) for row in c.execute(query, (visit['uniqueid'],)).fetchall()] == [row for row in visits if row['uniqueid'] == visit['uniqueid']] + [revisit]
+    assert [dict(zip(wuzzufpagecolumns, row)) for row in c.execute(query, (900,)).fetchall()] == [newjob]
+    assert c.execute('''SELECT closeddate FROM closedjobs WHERE uniqueid = ?;''', (visit['uniqueid'],)).fetchall() == [('2017-12-20',)]
+
+    #the scraper moves the closed jobs and those posted 57 days ago to archivedpagedata and deletes them from pagedata
+    pagedata = sorted_rows(get_rows(c, 'pagedata', wuzzufpagecolumns))
+    archivedpagedata = sorted_rows(get_rows(c, 'archivedpagedata', wuzzufpagecolumns))
+    moved = set(row[0] for row in pagedata if row[5] == 'CLOSED' or row[1] == '2017-11-02')
+    assert visit['uniqueid'] in moved and 900 not in moved
+    query = '''INSERT OR IGNORE INTO archivedpagedata SELECT * FROM pagedata WHERE uniqueid in (SELECT DISTINCT uniqueid FROM pagedata WHERE stat == 'CLOSED' OR postdate == DATE(?,'-{} days'));'''
+    c.execute(query.format(57), ('2017-12-29',))
+    c.execute('''DELETE FROM factpagedata WHERE uniqueid in (SELECT DISTINCT uniqueid FROM factarchivedpagedata);''')
+    conn.commit()
+    assert sorted_rows(get_rows(c, 'pagedata', wuzzufpagecolumns)) == [row for row in pagedata if row[0] not in moved and row[0] not in set(r[0] for r in archivedpagedata)]
+    assert sorted_rows(get_rows(c, 'archivedpagedata', wuzzufpagecolumns)) == sorted_rows(archivedpagedata + [row for row in pagedata if row[0] in moved])
+    assert c.execute('''SELECT COUNT(*) FROM basepagedata WHERE uniqueid IN (SELECT uniqueid FROM basearchivedpagedata);''').fetchall()[0][0] == 0
+    assert c.execute('''SELECT closeddate FROM closedjobs WHERE uniqueid = ?;''', (visit['uniqueid'],)).fetchall() == [('2017-12-20',)]
+
+    #and on the first of the month clears archivedpagedata, with the texts only its rows had
+    c.execute('''DELETE FROM factarchivedpagedata WHERE uniqueid in (SELECT uniqueid FROM factarchivedpagedata);''')
+    assert delete_unusedtexts(c, wuzzuf.textkeys) > 0
+    conn.commit()
+    assert get_rows(c, 'archivedpagedata', wuzzufpagecolumns) == []
+    assert c.execute('''SELECT COUNT(*) FROM basearchivedpagedata;''').fetchall()[0][0] == 0
+    assert sorted_rows(get_rows(c, 'pagedata', wuzzufpagecolumns)) == [row for row in pagedata if row[0] not in moved and row[0] not in set(r[0] for r in archivedpagedata)]
+    texts = set(value for row in get_rows(c, 'pagedata', wuzzuf.textcolumns) for value in row if value is not None)
+    assert c.execute('''SELECT COUNT(*) FROM textstore;''').fetchall()[0][0] == len(texts)
@@ -0,0 +1,172 @@
+#the OLX scraper run against the stand-in site of olxsite.py: a run stopped part way through the subregion sweep is
+#resumed by the next run without sweeping the same subregions again, and a listing is no longer read once it shows
+#knownrun ads in a row that are already known.  An ad shown in several listings (or under several post dates) is
+#fetched once a day and every listing it was seen in is kept.  The ads a listing read in full no longer shows are
+#marked likely closed and only a sample of them is fetched to confirm it.  The weekly revisits leave out the ads a
+#fetch found closed, and only the listings whose count changed in the last days are read
+import os
+import zlib
+import datetime
+
+from PageStore import PageStore
+from olxsite import today, fsub, get_date, sitemap_page, subregion_page, listing_pages, ad_page, write_pages, scrape, query_db, get_visits
+
+#the days of the rotation of listings read in full in ScrapeEgyptOLX_cloudv2.py, and the share of the ads marked
+#likely closed that are fetched to confirm
+fulllistingdays = 7
+confirmshare = 0.05
+
+
+#FUNCTION: the number of times each page of the site was fetched by the runs that stored their pages
+def get_fetches(tmp_path):
+    pagestore = PageStore(os.path.join(tmp_path, 'egyptOLX_pages.db'))
+    fetches = {}
+    for url, fetchtime, status, body in pagestore.iter_fetches('https://olx.com.eg/'):
+        path = url[len('https://olx.com.eg'):]
+        fetches[path] = fetches.get(path, 0) + 1
+    pagestore.close()
+    return(fetches)
+
+
+def test_subregion_sweep_resumed(tmp_path):
+    subregions = ['Area {}'.format(k) for k in range(12)]
+    pages = {'/en/sitemap/regions/': sitemap_page({'Cairo': subregions})}
+    for subregion in subregions:
+        pages['/en/jobs-services/{}/'.format(fsub(subregion))] = subregion_page(fsub(subregion), {'Sales': 0})
+        pages.update(listing_pages(fsub(subregion), 'Sales', []))
+    write_pages(tmp_path, pages, 0)
+
+    #the request budget runs out while the first subregions are being swept
+    scrape(tmp_path, 0, ['--store-pages', '--max-requests', '2'])
+    swept = query_db(tmp_path, '''SELECT COUNT(*) FROM regionjobadcounts WHERE downloaddate = ?;''', (get_date(0),))[0][0]
+    assert 0 < swept < len(subregions)
+    output = scrape(tmp_path, 0, ['--store-pages'])
+    assert "Subregions already written today: {}".format(swept) in output
+    assert query_db(tmp_path, '''SELECT COUNT(*) FROM regionjobadcounts WHERE downloaddate = ?;''', (get_date(0),))[0][0] == len(subregions)
+    fetches = get_fetches(tmp_path)
+    assert fetches['/en/sitemap/regions/'] == 1
+    assert [fetches['/en/jobs-services/{}/'.format(fsub(subregion))] for subregion in subregions] == [1]*len(subregions)
+
+
+#FUNCTION: a subregion whose Sales listing is read in full on the given day of the rotation (full is True) or not
+def pick_subregion(day, full):
+    for k in range(100):
+        subregion = 'Area {}'.format(k)
+        key = '{}/Sales'.format(fsub(subregion)).encode('utf-8')
+        if (zlib.crc32(key) % fulllistingdays == (today + datetime.timedelta(days=day)).toordinal() % fulllistingdays) == full:
+            return(subregion)
+
+
+#FUNCTION: stores the site with a single subregion whose listings {sector: [(uniqueadid, postdate)]} show the ads, and
+#the pages of the ads in adpages (None for an ad that was taken down)
+def write_listings(tmp_path, day, subregion, listings, adpages, perpage=20):
+    f = fsub(subregion)
+    pages = {'/en/sitemap/regions/': sitemap_page({'Cairo': [subregion]}), '/en/jobs-services/{}/'.format(f): subregion_page(f, dict((sector, len(ads)) for sector, ads in listings.items()))}
+    for sector, ads in listings.items():
+        pages.update(listing_pages(f, sector, ads, perpage))
+    pages.update(adpages)
+    write_pages(tmp_path, pages, day)
+
+
+def test_listing_stopped_on_known_ads(tmp_path):
+    subregion = pick_subregion(1, False)
+    ads = [(300000 + i, today) for i in range(30)]
+    #no page views so that the ads are not revisited the next day
+    adpages = dict(page for uniqueadid, postdate in ads for page in ad_page(uniqueadid, postdate, 0).items())
+    write_listings(tmp_path, 0, subregion, {'Sales': ads}, adpages, perpage=15)
+    scrape(tmp_path, 0, ['--store-pages'])
+    assert get_fetches(tmp_path)['/en/jobs-services/sales/{}/?page=2'.format(fsub(subregion))] == 1
+
+    #two new ads on top of the ones already known, all posted since the last download
+    newads = [(300100 + i, today + datetime.timedelta(days=1)) for i in range(2)]
+    adpages = dict(page for uniqueadid, postdate in newads for page in ad_page(uniqueadid, postdate, 0).items())
+    write_listings(tmp_path, 1, subregion, {'Sales': newads + ads}, adpages, perpage=15)
+    output = scrape(tmp_path, 1, ['--store-pages'])
+    assert "Listings stopped early on 10 known ads in a row: 1" in output
+    assert get_fetches(tmp_path)['/en/jobs-services/sales/{}/?page=2'.format(fsub(subregion))] == 1
+    assert get_visits(tmp_path, 1) == set(uniqueadid for uniqueadid, postdate in newads)
+
+
+def test_ad_in_several_listings_fetched_once(tmp_path):
+    lastweek = today - datetime.timedelta(days=7)
+    #400000 is reposted in another sector (and taken down before it is fetched), 400001 is listed in both sectors
+    listings = {'Sales': [(400000, today), (400001, today), (400002, today)], 'Accounting': [(400001, today), (400000, lastweek)]}
+    adpages = {'/en/ad/job-ID400000.html': None}
+    for uniqueadid in [400001, 400002]:
+        adpages.update(ad_page(uniqueadid, today, 10))
+    write_listings(tmp_path, 0, 'Dokki', listings, adpages)
+    #the weekly revisits pick the ad under both post dates
+    scrape(tmp_path, 0, ['--revisit', 'weekly'])
+    assert sorted(query_db(tmp_path, '''SELECT uniqueadid, postdate FROM jobadpageurls;''')) == [(400000, get_date(-7)), (400000, get_date(0)), (400001, get_date(0)), (400002, get_date(0))]
+    #the latest post date is kept for the visit
+    assert sorted(query_db(tmp_path, '''SELECT uniqueadid, postdate, adstatus FROM jobadpagedata WHERE downloaddate = ?;''', (get_date(0),))) == [(400000, get_date(0), 'CLOSED'), (400001, get_date(0), 'OPEN'), (400002, get_date(0), 'OPEN')]
+    assert sorted(query_db(tmp_path, '''SELECT uniqueadid, jobsector FROM jobadlistings;''')) == [(400000, 'Accounting'), (400000, 'Sales'), (400001, 'Accounting'), (400001, 'Sales'), (400002, 'Sales')]
+
+
+#FUNCTION: the first ad id from start that is (sample is True) or is not in the share of the ads marked likely closed
+#that are fetched to confirm
+def pick_adid(start, sample):
+    uniqueadid = start
+    while (zlib.crc32(str(uniqueadid).encode('utf-8')) % 1000 < confirmshare*1000) != sample:
+        uniqueadid += 1
+    return(uniqueadid)
+
+
+def test_ads_missing_from_full_listing_marked_closed(tmp_path):
+    subregion = pick_subregion(1, True)
+    sampled = pick_adid(500000, True)
+    ads = [pick_adid(sampled + 1, False)]
+    while len(ads) < 4:
+        ads.append(pick_adid(ads[-1] + 1, False))
+    listed = [(uniqueadid, today) for uniqueadid in [sampled] + ads]
+    adpages = dict(page for uniqueadid, postdate in listed for page in ad_page(uniqueadid, postdate, 0).items())
+    write_listings(tmp_path, 0, subregion, {'Sales': listed}, adpages)
+    scrape(tmp_path, 0)
+
+    #the listing is read in full and no longer shows three of the ads, the one in the sample was taken down
+    write_listings(tmp_path, 1, subregion, {'Sales': listed[3:]}, {'/en/ad/job-ID{}.html'.format(sampled): None})
+    scrape(tmp_path, 1)
+    inferred = query_db(tmp_path, '''SELECT uniqueadid, inferreddate, confirmstatus FROM jobadinferredclosed;''')
+    assert sorted(inferred) == [(sampled, get_date(1), 'CLOSED'), (ads[0], get_date(1), None), (ads[1], get_date(1), None)]
+    assert get_visits(tmp_path, 1) == set([sampled])
+    assert query_db(tmp_path, '''SELECT uniqueadid FROM jobadclosed;''') == [(sampled,)]
+
+    #an ad that shows up in the listing again was not closed after all
+    write_listings(tmp_path, 2, subregion, {'Sales': [listed[1]] + listed[3:]}, {})
+    scrape(tmp_path, 2)
+    assert sorted(query_db(tmp_path, '''SELECT uniqueadid FROM jobadinferredclosed;''')) == [(sampled,), (ads[1],)]
+
+
+def test_weekly_revisits_leave_out_closed_ads(tmp_path):
+    threedaysago = today - datetime.timedelta(days=3)
+    listed = [(600000, today), (600001, today), (600002, today), (600003, threedaysago)]
+    adpages = dict(page for uniqueadid, postdate in listed for page in ad_page(uniqueadid, postdate, 10).items())
+    adpages['/en/ad/job-ID600002.html'] = None
+    write_listings(tmp_path, 0, 'Haram', {'Sales': listed}, adpages)
+    scrape(tmp_path, 0, ['--revisit', 'weekly'])
+    assert get_visits(tmp_path, 0) == set([600000, 600001, 600002])
+    assert query_db(tmp_path, '''SELECT uniqueadid, closeddate FROM jobadclosed;''') == [(600002, get_date(0))]
+
+    #a week later the ads posted that day are revisited, but not the one found closed
+    write_listings(tmp_path, 7, 'Haram', {'Sales': listed}, {})
+    scrape(tmp_path, 7, ['--revisit', 'weekly'])
+    assert get_visits(tmp_path, 7) == set([600000, 600001])
+
+
+def test_only_changed_listings_read(tmp_path):
+    ads = {'maadi': [(700000, today)], 'dokki': [(700100, today)]}
+    for day in [0, 7]:
+        if day == 7:
+            #a new ad in Maadi, the count of Dokki has not changed for more than 5 days
+            ads['maadi'].insert(0, (700001, today + datetime.timedelta(days=7)))
+        pages = {'/en/sitemap/regions/': sitemap_page({'Cairo': ['Maadi', 'Dokki']})}
+        for f, listed in ads.items():
+            pages['/en/jobs-services/{}/'.format(f)] = subregion_page(f, {'Sales': len(listed)})
+            pages.update(listing_pages(f, 'Sales', listed))
+            pages.update(dict(page for uniqueadid, postdate in listed for page in ad_page(uniqueadid, postdate, 0).items()))
+        write_pages(tmp_path, pages, day)
+        scrape(tmp_path, day, ['--store-pages'])
+    fetches = get_fetches(tmp_path)
+    assert fetches['/en/jobs-services/sales/maadi/'] == 2
+    assert fetches['/en/jobs-services/sales/dokki/'] == 1
+    assert get_visits(tmp_path, 7) == set([700001])
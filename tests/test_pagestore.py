@@ -0,0 +1,39 @@
+#the page store keeps every fetch of a page but each distinct body only once, and gives the pages back as they were
+#fetched for the replay
+import datetime
+
+from PageStore import PageStore
+
+utc = datetime.timezone.utc
+
+
+def test_same_body_stored_once(tmp_path):
+    pagestore = PageStore(str(tmp_path / 'pages.db'))
+    for day in range(1, 4):
+        pagestore.save('https://olx.com.eg/en/ad/1', 200, b'<html>ad 1</html>', datetime.datetime(2018, 1, day, tzinfo=utc))
+    #the same body under another url is not stored again either
+    pagestore.save('https://olx.com.eg/en/ad/2', 200, b'<html>ad 1</html>', datetime.datetime(2018, 1, 1, tzinfo=utc))
+    pagestore.save('https://olx.com.eg/en/ad/2', 200, b'<html>ad 2</html>', datetime.datetime(2018, 1, 2, tzinfo=utc))
+    assert pagestore.stats == {'saved': 5, 'newbodies': 2}
+    assert pagestore.conn.execute('''SELECT COUNT(*) FROM pagebodies;''').fetchall()[0][0] == 2
+    assert pagestore.conn.execute('''SELECT COUNT(*) FROM pagefetches;''').fetchall()[0][0] == 5
+    pagestore.close()
+
+
+def test_fetches_replayed(tmp_path):
+    dbname = str(tmp_path / 'pages.db')
+    pagestore = PageStore(dbname)
+    first = datetime.datetime(2018, 1, 1, 6, 0, tzinfo=utc)
+    second = datetime.datetime(2018, 1, 2, 6, 0, tzinfo=utc)
+    pagestore.save('https://olx.com.eg/en/ad/1', 200, b'<html>open</html>', first)
+    pagestore.save('https://olx.com.eg/en/ad/1', 404, None, second)
+    pagestore.save('https://wuzzuf.net/jobs/p/1', 200, b'<html>wuzzuf</html>', first)
+    pagestore.close()
+
+    pagestore = PageStore(dbname)
+    assert list(pagestore.iter_fetches('https://olx.com.eg/')) == [('https://olx.com.eg/en/ad/1', first, 200, b'<html>open</html>'),
+                                                                  ('https://olx.com.eg/en/ad/1', second, 404, b'')]
+    assert [fetch[1] for fetch in pagestore.iter_fetches('https://olx.com.eg/', since=second)] == [second]
+    assert pagestore.get_latest('https://olx.com.eg/en/ad/1') == (404, b'')
+    assert pagestore.get_latest('https://olx.com.eg/en/ad/3') is None
+    pagestore.close()
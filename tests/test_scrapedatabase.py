@@ -0,0 +1,205 @@
+#two texts with the same key in textstore fail the insert rather than one of them reading back the other.
+#BufferedWriter commits its rows in batches and flushes whatever is still buffered when the scraper exits or is stopped.
+#connect_db opens the databases so that they can be read while a scraper writes to them
+import os
+import sys
+import signal
+import threading
+import sqlite3
+import subprocess
+
+import pytest
+
+import ScrapeDatabase
+import WuzzufDatabaseConversion as wuzzuf
+from ScrapeDatabase import connect_db, migrate_db, store_texts, BufferedWriter
+
+repo = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+pagequery = '''INSERT OR IGNORE INTO pagedata (uniqueid,postdate,downloaddate,stat,jobtitle,roles) VALUES (?,?,?,?,?,?);'''
+countquery = '''INSERT INTO counts VALUES (?,?);'''
+
+
+#FUNCTION: a text_key under which every text has the same key
+def colliding_key(text):
+    if text is None:
+        return(None)
+    return(1)
+
+
+def test_same_text_stored_once(tmp_path):
+    conn = connect_db(str(tmp_path / 'wuzzuf.db'))
+    migrate_db(conn, wuzzuf.migrations)
+    conn.execute(pagequery, (1, '2018-01-01', '2018-01-02', 'OPEN', 'Accountant', 'Finance'))
+    conn.execute(pagequery, (1, '2018-01-01', '2018-01-03', 'OPEN', 'Accountant', 'Finance'))
+    assert conn.execute('''SELECT COUNT(*) FROM textstore;''').fetchall()[0][0] == 2
+    assert conn.execute('''SELECT jobtitle, roles FROM pagedata;''').fetchall() == [('Accountant', 'Finance')]*2
+    conn.close()
+
+
+def test_key_collision_in_trigger(tmp_path, monkeypatch):
+    monkeypatch.setattr(ScrapeDatabase, 'text_key', colliding_key)
+    conn = connect_db(str(tmp_path / 'wuzzuf.db'))
+    migrate_db(conn, wuzzuf.migrations)
+    conn.execute(pagequery, (1, '2018-01-01', '2018-01-02', 'OPEN', 'Accountant', None))
+    #the same text again is not a collision
+    conn.execute(pagequery, (1, '2018-01-01', '2018-01-03', 'OPEN', 'Accountant', None))
+    with pytest.raises(sqlite3.IntegrityError, match='textstore key collision'):
+        conn.execute(pagequery, (2, '2018-01-01', '2018-01-03', 'OPEN', 'Driver', None))
+    assert conn.execute('''SELECT uniqueid, jobtitle FROM pagedata;''').fetchall() == [(1, 'Accountant'), (1, 'Accountant')]
+    conn.close()
+
+
+def test_key_collision_in_migration(tmp_path, monkeypatch):
+    monkeypatch.setattr(ScrapeDatabase, 'text_key', colliding_key)
+    conn = connect_db(str(tmp_path / 'texts.db'))
+    c = conn.cursor()
+    c.execute(ScrapeDatabase.querytextstore)
+    c.execute('''CREATE TABLE jobs (title TEXT);''')
+    c.executemany('''INSERT INTO jobs VALUES (?);''', [('Accountant',), ('Accountant',)])
+    store_texts(c, 'jobs', ['title'])
+    c.execute('''INSERT INTO jobs VALUES ('Driver');''')
+    with pytest.raises(ValueError):
+        store_texts(c, 'jobs', ['title'])
+    conn.close()
+
+
+#FUNCTION: a database with a table of counts and a writer on it
+def make_writer(dbname, **kwargs):
+    conn = connect_db(dbname)
+    conn.execute('''CREATE TABLE counts (fsubreg TEXT, totalposts INTEGER);''')
+    conn.commit()
+    return(conn, BufferedWriter(conn, **kwargs))
+
+
+def count_rows(dbname):
+    conn = connect_db(dbname)
+    count = conn.execute('''SELECT COUNT(*) FROM counts;''').fetchall()[0][0]
+    conn.close()
+    return(count)
+
+
+def test_rows_committed_in_batches(tmp_path):
+    dbname = str(tmp_path / 'olx.db')
+    conn, writer = make_writer(dbname, maxrows=3, maxdelay=60)
+    writer.write(countquery, ('cairo', 1))
+    writer.write_many(countquery, [('giza', 2)])
+    assert count_rows(dbname) == 0
+    writer.write(countquery, ('alex', 3))
+    assert count_rows(dbname) == 3
+    assert writer.stats == {'rows': 3, 'commits': 1}
+    writer.close()
+    conn.close()
+
+
+def test_rows_committed_after_maxdelay(tmp_path, monkeypatch):
+    clock = [100.0]
+    monkeypatch.setattr(ScrapeDatabase.time, 'time', lambda: clock[0])
+    dbname = str(tmp_path / 'olx.db')
+    conn, writer = make_writer(dbname, maxrows=100, maxdelay=5)
+    writer.write(countquery, ('cairo', 1))
+    clock[0] = 105.0
+    writer.write(countquery, ('giza', 2))
+    assert count_rows(dbname) == 2
+    writer.close()
+    conn.close()
+
+
+def test_synced_rows_read_back_before_commit(tmp_path):
+    dbname = str(tmp_path / 'olx.db')
+    conn, writer = make_writer(dbname)
+    writer.write(countquery, ('cairo', 1))
+    writer.sync()
+    assert conn.execute('''SELECT * FROM counts;''').fetchall() == [('cairo', 1)]
+    assert count_rows(dbname) == 0
+    writer.close()
+    assert count_rows(dbname) == 1
+    conn.close()
+
+
+def test_failed_write_buffered_again(tmp_path):
+    dbname = str(tmp_path / 'olx.db')
+    conn, writer = make_writer(dbname)
+    writer.write(countquery, ('cairo', 1))
+    writer.write('''INSERT INTO missing VALUES (?);''', (1,))
+    with pytest.raises(sqlite3.OperationalError):
+        writer.flush()
+    assert count_rows(dbname) == 0
+    assert [len(rows) for query, rows in writer.pending] == [1, 1]
+    conn.execute('''CREATE TABLE missing (value INTEGER);''')
+    writer.flush()
+    assert count_rows(dbname) == 1
+    writer.close()
+    conn.close()
+
+
+#a scraper that buffers a row and then waits to be stopped, or exits straight away with 'exit'
+writerscript = '''import sys, time
+from ScrapeDatabase import connect_db, BufferedWriter
+conn = connect_db(sys.argv[1])
+conn.execute("CREATE TABLE counts (fsubreg TEXT, totalposts INTEGER);")
+conn.commit()
+writer = BufferedWriter(conn, maxrows=100, maxdelay=600)
+writer.write("INSERT INTO counts VALUES (?,?);", ("cairo", 1))
+print("written", flush=True)
+if sys.argv[2] != "exit":
+    time.sleep(60)
+'''
+
+
+@pytest.mark.parametrize('stop', ['exit', 'SIGTERM', 'SIGHUP'])
+def test_rows_flushed_when_stopped(tmp_path, stop):
+    dbname = str(tmp_path / 'olx.db')
+    env = dict(os.environ, PYTHONPATH=repo)
+    process = subprocess.Popen([sys.executable, '-c', writerscript, dbname, stop], env=env, stdout=subprocess.PIPE)
+    assert process.stdout.readline() == b'written\n'
+    if stop != 'exit':
+        process.send_signal(getattr(signal, stop))
+    process.wait(timeout=30)
+    process.stdout.close()
+    assert count_rows(dbname) == 1
+
+
+def test_connection_settings(tmp_path):
+    conn = connect_db(str(tmp_path / 'olx.db'))
+    assert conn.execute('''PRAGMA journal_mode;''').fetchall()[0][0] == 'wal'
+    #NORMAL
+    assert conn.execute('''PRAGMA synchronous;''').fetchall()[0][0] == 1
+    assert conn.execute('''PRAGMA cache_size;''').fetchall()[0][0] == -ScrapeDatabase.cachesize*1024
+    assert conn.execute('''PRAGMA busy_timeout;''').fetchall()[0][0] == ScrapeDatabase.busytimeout*1000
+    #MEMORY
+    assert conn.execute('''PRAGMA temp_store;''').fetchall()[0][0] == 2
+    assert conn.execute('''SELECT textdecompress(textcompress(?));''', ('Accountant '*10,)).fetchall()[0][0] == 'Accountant '*10
+    conn.close()
+
+
+def test_read_while_writing(tmp_path):
+    dbname = str(tmp_path / 'olx.db')
+    conn, writer = make_writer(dbname)
+    writer.write(countquery, ('cairo', 1))
+    writer.flush()
+    writer.write(countquery, ('giza', 2))
+    writer.sync()
+    #an analysis script reads the committed rows while the scraper has a write open
+    reader = connect_db(dbname)
+    assert reader.execute('''SELECT * FROM counts;''').fetchall() == [('cairo', 1)]
+    reader.close()
+    writer.close()
+    conn.close()
+
+
+def test_writer_waits_on_lock(tmp_path):
+    dbname = str(tmp_path / 'olx.db')
+    conn, writer = make_writer(dbname)
+    other = connect_db(dbname, check_same_thread=False)
+    other.execute('''BEGIN IMMEDIATE;''')
+    #the other connection lets go of the write lock after a moment rather than the write failing with 'database is locked'
+    timer = threading.Timer(0.2, other.commit)
+    timer.start()
+    writer.write(countquery, ('cairo', 1))
+    writer.flush()
+    timer.join()
+    assert count_rows(dbname) == 1
+    other.close()
+    writer.close()
+    conn.close()
@@ -0,0 +1,158 @@
+#the prepare stage of FetchPipeline changes the rows before they are written, and a batch it fails on is still written.
+#The parsing processes are forked before the pipeline starts its threads.  FetchEngine caps the requests to each host
+#and hands the results back to the thread that called run(), fetch_ordered() yields the listing pages in order and
+#cancels the ones not yet started when the caller stops early
+import time
+import threading
+import multiprocessing
+from urllib.parse import urlsplit
+
+from ScrapeEngine import FetchEngine, FetchPipeline
+
+
+def fetch(n):
+    return(n,)
+
+
+def parse(n):
+    if n == 3:
+        raise ValueError('page not parsed')
+    return([n, 'AR'])
+
+
+def run_pipeline(preparefunc):
+    written = []
+    failed = []
+    pipeline = FetchPipeline(maxinflight=4, parseworkers=0, batchsize=4, reportevery=5)
+    tasks = [('https://olx.com.eg/en/ad/{}'.format(n), (n,)) for n in range(10)]
+    pipeline.run(tasks, fetch, parse, lambda batch: written.extend(row for args, row in batch), lambda args, e: failed.append(args[0]), preparefunc=preparefunc)
+    return(sorted(written), failed)
+
+
+def test_prepared_rows_are_written():
+    def translate(rows):
+        for row in rows:
+            row[1] = 'EN'
+    written, failed = run_pipeline(translate)
+    assert written == [[n, 'EN'] for n in range(10) if n != 3]
+    assert failed == [3]
+
+
+def test_rows_written_when_prepare_fails():
+    def translate(rows):
+        raise ConnectionError('translator down')
+    written, failed = run_pipeline(translate)
+    assert written == [[n, 'AR'] for n in range(10) if n != 3]
+    assert failed == [3]
+
+
+class CountingPipeline(FetchPipeline):
+
+    #the number of parsing processes already running when the writer thread starts
+    def write_rows(self, writequeue, writefunc, errorfunc, writererror):
+        self.started = len(multiprocessing.active_children())
+        return(FetchPipeline.write_rows(self, writequeue, writefunc, errorfunc, writererror))
+
+
+def test_parse_processes_forked_before_the_threads():
+    written = []
+    pipeline = CountingPipeline(maxinflight=4, parseworkers=2, batchsize=4, reportevery=5)
+    tasks = [('https://olx.com.eg/en/ad/{}'.format(n), (n,)) for n in range(4)]
+    pipeline.run(tasks, fetch, abs, lambda batch: written.extend(row for args, row in batch))
+    assert pipeline.started == 2
+    assert sorted(written) == [0, 1, 2, 3]
+
+
+class HostCounter:
+
+    #a page function that records the most requests it had running at once, to each host and in all
+    def __init__(self, delay=0.02):
+        self.delay = delay
+        self.lock = threading.Lock()
+        self.running = {}
+        self.most = {}
+        self.threads = set()
+
+    def fetch(self, url):
+        host = urlsplit(url).netloc
+        with self.lock:
+            self.running[host] = self.running.get(host, 0) + 1
+            self.running['all'] = self.running.get('all', 0) + 1
+            for key in [host, 'all']:
+                self.most[key] = max(self.most.get(key, 0), self.running[key])
+            self.threads.add(threading.current_thread())
+        time.sleep(self.delay)
+        with self.lock:
+            self.running[host] -= 1
+            self.running['all'] -= 1
+        if url.endswith('/bad'):
+            raise ValueError('page not parsed')
+        return(url)
+
+
+def test_requests_capped_per_host():
+    counter = HostCounter()
+    written = []
+    engine = FetchEngine(maxinflight=6, perhostlimit=2)
+    tasks = [('https://{}/ad/{}'.format(host, n), ('https://{}/ad/{}'.format(host, n),)) for n in range(6) for host in ['olx.com.eg', 'wuzzuf.net', 'google.com']]
+    assert engine.run(tasks, counter.fetch, lambda args, result: written.append(result)) == 18
+    assert sorted(written) == sorted(url for url, args in tasks)
+    assert counter.most == {'olx.com.eg': 2, 'wuzzuf.net': 2, 'google.com': 2, 'all': 6}
+
+
+def test_rows_written_in_calling_thread():
+    counter = HostCounter()
+    writers = set()
+    failed = []
+    engine = FetchEngine(maxinflight=4, perhostlimit=4)
+    urls = ['https://olx.com.eg/ad/{}'.format(n) for n in range(5)] + ['https://olx.com.eg/bad']
+    completed = engine.run([(url, (url,)) for url in urls], counter.fetch, lambda args, result: writers.add(threading.current_thread()), lambda args, e: failed.append(args[0]))
+    assert completed == 5
+    assert writers == {threading.current_thread()}
+    assert threading.current_thread() not in counter.threads
+    assert failed == ['https://olx.com.eg/bad']
+    assert engine.stats['errors'] == 1
+
+
+def test_tasks_taken_as_they_are_needed():
+    taken = []
+    def tasks():
+        for n in range(10):
+            taken.append(n)
+            yield(('https://olx.com.eg/ad/{}'.format(n), (n,)))
+    #only maxinflight tasks are taken ahead, so the run budget can stop the rest from being started
+    written = []
+    def write(args, result):
+        written.append(result)
+        if len(written) == 1:
+            assert len(taken) <= 3
+    engine = FetchEngine(maxinflight=2)
+    engine.run(tasks(), lambda n: n, write)
+    assert sorted(written) == list(range(10))
+
+
+def test_listing_pages_in_order():
+    #the later pages come back first
+    def fetch(page):
+        time.sleep(0.01*(5 - page))
+        return(page)
+    engine = FetchEngine(maxinflight=5)
+    tasks = [('https://olx.com.eg/en/jobs/?page={}'.format(p), (p,)) for p in range(1, 6)]
+    assert list(engine.fetch_ordered(tasks, fetch)) == [1, 2, 3, 4, 5]
+
+
+def test_pages_not_needed_cancelled():
+    fetched = []
+    def fetch(page):
+        fetched.append(page)
+        time.sleep(0.01)
+        return(page)
+    engine = FetchEngine(maxinflight=1)
+    tasks = [('https://olx.com.eg/en/jobs/?page={}'.format(p), (p,)) for p in range(1, 7)]
+    pages = engine.fetch_ordered(tasks, fetch)
+    for page in pages:
+        #the ads on the first page are already older than the last download
+        pages.close()
+        break
+    assert len(fetched) <= 2
+    assert engine.stats['cancelled'] == 6 - len(fetched)
@@ -0,0 +1,177 @@
+#a unit of the crawl frontier is handed to one run at a time, is handed out again once its lease runs out or it
+#fails, the units an earlier day did not get to are carried over to the next day once, and a unit is only marked done
+#in the database along with the rows written for it.  The run budget stops new work at the deadline or after the
+#maximum number of requests
+import sqlite3
+import datetime
+
+import pytest
+
+import ScrapeFrontier as frontiermodule
+from ScrapeDatabase import BufferedWriter
+from ScrapeFrontier import CrawlFrontier, RunBudget, get_deadline
+
+
+def test_units_leased_once(tmp_path):
+    conn = sqlite3.connect(str(tmp_path / 'frontier.db'))
+    frontier = CrawlFrontier(conn, '2018-01-02')
+    assert frontier.add('subregion', [('cairo', ['Cairo']), ('giza', ['Giza'])]) == 2
+    #the same work added again by a restarted run is left as it is
+    assert frontier.add('subregion', [('cairo', ['Cairo'])]) == 0
+    assert frontier.lease('subregion', limit=1) == [('cairo', ['Cairo'])]
+    assert frontier.lease('subregion') == [('giza', ['Giza'])]
+    assert frontier.lease('subregion') == []
+    frontier.complete('subregion', 'cairo')
+    frontier.complete('subregion', 'giza')
+    assert frontier.counts('subregion') == {'done': 2}
+    conn.close()
+
+
+def test_lease_runs_out(tmp_path):
+    conn = sqlite3.connect(str(tmp_path / 'frontier.db'))
+    frontier = CrawlFrontier(conn, '2018-01-02', leaseseconds=-1, maxattempts=2)
+    frontier.add('addetail', [(1, [1])])
+    assert frontier.lease('addetail') == [('1', [1])]
+    #the run holding the unit died, so the next run takes it again until it is out of attempts
+    assert frontier.lease('addetail') == [('1', [1])]
+    assert frontier.lease('addetail') == []
+    assert frontier.counts('addetail') == {'failed': 1}
+    conn.close()
+
+
+def test_failed_unit_retried(tmp_path):
+    conn = sqlite3.connect(str(tmp_path / 'frontier.db'))
+    frontier = CrawlFrontier(conn, '2018-01-02', maxattempts=2)
+    frontier.add('addetail', [(1, [1])])
+    frontier.lease('addetail')
+    frontier.fail('addetail', 1)
+    assert frontier.lease('addetail') == [('1', [1])]
+    frontier.fail('addetail', 1)
+    assert frontier.lease('addetail') == []
+    assert frontier.counts('addetail') == {'failed': 1}
+    conn.close()
+
+
+def test_released_unit_keeps_its_attempts(tmp_path):
+    conn = sqlite3.connect(str(tmp_path / 'frontier.db'))
+    frontier = CrawlFrontier(conn, '2018-01-02', maxattempts=1)
+    frontier.add('addetail', [(1, [1])])
+    frontier.lease('addetail')
+    frontier.release('addetail', [1])
+    assert frontier.counts('addetail') == {'pending': 1}
+    assert frontier.lease('addetail') == [('1', [1])]
+    conn.close()
+
+
+def test_restarted_run_resumes(tmp_path):
+    dbname = str(tmp_path / 'frontier.db')
+    conn = sqlite3.connect(dbname)
+    frontier = CrawlFrontier(conn, '2018-01-02')
+    frontier.add('subregion', [('cairo', ['Cairo']), ('giza', ['Giza'])])
+    frontier.lease('subregion')
+    frontier.complete('subregion', 'cairo')
+    frontier.release('subregion', ['giza'])
+    frontier.commit()
+    conn.close()
+
+    conn = sqlite3.connect(dbname)
+    frontier = CrawlFrontier(conn, '2018-01-02')
+    frontier.add('subregion', [('cairo', ['Cairo']), ('giza', ['Giza'])])
+    assert frontier.lease('subregion') == [('giza', ['Giza'])]
+    conn.close()
+
+
+def test_carry_over(tmp_path):
+    conn = sqlite3.connect(str(tmp_path / 'frontier.db'))
+    frontier = CrawlFrontier(conn, '2018-01-01')
+    frontier.add('addetail', [(1, [1]), (2, [2]), (3, [3])])
+    frontier.lease('addetail', limit=2)
+    frontier.complete('addetail', 1)
+    frontier.commit()
+
+    frontier = CrawlFrontier(conn, '2018-01-02')
+    #the unit still leased by the run that ran out of time and the one it never got to
+    assert frontier.carry_over('addetail') == [('2', [2]), ('3', [3])]
+    assert frontier.carry_over('addetail') == []
+    assert frontier.lease('addetail') == []
+    conn.close()
+
+
+def test_old_frontiers_deleted(tmp_path):
+    conn = sqlite3.connect(str(tmp_path / 'frontier.db'))
+    frontier = CrawlFrontier(conn, '2018-01-01')
+    frontier.add('addetail', [(1, [1])])
+    frontier = CrawlFrontier(conn, '2018-01-20', keepdays=7)
+    assert frontier.carry_over('addetail') == []
+    assert conn.execute('''SELECT COUNT(*) FROM crawlfrontier;''').fetchall()[0][0] == 0
+    conn.close()
+
+
+def test_completed_with_the_rows(tmp_path):
+    conn = sqlite3.connect(str(tmp_path / 'frontier.db'))
+    conn.execute('''CREATE TABLE counts (fsubreg TEXT, totalposts INTEGER);''')
+    writer = BufferedWriter(conn)
+    frontier = CrawlFrontier(conn, '2018-01-02', writer=writer)
+    frontier.add('subregion', [('cairo', ['Cairo'])])
+    frontier.lease('subregion')
+    writer.write('''INSERT INTO counts VALUES (?,?);''', ('cairo', 12))
+    frontier.complete('subregion', 'cairo')
+    #neither is in the database until the writer is flushed
+    other = sqlite3.connect(str(tmp_path / 'frontier.db'))
+    assert other.execute('''SELECT status FROM crawlfrontier;''').fetchall() == [('leased',)]
+    writer.flush()
+    assert other.execute('''SELECT status FROM crawlfrontier;''').fetchall() == [('done',)]
+    assert other.execute('''SELECT * FROM counts;''').fetchall() == [('cairo', 12)]
+    other.close()
+    writer.close()
+    conn.close()
+
+
+class CountingSession:
+
+    def __init__(self):
+        self.stats = {'requests': 0}
+
+
+def test_budget_stops_at_max_requests():
+    session = CountingSession()
+    budget = RunBudget(session, maxrequests=3)
+    taken = []
+    for item in budget.take(range(10)):
+        taken.append(item)
+        session.stats['requests'] += 1
+    assert taken == [0, 1, 2]
+    assert budget.reason == 'request budget'
+    #once reached the budget stays exhausted
+    assert list(budget.take(range(10))) == []
+
+
+def test_budget_stops_at_deadline(monkeypatch):
+    clock = [100.0]
+    monkeypatch.setattr(frontiermodule.time, 'time', lambda: clock[0])
+    budget = RunBudget(CountingSession(), deadline=110.0)
+    assert not budget.exhausted()
+    clock[0] = 110.0
+    assert budget.exhausted()
+    assert budget.reason == 'deadline'
+
+
+def test_budget_without_limits():
+    budget = RunBudget(CountingSession())
+    assert list(budget.take(range(5))) == [0, 1, 2, 3, 4]
+    assert not budget.exhausted()
+
+
+def test_deadline_in_minutes(monkeypatch):
+    monkeypatch.setattr(frontiermodule.time, 'time', lambda: 1000.0)
+    now = datetime.datetime(2018, 1, 2, 6, 0, tzinfo=datetime.timezone.utc)
+    assert get_deadline(None, now) is None
+    assert get_deadline('90', now) == 1000.0 + 90*60
+
+
+@pytest.mark.parametrize('value, hours', [('08:30', 2.5), ('06:00', 24), ('05:00', 23)])
+def test_deadline_at_clock_time(monkeypatch, value, hours):
+    monkeypatch.setattr(frontiermodule.time, 'time', lambda: 1000.0)
+    now = datetime.datetime(2018, 1, 2, 6, 0, tzinfo=datetime.timezone.utc)
+    #a time that has already passed today is the time tomorrow
+    assert get_deadline(value, now) == 1000.0 + hours*3600
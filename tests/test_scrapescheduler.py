@@ -0,0 +1,81 @@
+#the revisit scheduler visits an ad again sooner the faster its counters change, fills the budget with the new ads
+#first, then the ads not visited for maxinterval days, then the largest expected change
+import datetime
+
+from ScrapeScheduler import RevisitScheduler, to_date
+
+today = datetime.date(2018, 1, 10)
+
+
+#FUNCTION: a scheduler with the ads {adid: (postdate, [(downloaddate, value)])}
+def make_scheduler(ads, **kwargs):
+    scheduler = RevisitScheduler(**kwargs)
+    for adid, (postdate, snapshots) in ads.items():
+        scheduler.add_ad(adid, postdate, adid)
+        for downloaddate, value in snapshots:
+            scheduler.add_snapshot(adid, downloaddate, value)
+    return(scheduler)
+
+
+def test_velocity_of_one_visit():
+    scheduler = make_scheduler({1: ('2018-01-01', [('2018-01-05', 40)])})
+    assert scheduler.get_velocity(1, to_date('2018-01-01')) == (10.0, datetime.date(2018, 1, 5))
+
+
+def test_velocity_smoothed_over_visits():
+    scheduler = make_scheduler({1: ('2018-01-01', [('2018-01-02', 10), ('2018-01-04', 50), ('2018-01-05', 50)])}, smoothing=0.5)
+    #10 a day, then 20 a day, then no change
+    velocity, lastvisit = scheduler.get_velocity(1, to_date('2018-01-01'))
+    assert velocity == 0.5*0 + 0.5*(0.5*20 + 0.5*10)
+    assert lastvisit == datetime.date(2018, 1, 5)
+
+
+def test_counters_going_down_are_no_change():
+    scheduler = make_scheduler({1: ('2018-01-01', [('2018-01-02', 10), ('2018-01-03', 4)])}, smoothing=1)
+    assert scheduler.get_velocity(1, to_date('2018-01-01'))[0] == 0
+
+
+def test_interval_from_velocity():
+    scheduler = RevisitScheduler(mininterval=1, maxinterval=28, mindelta=5)
+    lastvisit = datetime.date(2018, 1, 1)
+    assert scheduler.get_nextvisit(10.0, lastvisit) == datetime.date(2018, 1, 2)
+    assert scheduler.get_nextvisit(1.0, lastvisit) == datetime.date(2018, 1, 6)
+    assert scheduler.get_nextvisit(0.1, lastvisit) == datetime.date(2018, 1, 29)
+    assert scheduler.get_nextvisit(0.0, lastvisit) == datetime.date(2018, 1, 29)
+
+
+def test_fast_ads_revisited_first():
+    ads = {'fast': ('2018-01-01', [('2018-01-08', 700), ('2018-01-09', 800)]),
+           'slow': ('2018-01-01', [('2018-01-08', 7), ('2018-01-09', 8)]),
+           'dormant': ('2017-11-01', [('2017-12-01', 0), ('2017-12-20', 0)])}
+    scheduler = make_scheduler(ads)
+    #the slow ad is not due for another few days and the dormant ad is only checked every maxinterval days
+    assert scheduler.schedule(today) == ['fast']
+    assert scheduler.schedule(datetime.date(2018, 1, 15)) == ['fast', 'slow']
+    assert scheduler.schedule(datetime.date(2018, 1, 9)) == []
+    assert scheduler.schedule(datetime.date(2018, 1, 17)) == ['dormant', 'fast', 'slow']
+
+
+def test_budget_order():
+    ads = {'new': ('2018-01-09', []),
+           'overdue': ('2017-11-01', [('2017-12-01', 50), ('2017-12-12', 50)]),
+           'fast': ('2018-01-01', [('2018-01-08', 700), ('2018-01-09', 800)]),
+           'faster': ('2018-01-01', [('2018-01-08', 700), ('2018-01-09', 900)])}
+    assert make_scheduler(ads).schedule(today) == ['new', 'overdue', 'faster', 'fast']
+    assert make_scheduler(ads, budget=2).schedule(today) == ['new', 'overdue']
+
+
+def test_snapshots_ignored():
+    scheduler = make_scheduler({1: ('2018-01-01', [('2018-01-05', None), ('2018-01-06', 'n/a'), ('2018-01-07', float('nan'))])})
+    #an ad that is not open any more
+    scheduler.add_snapshot(2, '2018-01-05', 10)
+    assert scheduler.snapshots == {}
+    assert scheduler.schedule(today) == [1]
+
+
+def test_stored_dates():
+    assert to_date('2017-12-5') == datetime.date(2017, 12, 5)
+    assert to_date('2017-12-05 00:00:00') == datetime.date(2017, 12, 5)
+    assert to_date(datetime.datetime(2017, 12, 5, 10, 30)) == datetime.date(2017, 12, 5)
+    assert to_date('Dec 5') is None
+    assert to_date(None) is None
@@ -0,0 +1,277 @@
+#RetryPolicy only takes a 404/410 as a page that is gone, retries the transient errors and raises everything else.
+#RateLimiter ramps the rate of each host up while it responds well and backs off when it fails or slows down, and
+#CircuitBreaker holds back the requests to a host that keeps failing for a cool down that doubles while it is down.
+#HTTPSession keeps its connections to a site alive between requests and otherwise answers like urlopen
+import gzip
+import zlib
+import socket
+import threading
+import urllib.error
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import pytest
+
+import ScrapeSession as session
+from ScrapeSession import RetryPolicy, CircuitBreaker, CircuitOpenError, RateLimiter, HTTPSession
+
+
+class FailingSession:
+
+    def __init__(self, errors):
+        self.errors = list(errors)
+        self.requests = 0
+
+    def get(self, url):
+        self.requests += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        return('page')
+
+
+def http_error(code):
+    return(urllib.error.HTTPError('https://olx.com.eg/ad/1', code, 'error', None, None))
+
+
+@pytest.mark.parametrize('code', [404, 410])
+def test_gone_page(code):
+    session = FailingSession([http_error(code)])
+    policy = RetryPolicy(session, basedelay=0)
+    assert policy.get('https://olx.com.eg/ad/1') is None
+    assert session.requests == 1
+    assert policy.stats['permanent'] == 1
+
+
+@pytest.mark.parametrize('code', [403, 408, 429, 500, 503])
+def test_transient_status_is_retried(code):
+    session = FailingSession([http_error(code), http_error(code)])
+    policy = RetryPolicy(session, basedelay=0)
+    assert policy.get('https://olx.com.eg/ad/1') == 'page'
+    assert session.requests == 3
+    assert policy.stats['permanent'] == 0
+
+
+def test_blocked_page_is_not_gone():
+    session = FailingSession([http_error(403)]*3)
+    policy = RetryPolicy(session, maxattempts=3, basedelay=0)
+    with pytest.raises(urllib.error.HTTPError):
+        policy.get('https://olx.com.eg/ad/1')
+    assert policy.stats['gaveup'] == 1
+
+
+@pytest.mark.parametrize('error', [http_error(400), ValueError('bad content'), KeyError('Location')])
+def test_unexpected_error_is_raised(error):
+    session = FailingSession([error])
+    policy = RetryPolicy(session, basedelay=0)
+    with pytest.raises(type(error)):
+        policy.get('https://olx.com.eg/ad/1')
+    assert session.requests == 1
+    assert policy.stats['permanent'] == 0
+
+
+def test_blocked_host_opens_breaker():
+    breaker = CircuitBreaker(threshold=3, cooldown=30)
+    for i in range(3):
+        breaker.record('olx.com.eg', 403)
+    assert breaker.stats['opened'] == 1
+    breaker.record('olx.com.eg', 404)
+    assert breaker.hosts['olx.com.eg']['failures'] == 0
+
+
+def test_blocked_host_slows_rate():
+    limiter = RateLimiter(rate=2.0)
+    limiter.record('olx.com.eg', 403, 0.1)
+    assert limiter.hosts['olx.com.eg']['rate'] == 1.0
+
+
+class FakeClock:
+
+    #time.monotonic and time.sleep of ScrapeSession, sleeping moves the clock on
+    def __init__(self, monkeypatch):
+        self.now = 1000.0
+        self.slept = []
+        monkeypatch.setattr(session.time, 'monotonic', lambda: self.now)
+        monkeypatch.setattr(session.time, 'sleep', self.sleep)
+
+    def sleep(self, seconds):
+        self.slept.append(seconds)
+        self.now += seconds
+
+
+def test_rate_ramps_up_to_maxrate():
+    limiter = RateLimiter(rate=2.0, maxrate=2.5, rampstep=0.1)
+    for i in range(3):
+        limiter.record('olx.com.eg', 200, 0.1)
+    assert limiter.hosts['olx.com.eg']['rate'] == pytest.approx(2.3)
+    for i in range(10):
+        limiter.record('olx.com.eg', 200, 0.1)
+    assert limiter.hosts['olx.com.eg']['rate'] == 2.5
+
+
+@pytest.mark.parametrize('status', [None, 429, 500, 503])
+def test_rate_backs_off_to_minrate(status):
+    limiter = RateLimiter(rate=2.0, minrate=0.4, backoff=0.5)
+    limiter.record('olx.com.eg', status, 0.1)
+    assert limiter.hosts['olx.com.eg']['rate'] == 1.0
+    for i in range(5):
+        limiter.record('olx.com.eg', status, 0.1)
+    assert limiter.hosts['olx.com.eg']['rate'] == 0.4
+    assert limiter.stats['backoffs'] == 6
+
+
+def test_gone_page_does_not_slow_rate():
+    limiter = RateLimiter(rate=2.0, rampstep=0.1)
+    limiter.record('olx.com.eg', 404, 0.1)
+    assert limiter.hosts['olx.com.eg']['rate'] == pytest.approx(2.1)
+
+
+def test_slow_response_slows_rate():
+    limiter = RateLimiter(rate=2.0, rampstep=0.1, backoff=0.5, spikefactor=3.0, minspike=1.0)
+    limiter.record('olx.com.eg', 200, 0.5)
+    #slower than 3 times the average, but not than minspike
+    limiter.record('olx.com.eg', 200, 0.9)
+    assert limiter.hosts['olx.com.eg']['rate'] == pytest.approx(2.2)
+    limiter.record('olx.com.eg', 200, 3.0)
+    assert limiter.hosts['olx.com.eg']['rate'] == pytest.approx(2.2*0.75)
+
+
+def test_requests_spaced_by_rate(monkeypatch):
+    clock = FakeClock(monkeypatch)
+    limiter = RateLimiter(rate=4.0, burst=2)
+    for i in range(4):
+        limiter.acquire('olx.com.eg')
+    #the burst goes straight away, then one request every 1/rate seconds
+    assert clock.slept == [0.25, 0.25]
+    #each host has a bucket of its own
+    limiter.acquire('wuzzuf.net')
+    assert clock.slept == [0.25, 0.25]
+
+
+def test_open_breaker_waits_out_cooldown(monkeypatch):
+    clock = FakeClock(monkeypatch)
+    breaker = CircuitBreaker(threshold=2, cooldown=30)
+    breaker.record('olx.com.eg', None)
+    breaker.acquire('olx.com.eg')
+    assert clock.slept == []
+    breaker.record('olx.com.eg', 503)
+    breaker.acquire('olx.com.eg')
+    assert clock.slept == [30]
+    #other hosts are not held back
+    breaker.acquire('wuzzuf.net')
+    assert clock.slept == [30]
+
+
+def test_cooldown_doubles_until_host_recovers(monkeypatch):
+    clock = FakeClock(monkeypatch)
+    breaker = CircuitBreaker(threshold=1, cooldown=30, maxcooldown=100)
+    for i in range(4):
+        breaker.acquire('olx.com.eg')
+        breaker.record('olx.com.eg', 429)
+    breaker.acquire('olx.com.eg')
+    assert clock.slept == [30, 60, 100, 100]
+    breaker.record('olx.com.eg', 200)
+    assert breaker.hosts['olx.com.eg']['cooldown'] == 30
+    breaker.record('olx.com.eg', 429)
+    breaker.acquire('olx.com.eg')
+    assert clock.slept[-1] == 30
+
+
+def test_breaker_refuses_after_maxpause(monkeypatch):
+    clock = FakeClock(monkeypatch)
+    breaker = CircuitBreaker(threshold=1, cooldown=30, maxpause=50)
+    breaker.record('olx.com.eg', 403)
+    breaker.acquire('olx.com.eg')
+    breaker.record('olx.com.eg', 403)
+    #paused for 30 + 60 seconds, so the run goes on without the host while it is down
+    with pytest.raises(CircuitOpenError):
+        breaker.acquire('olx.com.eg')
+    assert breaker.stats['rejected'] == 1
+    clock.now += 60
+    breaker.acquire('olx.com.eg')
+
+
+class SiteHandler(BaseHTTPRequestHandler):
+
+    #answers on keep-alive connections like the website does, /close closes the connection after the page
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        headers = {}
+        status, body = 200, b'page ' + self.path.encode('utf-8')
+        if self.path == '/gzip':
+            headers['Content-Encoding'] = 'gzip'
+            body = gzip.compress(body)
+        elif self.path == '/deflate':
+            headers['Content-Encoding'] = 'deflate'
+            body = zlib.compress(body)
+        elif self.path == '/moved':
+            status, body = 302, b''
+            headers['Location'] = '/ad/1?page=2'
+        elif self.path == '/gone':
+            status, body = 404, b''
+        elif self.path == '/close':
+            headers['Connection'] = 'close'
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def site():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), SiteHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield('http://127.0.0.1:{}'.format(server.server_address[1]))
+    server.shutdown()
+    server.server_close()
+
+
+def test_connections_reused(site):
+    client = HTTPSession(timeout=5)
+    for i in range(5):
+        assert client.get(site + '/ad/{}'.format(i)).read() == 'page /ad/{}'.format(i).encode('utf-8')
+    assert client.stats == {'requests': 5, 'opened': 1, 'reused': 4}
+    #a connection the server closes is not put back in the pool
+    client.get(site + '/close')
+    client.get(site + '/ad/1')
+    assert client.stats['opened'] == 2
+    client.close()
+
+
+def test_idle_connection_closed_by_server(site):
+    client = HTTPSession(timeout=5)
+    client.get(site + '/ad/1')
+    #the server drops the connection while it sits in the pool
+    for connection in client.idle[('http', site[len('http://'):])]:
+        connection.sock.shutdown(socket.SHUT_RDWR)
+    assert client.get(site + '/ad/2').read() == b'page /ad/2'
+    assert client.stats['opened'] == 2
+    client.close()
+
+
+@pytest.mark.parametrize('path', ['/gzip', '/deflate'])
+def test_compressed_pages_decoded(site, path):
+    client = HTTPSession(timeout=5)
+    assert client.get(site + path).read() == b'page ' + path.encode('utf-8')
+    client.close()
+
+
+def test_redirects_and_errors_like_urlopen(site):
+    client = HTTPSession(timeout=5)
+    response = client.get(site + '/moved')
+    assert (response.getcode(), response.geturl(), response.read()) == (200, site + '/ad/1?page=2', b'page /ad/1?page=2')
+    with pytest.raises(urllib.error.HTTPError) as error:
+        client.get(site + '/gone')
+    assert error.value.code == 404
+    client.close()
+
+
+def test_requests_sent_to_rewritten_site(site):
+    client = HTTPSession(timeout=5, rewrites={'https://olx.com.eg': site})
+    assert client.get('https://olx.com.eg/en/ad/1').read() == b'page /en/ad/1'
+    client.close()
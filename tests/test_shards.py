@@ -0,0 +1,66 @@
+#two shards crawl two days in a row against LocalTestServer.py.  The ads found on the first day by one shard's
+#listings whose ids fall in the other shard are revisited by that shard on the second day, as MergeOLXShards.py
+#copies the merged database over the shards
+import os
+import zlib
+import datetime
+
+from olxsite import repo, today, fsub, sitemap_page, subregion_page, listing_pages, ad_page, write_pages, free_port, start_server, run, get_visits
+
+regions = {'Cairo': ['Maadi', 'Heliopolis', 'Nasr City'], 'Giza': ['Dokki', 'Haram']}
+
+
+def in_shard(key, shard):
+    return(zlib.crc32(str(key).encode('utf-8')) % 2 == shard)
+
+
+#FUNCTION: the open ads of each subregion on the given day (0 is the unsharded first crawl), as (id, postdate).
+#Every day adds new ads so that the shards find ads that fall in the other shard
+def get_ads(day):
+    ads = {}
+    for k, subregion in enumerate(sorted(s for subregions in regions.values() for s in subregions)):
+        ads[fsub(subregion)] = [(200000 + 100*k + i, today + datetime.timedelta(days=min(i//3, day))) for i in range(3*(day + 1))]
+    return(ads)
+
+
+#FUNCTION: stores the pages of the site on the given day in the page store served by LocalTestServer.py
+def write_site(tmp_path, day):
+    ads = get_ads(day)
+    pages = {'/en/sitemap/regions/': sitemap_page(regions)}
+    for f, subregionads in ads.items():
+        pages['/en/jobs-services/{}/'.format(f)] = subregion_page(f, {'Sales': len(subregionads)})
+        pages.update(listing_pages(f, 'Sales', sorted(subregionads, key=lambda ad: ad[1], reverse=True)))
+        for uniqueadid, postdate in subregionads:
+            #enough page views a day for the revisit scheduler to fetch every ad every day
+            pages.update(ad_page(uniqueadid, postdate, 100*(day + 1)))
+    write_pages(tmp_path, pages, day)
+
+
+def crawl(tmp_path, port, day, shards):
+    write_site(tmp_path, day)
+    server = start_server(tmp_path, port)
+    try:
+        scraper = os.path.join(repo, 'ScrapeEgyptOLX_cloudv2.py')
+        if shards is None:
+            run(tmp_path, [scraper, '--base-url', 'http://127.0.0.1:{}'.format(port)], day)
+        else:
+            for shard in range(shards):
+                run(tmp_path, [scraper, '--base-url', 'http://127.0.0.1:{}'.format(port), '--shard', '{}/{}'.format(shard, shards)], day)
+            run(tmp_path, [os.path.join(repo, 'MergeOLXShards.py')] + ['egyptOLX_shard{}.db'.format(shard) for shard in range(shards)])
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def test_two_days_two_shards(tmp_path):
+    #the ads added on day 1 that are listed in a subregion of one shard but fall in the other
+    crossing = [uniqueadid for f, subregionads in get_ads(1).items() for uniqueadid, postdate in subregionads[3:] if in_shard(f, 0) != in_shard(uniqueadid, 0)]
+    assert len(crossing) > 0
+
+    port = free_port()
+    crawl(tmp_path, port, 0, None)
+    for day in [1, 2]:
+        crawl(tmp_path, port, day, 2)
+        #every open ad on the site is fetched by one of the shards each day
+        expected = set(uniqueadid for subregionads in get_ads(day).values() for uniqueadid, postdate in subregionads)
+        assert get_visits(tmp_path, day) == expected
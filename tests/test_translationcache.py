@@ -0,0 +1,62 @@
+#the texts joined into one request are split back apart whatever they hold, the cache falls back to one request per
+#text when the translator loses the markers, and the least recently used translations are evicted first
+import TranslationCache as cache
+from TranslationCache import TranslationCache
+
+
+class LineTranslator:
+
+    #translates every line but the markers, or drops the markers too with dropmarkers
+    def __init__(self, dropmarkers=False):
+        self.dropmarkers = dropmarkers
+        self.requests = []
+
+    def translate(self, text, dest='en'):
+        self.requests.append(text)
+        lines = []
+        for line in text.split('\n'):
+            if line == cache.marker:
+                if not self.dropmarkers:
+                    lines.append(line)
+            else:
+                lines.append('EN:' + line)
+        return(cache.StubTranslation('\n'.join(lines), dest))
+
+
+def test_texts_joined_into_one_request(tmp_path):
+    translator = LineTranslator()
+    translationcache = TranslationCache(str(tmp_path / 'translations.db'), translator)
+    texts = ['a > b', 'one\n###\ntwo', 'x' + cache.marker + 'y', float('nan')]
+    translated = translationcache.translate_many(texts)
+    assert translated[:3] == ['EN:a > b', 'EN:one\nEN:###\nEN:two', 'EN:xy']
+    assert translated[3] != translated[3]
+    assert len(translator.requests) == 1
+    translationcache.close()
+
+
+def test_one_request_per_text_without_markers(tmp_path):
+    translator = LineTranslator(dropmarkers=True)
+    translationcache = TranslationCache(str(tmp_path / 'translations.db'), translator)
+    assert translationcache.translate_many(['a', 'b', 'c']) == ['EN:a', 'EN:b', 'EN:c']
+    assert len(translator.requests) == 4
+    assert translationcache.stats['split'] == 1
+    translationcache.close()
+
+
+def test_least_recently_used_evicted(tmp_path, monkeypatch):
+    clock = iter(range(1000))
+    monkeypatch.setattr(cache.time, 'time', lambda: next(clock))
+    translator = LineTranslator()
+    translationcache = TranslationCache(str(tmp_path / 'translations.db'), translator, maxentries=2)
+    translationcache.translate('first')
+    translationcache.translate('second')
+    #first is used again, so second is the least recently used when third is added
+    translationcache.translate('first')
+    translationcache.translate('third')
+    assert translationcache.stats['evicted'] == 1
+    requests = len(translator.requests)
+    assert translationcache.translate_many(['first', 'third']) == ['EN:first', 'EN:third']
+    assert len(translator.requests) == requests
+    translationcache.translate('second')
+    assert len(translator.requests) == requests + 1
+    translationcache.close()